@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'gestion_stages.settings')
+# Vues async pour les lectures, dépôts et téléchargements (voir stages.urls)
+os.environ.setdefault('STAGES_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
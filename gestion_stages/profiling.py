@@ -0,0 +1,346 @@
+"""
+Instrumentation des requêtes, activée par STAGES_PROFILING.
+
+Pour chaque requête : durée totale, nombre et durée des requêtes SQL,
+durée de l'encodage JSON et octets envoyés. Le résultat part dans l'en-tête
+Server-Timing et alimente des histogrammes Prometheus par nom d'URL, exposés
+sur /metrics. Une fraction STAGES_PROFILING_SAMPLE_RATE des requêtes passe
+sous cProfile ; le profil est écrit dans STAGES_PROFILING_DIR si la requête
+a duré plus de STAGES_PROFILING_SLOW_MS.
+
+Désactivé, le middleware se retire de la chaîne (MiddlewareNotUsed) : aucun
+coût par requête. /metrics expose aussi l'état des pools de connexions
+PostgreSQL (connexions prêtées, attentes) ; sans profilage ni pool, il
+répond 404.
+
+Les métriques sont propres à chaque processus : avec plusieurs workers,
+Prometheus doit interroger chacun d'eux (ou passer par un agrégateur).
+"""
+import cProfile
+import contextvars
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import Http404, HttpResponse
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+
+# Mesures de la requête en cours ; suit la requête dans les threads de
+# sync_to_async (vues async), qui copient le contexte
+_current = contextvars.ContextVar('stages_request_stats', default=None)
+
+
+def enabled():
+    return getattr(settings, 'STAGES_PROFILING', False)
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db_time', 'json_time', 'bytes')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.json_time = 0.0
+        self.bytes = 0
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, view, value):
+        counts, total = self.series.get(view, (None, 0))
+        if counts is None:
+            counts = [0] * (len(self.buckets) + 1)
+        counts[bisect_left(self.buckets, value)] += 1
+        self.series[view] = (counts, total + value)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for view, (counts, total) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{view="{view}",le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{view="{view}"}} {total}')
+            lines.append(f'{self.name}_count{{view="{view}"}} {cumulative}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {
+            'duration': Histogram('stages_request_duration_seconds', "Durée des requêtes par vue.", DURATION_BUCKETS),
+            'queries': Histogram('stages_db_queries', "Requêtes SQL par requête HTTP.", QUERY_BUCKETS),
+            'db_time': Histogram('stages_db_duration_seconds', "Temps passé en base par requête HTTP.", DURATION_BUCKETS),
+            'json_time': Histogram('stages_serialization_duration_seconds', "Temps d'encodage JSON par requête HTTP.", DURATION_BUCKETS),
+            'bytes': Histogram('stages_response_bytes', "Octets envoyés par requête HTTP.", SIZE_BUCKETS),
+        }
+        self.statuses = {}
+
+    def record(self, view, status, duration, stats):
+        with self.lock:
+            self.histograms['duration'].observe(view, duration)
+            self.histograms['queries'].observe(view, stats.queries)
+            self.histograms['db_time'].observe(view, stats.db_time)
+            self.histograms['json_time'].observe(view, stats.json_time)
+            self.histograms['bytes'].observe(view, stats.bytes)
+            key = (view, status)
+            self.statuses[key] = self.statuses.get(key, 0) + 1
+
+    def render(self):
+        with self.lock:
+            lines = ['# HELP stages_requests_total Requêtes par vue et code de réponse.',
+                     '# TYPE stages_requests_total counter']
+            for (view, status), count in sorted(self.statuses.items()):
+                lines.append(f'stages_requests_total{{view="{view}",status="{status}"}} {count}')
+            for histogram in self.histograms.values():
+                lines.extend(histogram.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def pool_stats():
+    """
+    État des pools psycopg du processus, par alias : taille, connexions
+    prêtées et libres, requêtes en attente, et cumuls depuis l'ouverture
+    (demandes, temps d'attente, délais dépassés, connexions perdues).
+    """
+    result = {}
+    for alias in connections:
+        pool = getattr(connections[alias], 'pool', None)
+        if pool is None or pool.closed:
+            # Pas de pool, ou pas encore ouvert (aucune connexion demandée)
+            continue
+        raw = pool.get_stats()
+        size, available = raw.get('pool_size', 0), raw.get('pool_available', 0)
+        result[alias] = {
+            'min': raw.get('pool_min', 0),
+            'max': raw.get('pool_max', 0),
+            'size': size,
+            'in_use': size - available,
+            'available': available,
+            'waiting': raw.get('requests_waiting', 0),
+            'requests': raw.get('requests_num', 0),
+            'wait_seconds': raw.get('requests_wait_ms', 0) / 1000,
+            'timeouts': raw.get('requests_errors', 0),
+            'connections_lost': raw.get('connections_lost', 0),
+        }
+    return result
+
+
+POOL_METRICS = (
+    ('size', 'gauge', "Connexions ouvertes par le pool."),
+    ('in_use', 'gauge', "Connexions prêtées à une requête."),
+    ('available', 'gauge', "Connexions libres."),
+    ('waiting', 'gauge', "Requêtes en attente d'une connexion."),
+    ('max', 'gauge', "Taille maximale du pool."),
+    ('requests', 'counter', "Demandes de connexion depuis l'ouverture du pool."),
+    ('wait_seconds', 'counter', "Temps d'attente cumulé d'une connexion."),
+    ('timeouts', 'counter', "Demandes abandonnées (délai dépassé ou file pleine)."),
+    ('connections_lost', 'counter', "Connexions trouvées cassées par les vérifications."),
+)
+
+
+def render_pool_stats(stats):
+    lines = []
+    for key, kind, help_text in POOL_METRICS:
+        name = f'stages_db_pool_{key}' + ('_total' if kind == 'counter' else '')
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        for alias, values in sorted(stats.items()):
+            lines.append(f'{name}{{alias="{alias}"}} {values[key]}')
+    return '\n'.join(lines) + '\n'
+
+
+def _db_wrapper(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db_time += time.perf_counter() - start
+
+
+def _install_db_wrapper(connection, **kwargs):
+    # execute_wrappers survit aux reconnexions : ne l'ajouter qu'une fois
+    if _db_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_db_wrapper)
+
+
+_json_encode = DjangoJSONEncoder.encode
+
+
+def _timed_encode(self, o):
+    stats = _current.get()
+    if stats is None:
+        return _json_encode(self, o)
+    start = time.perf_counter()
+    try:
+        return _json_encode(self, o)
+    finally:
+        stats.json_time += time.perf_counter() - start
+
+
+def install():
+    """
+    Branche la mesure des requêtes SQL sur toutes les connexions (présentes
+    et futures) et celle de l'encodage JSON sur DjangoJSONEncoder, utilisé
+    par JsonResponse et les exports en flux. Appelé une fois, si activé.
+    """
+    connection_created.connect(_install_db_wrapper, dispatch_uid='stages_profiling')
+    for alias in connections:
+        _install_db_wrapper(connections[alias])
+    DjangoJSONEncoder.encode = _timed_encode
+
+
+def _reset(token):
+    try:
+        _current.reset(token)
+    except ValueError:
+        # Flux fermé depuis un autre contexte que celui qui l'a parcouru
+        pass
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.url_name if match and match.url_name else 'non_resolue'
+
+
+def _server_timing(duration, stats):
+    return ', '.join([
+        f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} SQL"',
+        f'json;dur={stats.json_time * 1000:.1f}',
+        f'total;dur={duration * 1000:.1f}',
+    ])
+
+
+class ProfilingMiddleware:
+    """
+    Mesure chaque requête (voir le module). Pour une réponse en flux, les
+    en-têtes partent avant le corps : Server-Timing ne couvre que la vue,
+    les métriques sont enregistrées à la fin de l'envoi et couvrent tout.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'STAGES_PROFILING_SAMPLE_RATE', 0)
+        self.slow = getattr(settings, 'STAGES_PROFILING_SLOW_MS', 1000) / 1000
+        self.directory = getattr(settings, 'STAGES_PROFILING_DIR', None)
+        install()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _start(self):
+        profiler = None
+        if self.directory and self.sample_rate and random.random() < self.sample_rate:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Un autre profileur est déjà actif (requête concurrente, Python 3.12+)
+                profiler = None
+        stats = RequestStats()
+        return stats, _current.set(stats), profiler, time.perf_counter()
+
+    def _stop(self, state):
+        stats, token, profiler, start = state
+        _current.reset(token)
+        if profiler is not None:
+            profiler.disable()
+        return time.perf_counter() - start
+
+    def _finish(self, request, response, state):
+        stats, token, profiler, start = state
+        duration = self._stop(state)
+        view = _view_name(request)
+        if profiler is not None and duration >= self.slow:
+            self._dump(profiler, view, duration)
+
+        response['Server-Timing'] = _server_timing(duration, stats)
+        if not response.streaming:
+            stats.bytes = len(response.content)
+            registry.record(view, response.status_code, duration, stats)
+        elif response.is_async:
+            response.streaming_content = self._ameasured(response.streaming_content, view, response.status_code, stats, start)
+        else:
+            response.streaming_content = self._measured(response.streaming_content, view, response.status_code, stats, start)
+        return response
+
+    def _dump(self, profiler, view, duration):
+        os.makedirs(self.directory, exist_ok=True)
+        name = f'{time.strftime("%Y%m%d-%H%M%S")}_{view}_{duration * 1000:.0f}ms_{os.getpid()}.prof'
+        profiler.dump_stats(os.path.join(self.directory, name))
+
+    def _measured(self, content, view, status, stats, start):
+        token = _current.set(stats)
+        try:
+            for chunk in content:
+                stats.bytes += len(chunk)
+                yield chunk
+        finally:
+            _reset(token)
+            registry.record(view, status, time.perf_counter() - start, stats)
+
+    async def _ameasured(self, content, view, status, stats, start):
+        token = _current.set(stats)
+        try:
+            async for chunk in content:
+                stats.bytes += len(chunk)
+                yield chunk
+        finally:
+            _reset(token)
+            registry.record(view, status, time.perf_counter() - start, stats)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = self._start()
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            self._stop(state)
+            raise
+        return self._finish(request, response, state)
+
+    async def __acall__(self, request):
+        state = self._start()
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            self._stop(state)
+            raise
+        return self._finish(request, response, state)
+
+
+def metrics(request):
+    """Métriques du processus au format texte Prometheus."""
+    pools = pool_stats()
+    if not enabled() and not pools:
+        raise Http404
+    body = (registry.render() if enabled() else '') + (render_pool_stats(pools) if pools else '')
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
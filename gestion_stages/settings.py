@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -40,9 +41,11 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 ]
 
 MIDDLEWARE = [
+    'gestion_stages.profiling.ProfilingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -51,6 +54,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'stages.querybudget.QueryBudgetMiddleware',
+    'stages.routers.ReplicaMiddleware',
 
 ]
 
@@ -88,6 +93,38 @@ DATABASES = {
     }
 }
 
+# Connexions PostgreSQL : un pool psycopg (psycopg_pool) par processus, réglé
+# par variables d'environnement. Les connexions sont vérifiées avant d'être
+# prêtées et recyclées après STAGES_DB_POOL_MAX_LIFETIME secondes.
+# STAGES_DB_POOL=0 revient à des connexions persistantes sans pool ;
+# STAGES_DB_SQLITE=chemin bascule sur SQLite, sans pool (tests).
+if os.environ.get('STAGES_DB_SQLITE'):
+    DATABASES = {'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.environ['STAGES_DB_SQLITE']}}
+    # Réplica local : un second fichier SQLite, copie du primaire, lu par
+    # les API si STAGES_DB_SQLITE_REPLICA est défini (voir STAGES_DB_REPLICAS)
+    # et par les tests du routage
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('STAGES_DB_SQLITE_REPLICA') or os.environ['STAGES_DB_SQLITE'] + '.replica',
+    }
+elif os.environ.get('STAGES_DB_POOL', '1') == '1':
+    # Avec un pool, CONN_HEALTH_CHECKS fait vérifier chaque connexion par
+    # psycopg_pool (ConnectionPool.check_connection) avant de la prêter
+    DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+    DATABASES['default']['OPTIONS'] = {'pool': {
+        'min_size': int(os.environ.get('STAGES_DB_POOL_MIN_SIZE', 2)),
+        'max_size': int(os.environ.get('STAGES_DB_POOL_MAX_SIZE', 10)),
+        # Attente maximale d'une connexion libre (PoolTimeout au-delà) et
+        # nombre maximal de requêtes en attente (0 : illimité)
+        'timeout': float(os.environ.get('STAGES_DB_POOL_TIMEOUT', 10)),
+        'max_waiting': int(os.environ.get('STAGES_DB_POOL_MAX_WAITING', 0)),
+        'max_lifetime': float(os.environ.get('STAGES_DB_POOL_MAX_LIFETIME', 1800)),
+        'max_idle': float(os.environ.get('STAGES_DB_POOL_MAX_IDLE', 300)),
+    }}
+else:
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('STAGES_DB_CONN_MAX_AGE', 60))
+    DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
 
 
 # Password validation
@@ -151,3 +188,142 @@ MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
 # Ajouter 'django.middleware.csrf.CsrfViewMiddleware' si tu veux CSRF
 # Assure-toi aussi que 'django.contrib.staticfiles' est présent pour servir les assets.
+
+# Pagination par curseur des API de liste (?limit=, ?cursor=)
+STAGES_PAGE_SIZE = 50
+STAGES_MAX_PAGE_SIZE = 500
+# Taille des paquets lus par curseur serveur en mode ?stream=1
+STAGES_STREAM_CHUNK_SIZE = 2000
+
+# Budget de requêtes SQL par vue (nom d'URL), contrôlé par QueryBudgetMiddleware.
+# BEGIN/SAVEPOINT ne sont pas comptés ; les réponses en flux le sont jusqu'au
+# bout. Mesurés sans cache et avec extraction synchrone (QueryBudgetTests).
+STAGES_QUERY_BUDGET = 10
+STAGES_QUERY_BUDGETS = {
+    'home': 1,
+    'stagiaires_api': 1,
+    'encadrants_api': 1,
+    'stages_api': 1,
+    'rapports_api': 1,
+    'rapports_zip': 1,
+    'stages_search': 1,
+    'rapport_detail': 7,
+    'rapport_create': 7,
+    'rapport_valider': 4,
+    'rapport_archiver': 3,
+    'rapport_download': 1,
+    'rapport_fichier': 1,
+    'rapports_valider': 6,
+    'rapports_archiver': 4,
+    'sync': 5,
+    'stats': 1,
+    # Lot d'opérations : coût proportionnel au nombre d'opérations
+    'batch_operations': None,
+    # Import en masse : une requête par lot de STAGES_IMPORT_BATCH_SIZE, pas de budget fixe
+    'import_stagiaires': None,
+    'import_encadrants': None,
+    'import_stages': None,
+}
+# Lever une erreur au lieu de journaliser (activé par QueryBudgetTests)
+STAGES_QUERY_BUDGET_STRICT = False
+
+# Configuration plein texte (french + unaccent, créée par la migration 0006)
+STAGES_SEARCH_CONFIG = 'french_unaccent'
+
+# Extraction du texte des rapports : 'thread' (arrière-plan), 'sync' ou 'off'
+# (traitement par la commande extract_rapports)
+STAGES_EXTRACTION_MODE = 'thread'
+STAGES_EXTRACTION_MAX_CHARS = 500_000
+# Total décompressé par PDF (octets) : au-delà, les flux sont tronqués
+STAGES_EXTRACTION_MAX_INFLATED = 32 * 1024 * 1024
+
+# Téléchargement des rapports : None (Django sert le fichier, avec Range/ETag),
+# 'nginx' (X-Accel-Redirect vers STAGES_SENDFILE_URL_PREFIX, location internal
+# pointant sur MEDIA_ROOT) ou 'apache' (X-Sendfile)
+STAGES_SENDFILE_BACKEND = None
+STAGES_SENDFILE_URL_PREFIX = '/protected-media/'
+STAGES_DOWNLOAD_MAX_AGE = 3600
+
+# Cache des réponses GET (stages.cache), invalidé par compteurs de version.
+# Il exige un backend partagé par tous les workers : FileBasedCache (par
+# défaut, workers d'une même machine) ou Redis/Memcached (plusieurs
+# machines). Avec LocMemCache, propre à chaque processus, il est désactivé,
+# sauf si STAGES_CACHE_ENABLED = True (un seul processus). False le désactive.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('STAGES_CACHE_DIR', os.path.join(BASE_DIR, 'cache')),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+STAGES_CACHE_ALIAS = 'default'
+STAGES_CACHE_TIMEOUT = 300
+STAGES_CACHE_ENABLED = None
+
+# Import en masse (stages.imports) : taille des lots de bulk_create et
+# taille maximale du fichier importé (le corps est lu en mémoire)
+STAGES_IMPORT_BATCH_SIZE = 1000
+STAGES_IMPORT_MAX_BYTES = 20 * 1024 * 1024
+
+# Mise à jour des statuts (update_statuts, action d'admin) : stages par lot
+STAGES_STATUT_BATCH_SIZE = 1000
+
+# Transitions par lot (rapports/api/valider/, rapports/api/archiver/)
+STAGES_BATCH_MAX_IDS = 5000
+# Nombre maximal d'opérations d'un appel à /batch/
+STAGES_BATCH_MAX_OPERATIONS = 100
+
+# Synchronisation incrémentale (/sync/) : recul du jeton en secondes et
+# durée de conservation des traces de suppression (commande purge_suppressions)
+STAGES_SYNC_MARGIN = 5
+STAGES_SYNC_RETENTION_DAYS = 30
+# Lignes par page de l'état initial (/sync/ sans ?since=)
+STAGES_SYNC_PAGE_SIZE = 1000
+
+# Événements temps réel (/events/, Server-Sent Events, servi en ASGI).
+# Le broker en mémoire ne diffuse qu'aux clients du même processus.
+STAGES_EVENTS_BROKER = 'stages.events.InMemoryBroker'
+STAGES_EVENTS_QUEUE_SIZE = 100
+STAGES_EVENTS_HEARTBEAT = 15
+
+# Vues async (stages.async_views) pour les lectures, dépôts et téléchargements.
+# Activé par gestion_stages.asgi ; les vues synchrones restent servies en WSGI.
+STAGES_ASYNC_VIEWS = os.environ.get('STAGES_ASYNC_VIEWS', '') == '1'
+
+# Instrumentation (gestion_stages.profiling) : en-têtes Server-Timing,
+# histogrammes Prometheus par vue sur /metrics et profils cProfile des
+# requêtes lentes, pour une fraction STAGES_PROFILING_SAMPLE_RATE d'entre
+# elles. Désactivé, le middleware se retire de la chaîne.
+STAGES_PROFILING = os.environ.get('STAGES_PROFILING', '') == '1'
+STAGES_PROFILING_SAMPLE_RATE = 0.01
+STAGES_PROFILING_SLOW_MS = 1000
+STAGES_PROFILING_DIR = os.path.join(BASE_DIR, 'profiles')
+
+# Réplicas en lecture (stages.routers) pour les GET des API listées dans
+# STAGES_REPLICA_VIEWS. STAGES_REPLICA_HOSTS=hote1,hote2 déclare un réplica
+# par hôte, avec les identifiants du primaire. Après une écriture, le client
+# reste sur le primaire pendant STAGES_REPLICA_LAG secondes, qui est aussi le
+# retard maximal toléré d'un réplica.
+STAGES_DB_REPLICAS = []
+for _index, _host in enumerate(filter(None, os.environ.get('STAGES_REPLICA_HOSTS', '').split(',')), start=1):
+    DATABASES[f'replica{_index}'] = {**DATABASES['default'], 'HOST': _host.strip(), 'TEST': {'MIRROR': 'default'}}
+    STAGES_DB_REPLICAS.append(f'replica{_index}')
+if os.environ.get('STAGES_DB_SQLITE') and os.environ.get('STAGES_DB_SQLITE_REPLICA'):
+    STAGES_DB_REPLICAS.append('replica')
+DATABASE_ROUTERS = ['stages.routers.ReplicaRouter']
+STAGES_REPLICA_LAG = 2
+STAGES_REPLICA_CHECK_INTERVAL = 5
+STAGES_REPLICA_VIEWS = [
+    'stagiaires_api', 'stagiaire_detail', 'encadrants_api', 'encadrant_detail',
+    'stages_api', 'stages_search', 'stage_detail', 'rapports_api', 'rapport_detail', 'stats',
+    'stagiaires_autocomplete', 'encadrants_autocomplete', 'stages_autocomplete',
+]
+
+# Autocomplétion (*/api/autocomplete/?q=) : nombre de résultats par défaut
+# et maximum accepté pour ?limit=
+STAGES_AUTOCOMPLETE_LIMIT = 10
+STAGES_AUTOCOMPLETE_MAX_LIMIT = 50
+
+# Listes de l'admin : au-delà de ce nombre de lignes estimées (PostgreSQL),
+# le total affiché est l'estimation du planificateur au lieu d'un COUNT(*)
+STAGES_ADMIN_EXACT_COUNT_LIMIT = 10000
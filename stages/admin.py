@@ -1,28 +1,160 @@
-from django.contrib import admin
+import json
+
+from django.conf import settings
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
 from .models import Stagiaire, Encadrant, Stage, Rapport
+from .search import autocomplete_persons, autocomplete_stages, search_enabled, search_rapports, search_stages
+from .workflow import valider_rapports, archiver_rapports, recalculer_statuts
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Sous PostgreSQL, le nombre de lignes d'une liste vient de l'estimation
+    du planificateur (EXPLAIN, sans exécuter la requête) dès qu'elle dépasse
+    STAGES_ADMIN_EXACT_COUNT_LIMIT : plus de COUNT(*) sur toute la table à
+    chaque page. En dessous, ou sur une autre base, le compte reste exact.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if connections[queryset.db].vendor == 'postgresql':
+            plan = json.loads(queryset.order_by().explain(format='json'))
+            # Django aplatit la liste de plans renvoyée par psycopg
+            if isinstance(plan, list):
+                plan = plan[0]
+            estimate = int(plan['Plan']['Plan Rows'])
+            if estimate > getattr(settings, 'STAGES_ADMIN_EXACT_COUNT_LIMIT', 10000):
+                return estimate
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # Pas de second COUNT(*) sur la table entière pour « N au total »
+    show_full_result_count = False
+
+
+class PrefixAutocompleteMixin:
+    """
+    Recherche des listes autocomplete_fields par préfixe sur les noms
+    normalisés indexés (stages.search), au lieu d'un icontains sur chaque
+    champ de search_fields. La barre de recherche des listes est inchangée.
+    """
+    autocomplete_search = None
+
+    def get_search_results(self, request, queryset, search_term):
+        match = getattr(request, 'resolver_match', None)
+        if match is not None and match.url_name == 'autocomplete' and search_term.strip():
+            return self.autocomplete_search(queryset, search_term), False
+        return super().get_search_results(request, queryset, search_term)
+
+
+class FullTextSearchMixin:
+    """
+    Sous PostgreSQL, la barre de recherche passe par search_vector (index
+    GIN, stages.search) au lieu d'icontains à travers les jointures de
+    search_fields, qui reste le repli sur les autres bases.
+    """
+    full_text_search = None
+
+    def get_search_results(self, request, queryset, search_term):
+        if search_term.strip() and search_enabled():
+            return self.full_text_search(queryset, search_term)[0], False
+        return super().get_search_results(request, queryset, search_term)
+
+
+def _autocomplete_stages(queryset, q):
+    # Le libellé d'un stage affiche son stagiaire
+    return autocomplete_stages(queryset.select_related('stagiaire'), q)
+
+
+class StatutEffectifFilter(admin.SimpleListFilter):
+    """Statut calculé à partir de date_fin, comme ?statut= de stages_api (index (statut, date_fin))."""
+    title = 'statut'
+    parameter_name = 'statut'
+
+    def lookups(self, request, model_admin):
+        return [(statut, statut) for statut in ('En cours', 'Terminé', 'Validé')]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter_statut(self.value())
+        return queryset
+
+
+def _report(model_admin, request, updated, rejected, action):
+    model_admin.message_user(request, f"{len(updated)} rapport(s) {action}.", messages.SUCCESS)
+    if rejected:
+        reasons = sorted(set(rejected.values()))
+        model_admin.message_user(
+            request, f"{len(rejected)} rapport(s) ignoré(s) : {' '.join(reasons)}", messages.WARNING)
+
 
 @admin.register(Stagiaire)
-class StagiaireAdmin(admin.ModelAdmin):
+class StagiaireAdmin(PrefixAutocompleteMixin, LargeTableAdmin):
     list_display = ('prenom', 'nom', 'ecole', 'filiere', 'email', 'telephone')
     search_fields = ('prenom', 'nom', 'email', 'ecole', 'filiere')
+    autocomplete_search = staticmethod(autocomplete_persons)
 
 
 @admin.register(Encadrant)
-class EncadrantAdmin(admin.ModelAdmin):
+class EncadrantAdmin(PrefixAutocompleteMixin, LargeTableAdmin):
     list_display = ('prenom', 'nom', 'institution', 'email', 'telephone')
     list_filter = ('institution',)
     search_fields = ('prenom', 'nom', 'email')
+    autocomplete_search = staticmethod(autocomplete_persons)
 
 
 @admin.register(Stage)
-class StageAdmin(admin.ModelAdmin):
+class StageAdmin(PrefixAutocompleteMixin, FullTextSearchMixin, LargeTableAdmin):
     list_display = ('theme', 'type_stage', 'stagiaire', 'encadrant', 'date_debut', 'date_fin', 'statut')
-    list_filter = ('type_stage', 'statut', 'date_debut', 'date_fin')
+    list_select_related = ('stagiaire', 'encadrant')
+    list_filter = (StatutEffectifFilter, 'type_stage')
+    date_hierarchy = 'date_debut'
+    ordering = ('-date_debut', '-id')
     search_fields = ('theme', 'stagiaire__prenom', 'stagiaire__nom', 'encadrant__prenom', 'encadrant__nom')
+    autocomplete_fields = ('stagiaire', 'encadrant')
+    autocomplete_search = staticmethod(_autocomplete_stages)
+    full_text_search = staticmethod(search_stages)
+    actions = ('recalculer_statut',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('search_vector')
+
+    @admin.action(description="Recalculer le statut des stages sélectionnés")
+    def recalculer_statut(self, request, queryset):
+        ids = recalculer_statuts(queryset.values('pk'))
+        self.message_user(request, f"{len(ids)} stage(s) mis à jour.", messages.SUCCESS)
 
 
 @admin.register(Rapport)
-class RapportAdmin(admin.ModelAdmin):
+class RapportAdmin(FullTextSearchMixin, LargeTableAdmin):
     list_display = ('stage','etat', 'date_depot')
-    list_filter = ('etat', 'date_depot')
-    search_fields = ('stage__theme', 'stage__stagiaire__prenom', 'stage__stagiaire__nom')
\ No newline at end of file
+    # Rapport.__str__ et la colonne stage lisent le stage et son stagiaire
+    list_select_related = ('stage__stagiaire',)
+    list_filter = ('etat',)
+    date_hierarchy = 'date_depot'
+    # Même ordre que l'index (-date_depot, id)
+    ordering = ('-date_depot', 'id')
+    search_fields = ('stage__theme', 'stage__stagiaire__prenom', 'stage__stagiaire__nom')
+    autocomplete_fields = ('stage',)
+    full_text_search = staticmethod(search_rapports)
+    actions = ('valider', 'archiver')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('contenu', 'search_vector', 'stage__search_vector')
+
+    @admin.action(description="Valider les rapports sélectionnés")
+    def valider(self, request, queryset):
+        updated, rejected = valider_rapports(list(queryset.values_list('pk', flat=True)))
+        _report(self, request, updated, rejected, 'validé(s)')
+
+    @admin.action(description="Archiver les rapports sélectionnés")
+    def archiver(self, request, queryset):
+        updated, rejected = archiver_rapports(list(queryset.values_list('pk', flat=True)))
+        _report(self, request, updated, rejected, 'archivé(s)')
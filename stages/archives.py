@@ -0,0 +1,85 @@
+import logging
+import os
+import re
+import zipfile
+
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+# Formats déjà compressés (DOCX/ODT sont des ZIP, PDF a ses propres flux) :
+# les recompresser coûte du CPU pour rien, on les stocke tels quels
+STORED_EXTENSIONS = {'.docx', '.odt', '.pdf'}
+
+
+class _ChunkBuffer:
+    """
+    Flux en écriture seule, vidé à chaque bloc produit. Sans tell()/seek(),
+    zipfile écrit des descripteurs de données au lieu de revenir en arrière :
+    l'archive peut être envoyée au fil de l'eau.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _safe(part):
+    return re.sub(r'[^\w.-]+', '_', part or '').strip('_') or 'inconnu'
+
+
+def entry_name(rapport):
+    """annee/filiere/Nom_Prenom_rapport_<id>.ext"""
+    stagiaire = rapport.stage.stagiaire
+    extension = os.path.splitext(rapport.fichier.name)[1].lower()
+    annee = timezone.localtime(rapport.date_depot).year
+    return '/'.join([
+        str(annee),
+        _safe(stagiaire.filiere),
+        f'{_safe(stagiaire.nom)}_{_safe(stagiaire.prenom)}_rapport_{rapport.pk}{extension}',
+    ])
+
+
+def iter_zip(rapports):
+    """
+    Génère une archive ZIP des fichiers de `rapports` bloc par bloc :
+    ni fichier temporaire, ni archive complète en mémoire (au plus un bloc
+    de CHUNK_SIZE octets par fichier en cours).
+    """
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, mode='w', allowZip64=True) as archive:
+        for rapport in rapports:
+            fichier = rapport.fichier
+            try:
+                size = fichier.storage.size(fichier.name)
+                source = fichier.storage.open(fichier.name, 'rb')
+            except OSError:
+                logger.warning("Fichier absent pour le rapport %s : %s", rapport.pk, fichier.name)
+                continue
+            name = entry_name(rapport)
+            info = zipfile.ZipInfo(name, date_time=timezone.localtime(rapport.date_depot).timetuple()[:6])
+            extension = os.path.splitext(name)[1]
+            info.compress_type = zipfile.ZIP_STORED if extension in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+            info.file_size = size
+            with source, archive.open(info, mode='w') as dest:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                    dest.write(chunk)
+                    if buffer.chunks:
+                        yield buffer.drain()
+            if buffer.chunks:
+                yield buffer.drain()
+    # Répertoire central, écrit à la fermeture de l'archive
+    yield buffer.drain()
@@ -0,0 +1,92 @@
+"""
+Versions async des vues de lecture, de dépôt et de téléchargement.
+
+Servies à la place des vues synchrones quand STAGES_ASYNC_VIEWS est activé
+(c'est le cas par défaut avec gestion_stages.asgi, voir stages.urls) : une
+liste exportée en flux ou un fichier en cours de téléchargement n'immobilise
+alors plus de worker, l'envoi se fait dans la boucle asyncio.
+"""
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.shortcuts import aget_object_or_404
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+
+from .cache import cached_response
+from .downloads import aserve_file, download_filename
+from .filters import InvalidParameter
+from .models import Stagiaire, Encadrant, Stage, Rapport
+from .pagination import apaginated_response
+from .streaming import wants_stream, astreaming_response
+from .views import (
+    RAPPORTS, RAPPORTS_TELECHARGEABLES, stagiaires_query, encadrants_query, stages_query, filter_rapports,
+    rapport_to_dict, check_telechargeable, deposer_rapport,
+)
+
+
+async def alist_response(request, queryset, ordering, serialize=None):
+    if wants_stream(request):
+        return astreaming_response(request, queryset.order_by(*ordering), serialize)
+    return await apaginated_response(request, queryset, ordering, serialize)
+
+
+@cached_response(Stagiaire)
+async def stagiaires_api(request):
+    try:
+        stagiaires, ordering, serialize = stagiaires_query(request)
+    except InvalidParameter as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    return await alist_response(request, stagiaires, ordering, serialize)
+
+
+@cached_response(Encadrant)
+async def encadrants_api(request):
+    try:
+        encadrants, ordering, serialize = encadrants_query(request)
+    except InvalidParameter as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    return await alist_response(request, encadrants, ordering, serialize)
+
+
+@cached_response(Stage, Stagiaire, Encadrant)
+async def stages_api(request):
+    try:
+        stages, ordering, serialize = stages_query(request)
+    except InvalidParameter as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    return await alist_response(request, stages, ordering, serialize)
+
+
+@require_http_methods(["GET"])
+@cached_response(Rapport, Stage, Stagiaire)
+async def rapports_api(request):
+    qs, ordering = filter_rapports(request, RAPPORTS.all())
+    return await alist_response(request, qs, ordering, serialize=rapport_to_dict)
+
+
+# Sous ASGI le corps de la requête est reçu dans la boucle avant l'appel de
+# la vue : un envoi lent ne bloque aucun thread. Validation, stockage et
+# signaux restent synchrones (transactions) et passent par sync_to_async.
+@csrf_exempt
+@require_http_methods(["POST"])
+async def rapport_create(request):
+    return await sync_to_async(deposer_rapport)(request)
+
+
+@require_http_methods(["GET"])
+async def rapport_download(request, pk):
+    rapport = await aget_object_or_404(RAPPORTS_TELECHARGEABLES, pk=pk)
+    error = await sync_to_async(check_telechargeable, thread_sensitive=False)(rapport)
+    if error:
+        return error
+    return JsonResponse({"download_url": reverse('rapport_fichier', args=[rapport.pk])})
+
+
+@require_http_methods(["GET", "HEAD"])
+async def rapport_fichier(request, pk):
+    rapport = await aget_object_or_404(RAPPORTS_TELECHARGEABLES, pk=pk)
+    error = await sync_to_async(check_telechargeable, thread_sensitive=False)(rapport)
+    if error:
+        return error
+    return await aserve_file(request, rapport.fichier, download_filename(rapport))
@@ -0,0 +1,129 @@
+from django.conf import settings
+from django.db import transaction
+from django.forms.models import model_to_dict
+
+from .forms import StagiaireForm, EncadrantForm, StageForm, RapportForm, DEPOT_REFUSE, refus_rapport
+from .models import Stagiaire, Encadrant, Stage, Rapport
+
+RESOURCES = {
+    'stagiaires': (Stagiaire, StagiaireForm),
+    'encadrants': (Encadrant, EncadrantForm),
+    'stages': (Stage, StageForm),
+    'rapports': (Rapport, RapportForm),
+}
+
+OPERATIONS = ('create', 'update', 'delete')
+
+
+class BatchError(Exception):
+    """Opération `index` refusée : tout le lot est annulé."""
+
+    def __init__(self, index, errors, status=400):
+        super().__init__(index, errors)
+        self.index = index
+        self.errors = errors
+        self.status = status
+
+
+def _resolve(value, index, results):
+    # {"$ref": n} : id créé (ou modifié) par l'opération n, antérieure à celle-ci
+    if not (isinstance(value, dict) and '$ref' in value):
+        return value
+    ref = value['$ref']
+    if not isinstance(ref, int) or not 0 <= ref < index:
+        raise BatchError(index, {'$ref': [f"Référence invalide : {ref!r}"]})
+    if results[ref]['op'] == 'delete':
+        raise BatchError(index, {'$ref': [f"L'opération {ref} est une suppression."]})
+    return results[ref]['id']
+
+
+def _form_for(index, resource, data, files, instance=None):
+    form_class = RESOURCES[resource][1]
+    uploads = {}
+    if resource == 'rapports' and isinstance(data.get('fichier'), str):
+        # Fichier envoyé en multipart : "fichier" désigne le nom de la partie
+        name = data.pop('fichier')
+        if name not in files:
+            raise BatchError(index, {'fichier': [f"Fichier absent de la requête : {name}"]})
+        uploads['fichier'] = files[name]
+    if resource == 'stages' and instance is None:
+        # Comme stage_create : le statut est recalculé par Stage.save()
+        data.setdefault('statut', 'En cours')
+    if instance is not None:
+        # Mise à jour partielle : les champs absents gardent leur valeur
+        data = {**model_to_dict(instance, fields=list(form_class.base_fields)), **data}
+        if resource == 'rapports' and 'fichier' not in uploads:
+            data.pop('fichier', None)
+    return form_class(data, uploads, instance=instance)
+
+
+def _get(index, resource, pk):
+    model = RESOURCES[resource][0]
+    try:
+        return model.objects.get(pk=pk)
+    except (model.DoesNotExist, ValueError, TypeError):
+        raise BatchError(index, {'id': [f"{resource} introuvable : {pk!r}"]}, status=404)
+
+
+def _check_rapport(index, resource, op, instance):
+    # Mêmes règles que rapport_detail (PUT / DELETE)
+    if resource == 'rapports':
+        refus = refus_rapport(instance, op)
+        if refus:
+            raise BatchError(index, {'etat': [refus]})
+
+
+def _apply(index, operation, results, files):
+    if not isinstance(operation, dict):
+        raise BatchError(index, {'operation': ["Un objet est attendu."]})
+    op = operation.get('op')
+    resource = operation.get('resource')
+    if op not in OPERATIONS:
+        raise BatchError(index, {'op': [f"Opération inconnue : {op!r}"]})
+    if resource not in RESOURCES:
+        raise BatchError(index, {'resource': [f"Ressource inconnue : {resource!r}"]})
+    data = operation.get('data') or {}
+    if not isinstance(data, dict):
+        raise BatchError(index, {'data': ["Un objet est attendu."]})
+    data = {field: _resolve(value, index, results) for field, value in data.items()}
+
+    if op == 'delete':
+        instance = _get(index, resource, _resolve(operation.get('id'), index, results))
+        _check_rapport(index, resource, op, instance)
+        pk = instance.pk
+        instance.delete()
+        return {'op': op, 'resource': resource, 'id': pk}
+
+    instance = None
+    if op == 'update':
+        instance = _get(index, resource, _resolve(operation.get('id'), index, results))
+        _check_rapport(index, resource, op, instance)
+    form = _form_for(index, resource, data, files, instance)
+    if not form.is_valid():
+        raise BatchError(index, form.errors)
+    if resource == 'rapports' and op == 'create' and not form.cleaned_data['stage'].accepte_rapport():
+        raise BatchError(index, {'stage': [DEPOT_REFUSE]})
+    obj = form.save()
+    return {'op': op, 'resource': resource, 'id': obj.pk}
+
+
+def run_batch(operations, files=None):
+    """
+    Exécute les opérations dans l'ordre et dans une seule transaction :
+    à la première opération refusée, BatchError est levée et rien n'est
+    écrit. Chaque opération est {"op": create|update|delete, "resource":
+    stagiaires|encadrants|stages|rapports, "id": ..., "data": {...}} ; un
+    id ou une valeur de data peut valoir {"$ref": n} pour désigner l'objet
+    de l'opération n. Renvoie un résultat {"op", "resource", "id"} par opération.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise BatchError(None, {'operations': ["Une liste d'opérations non vide est attendue."]})
+    maximum = getattr(settings, 'STAGES_BATCH_MAX_OPERATIONS', 100)
+    if len(operations) > maximum:
+        raise BatchError(None, {'operations': [f"Au plus {maximum} opérations par lot."]})
+
+    results = []
+    with transaction.atomic():
+        for index, operation in enumerate(operations):
+            results.append(_apply(index, operation, results, files or {}))
+    return results
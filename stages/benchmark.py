@@ -0,0 +1,302 @@
+"""
+Mesure des routes de stages.urls par le client de test (commande bench_routes).
+
+Chaque scénario est une requête représentative d'une route, jouée sur la
+base courante (remplie par generate_data) : latences p50/p95/p99, nombre de
+requêtes SQL et pic mémoire Python (tracemalloc). Les écritures sont jouées
+dans une transaction annulée, la base est identique d'une itération et d'un
+run à l'autre. Une route sans scénario est signalée dans le rapport.
+"""
+import gc
+import json
+import platform
+import time
+import tracemalloc
+from contextlib import nullcontext
+
+import django
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.urls import URLPattern, reverse
+from django.utils import timezone
+from django.utils.http import urlencode
+
+from . import cache, sync as sync_feed, urls
+from .models import Stagiaire, Encadrant, Stage, Rapport, FichierRapport
+from .querybudget import count_queries
+
+# Routes non mesurables par requête unique
+EXCLUDED = {
+    'events_stream': "flux Server-Sent Events sans fin",
+}
+
+
+class EmptyDatabase(Exception):
+    pass
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))
+    return values[index]
+
+
+def sample():
+    """
+    Objets servant de paramètres aux scénarios, choisis de façon
+    déterministe (plus petits ids) pour que deux runs sur les mêmes
+    données jouent exactement les mêmes requêtes.
+    """
+    stagiaire = Stagiaire.objects.exclude(filiere=None).order_by('id').first()
+    encadrant = Encadrant.objects.order_by('id').first()
+    stage = Stage.objects.filter_statut('Terminé').select_related('stagiaire').order_by('id').first()
+    rapport = Rapport.objects.filter(etat='Validé').order_by('id').first()
+    en_attente = list(Rapport.objects.filter(etat='En attente').order_by('id').values_list('id', flat=True)[:100])
+    valides = list(Rapport.objects.filter(etat='Validé').order_by('id').values_list('id', flat=True)[:100])
+    if None in (stagiaire, encadrant, stage, rapport) or not en_attente:
+        raise EmptyDatabase("Données insuffisantes : lancer d'abord generate_data.")
+    return {
+        'stagiaire': stagiaire,
+        'encadrant': encadrant,
+        'stage': stage,
+        'rapport': rapport,
+        'en_attente': en_attente,
+        'valides': valides,
+        'mot': stage.theme.split()[0],
+        'annee': rapport.date_depot.year,
+        'sha256': FichierRapport.objects.order_by('sha256').values_list('sha256', flat=True).first(),
+        # Client à jour : coût d'une interrogation sans changement
+        'token': sync_feed.next_token(),
+    }
+
+
+def _json(data):
+    return {'data': json.dumps(data), 'content_type': 'application/json'}
+
+
+def _import_rows(count):
+    return [
+        {'nom': 'Bench', 'prenom': f'Import{i}', 'email': f'import.{i}@bench.test', 'ecole': 'ESI'}
+        for i in range(count)
+    ]
+
+
+def _upload(name='rapport.pdf'):
+    return SimpleUploadedFile(name, b'%PDF-1.4\n% Rapport de benchmark\n' + b'0' * 2048, 'application/pdf')
+
+
+def scenarios(s):
+    """
+    {nom d'URL: [(libellé, méthode, args, paramètres GET, options du client, écriture)]}.
+    Les options peuvent être une fonction, appelée à chaque itération
+    (fichiers envoyés, qui ne se relisent pas deux fois).
+    """
+    stagiaire, encadrant, stage, rapport = s['stagiaire'], s['encadrant'], s['stage'], s['rapport']
+    filiere = stagiaire.filiere
+    return {
+        'home': [('page', 'get', [], {}, {}, False)],
+        'add_stagiaire': [('formulaire', 'get', [], {}, {}, False)],
+        'add_stage': [('formulaire', 'get', [], {}, {}, False)],
+        'stagiaires_api': [
+            ('page', 'get', [], {}, {}, False),
+            ('page 500', 'get', [], {'limit': 500}, {}, False),
+            ('filtre + tri', 'get', [], {'filiere': filiere, 'ordering': 'nom', 'fields': 'id,nom,prenom'}, {}, False),
+            ('flux', 'get', [], {'stream': 1, 'filiere': filiere}, {}, False),
+        ],
+        'stagiaires_autocomplete': [('préfixe', 'get', [], {'q': stagiaire.nom[:3]}, {}, False)],
+        'import_stagiaires': [('100 lignes', 'post', [], {}, _json(_import_rows(100)), True)],
+        'create_stagiaire': [('création', 'post', [], {}, _json(
+            {'nom': 'Bench', 'prenom': 'Création', 'email': 'creation@bench.test', 'ecole': 'ESI'}), True)],
+        'stagiaire_detail': [
+            ('lecture', 'get', [stagiaire.pk], {}, {}, False),
+            ('patch', 'patch', [stagiaire.pk], {}, _json({'telephone': '+226 00 00 00 00'}), True),
+        ],
+        'encadrants_api': [('page', 'get', [], {}, {}, False)],
+        'encadrants_autocomplete': [('préfixe', 'get', [], {'q': encadrant.nom[:3]}, {}, False)],
+        'import_encadrants': [('100 lignes', 'post', [], {}, _json(
+            [{**row, 'institution': 'Externe'} for row in _import_rows(100)]), True)],
+        'create_encadrant': [('création', 'post', [], {}, _json(
+            {'nom': 'Bench', 'prenom': 'Création', 'email': 'creation@bench.test', 'institution': 'Interne'}), True)],
+        'encadrant_detail': [
+            ('lecture', 'get', [encadrant.pk], {}, {}, False),
+            ('patch', 'patch', [encadrant.pk], {}, _json({'telephone': '+226 00 00 00 00'}), True),
+        ],
+        'stages_api': [
+            ('page', 'get', [], {}, {}, False),
+            ('statut Terminé', 'get', [], {'statut': 'Terminé'}, {}, False),
+            ('encadrant', 'get', [], {'encadrant': encadrant.pk}, {}, False),
+            ('filière + période', 'get', [], {'filiere': filiere, 'du': stage.date_debut, 'au': stage.date_fin}, {}, False),
+            ('flux', 'get', [], {'stream': 1, 'encadrant': encadrant.pk}, {}, False),
+        ],
+        'stages_search': [('recherche', 'get', [], {'q': s['mot']}, {}, False)],
+        'stages_autocomplete': [('préfixe', 'get', [], {'q': s['mot'][:4]}, {}, False)],
+        'import_stages': [('100 lignes', 'post', [], {}, _json([
+            {'theme': f'Import {i}', 'type_stage': 'Academique', 'date_debut': '2024-01-01',
+             'date_fin': '2024-03-31', 'stagiaire': stagiaire.email, 'encadrant': encadrant.email}
+            for i in range(100)
+        ]), True)],
+        'stage_create': [('création', 'post', [], {}, _json({
+            'theme': 'Bench', 'type_stage': 'Academique', 'date_debut': '2024-01-01',
+            'date_fin': '2024-03-31', 'stagiaire': stagiaire.pk, 'encadrant': encadrant.pk,
+        }), True)],
+        'stage_detail': [
+            ('lecture', 'get', [stage.pk], {}, {}, False),
+            ('patch', 'patch', [stage.pk], {}, _json({'theme': stage.theme + ' (révisé)'}), True),
+        ],
+        'rapports_api': [
+            ('page', 'get', [], {}, {}, False),
+            ('état', 'get', [], {'etat': 'En attente'}, {}, False),
+            ('filière + année', 'get', [], {'filiere': filiere, 'annee': s['annee']}, {}, False),
+            ('flux', 'get', [], {'stream': 1, 'filiere': filiere, 'annee': s['annee']}, {}, False),
+        ],
+        'rapports_zip': [('filière + année', 'get', [], {'filiere': filiere, 'annee': s['annee']}, {}, False)],
+        'rapports_valider': [('100 ids', 'post', [], {}, _json({'ids': s['en_attente']}), True)],
+        'rapports_archiver': [('100 ids', 'post', [], {}, _json({'ids': s['valides']}), True)],
+        'rapport_create': [('dépôt', 'post', [], {}, lambda: {'data': {'stage': stage.pk, 'fichier': _upload()}}, True)],
+        'rapport_detail': [('lecture', 'get', [rapport.pk], {}, {}, False)],
+        'rapport_valider': [('validation', 'post', [s['en_attente'][0]], {}, {}, True)],
+        'rapport_archiver': [('archivage', 'post', [rapport.pk], {}, {}, True)],
+        'rapport_download': [('lien', 'get', [rapport.pk], {}, {}, False)],
+        'rapport_fichier': [('fichier', 'get', [rapport.pk], {}, {}, False)],
+        'fichier_rapport_detail': [('blob', 'get', [s['sha256'] or '0' * 64], {}, {}, False)],
+        'sync': [('incrémental', 'get', [], {'since': s['token']}, {}, False),
+                 ('état initial', 'get', [], {}, {}, False)],
+        'stats': [('trois ans', 'get', [], {'annee_min': s['annee'] - 2, 'annee_max': s['annee']}, {}, False)],
+        'batch_operations': [('3 opérations', 'post', [], {}, _json([
+            {'op': 'create', 'resource': 'stagiaires',
+             'data': {'nom': 'Bench', 'prenom': 'Lot', 'email': 'lot@bench.test'}},
+            {'op': 'create', 'resource': 'stages', 'data': {
+                'theme': 'Bench', 'type_stage': 'Academique', 'date_debut': '2024-01-01',
+                'date_fin': '2024-03-31', 'stagiaire': {'$ref': 0}, 'encadrant': encadrant.pk}},
+            {'op': 'update', 'resource': 'encadrants', 'id': encadrant.pk, 'data': {'telephone': '+226 00 00 00 00'}},
+        ]), True)],
+    }
+
+
+def route_names():
+    return [pattern.name for pattern in urls.urlpatterns if isinstance(pattern, URLPattern) and pattern.name]
+
+
+def _call(client, method, path, params, options):
+    options = options() if callable(options) else dict(options)
+    if params:
+        path = f"{path}?{urlencode(params)}"
+    response = getattr(client, method)(path, **options)
+    # Une réponse en flux n'est mesurée qu'une fois entièrement consommée
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+    else:
+        response.content
+    return response.status_code
+
+
+def _play(client, write, *call):
+    if not write:
+        return _call(client, *call)
+    with transaction.atomic():
+        status = _call(client, *call)
+        transaction.set_rollback(True)
+    return status
+
+
+def measure(client, write, call, iterations, warmup, warm_cache=False):
+    def play():
+        if not warm_cache:
+            cache.get_cache().clear()
+        return _play(client, write, *call)
+
+    for _ in range(warmup):
+        play()
+
+    latencies, statuses = [], set()
+    for _ in range(iterations):
+        gc.collect()
+        start = time.perf_counter()
+        statuses.add(play())
+        latencies.append(time.perf_counter() - start)
+
+    # Requêtes SQL et mémoire sur des passes à part : ni l'une ni l'autre
+    # ne doit fausser les latences
+    with count_queries() as queries:
+        play()
+    tracemalloc.start()
+    try:
+        play()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'status': sorted(statuses),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'requetes_sql': queries.count,
+        'memoire_pic_ko': round(peak / 1024, 1),
+    }
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'base': connection.vendor,
+        'vues_async': bool(getattr(settings, 'STAGES_ASYNC_VIEWS', False)),
+        'donnees': {
+            model._meta.model_name: model.objects.count()
+            for model in (Stagiaire, Encadrant, Stage, Rapport)
+        },
+    }
+
+
+def run(iterations=20, warmup=2, routes=None, warm_cache=False, log=None):
+    """Joue les scénarios des routes `routes` (toutes par défaut) et renvoie le rapport."""
+    log = log or (lambda message: None)
+    # Hôte accepté par ALLOWED_HOSTS (localhost est toujours permis en DEBUG)
+    host = next((host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*'), 'localhost')
+    client = Client(SERVER_NAME=host)
+    all_scenarios = scenarios(sample())
+    names = route_names()
+    results = {}
+    # Un seul processus : le cache des réponses peut être forcé même sur LocMemCache
+    with override_settings(STAGES_CACHE_ENABLED=True) if warm_cache else nullcontext():
+        for name in names:
+            if routes and name not in routes:
+                continue
+            for label, method, args, params, options, write in all_scenarios.get(name, []):
+                key = f"{name} {label}"
+                log(key)
+                call = (method, reverse(name, args=args), params, options)
+                results[key] = {'route': name, **measure(client, write, call, iterations, warmup, warm_cache)}
+    return {
+        'date': timezone.now().isoformat(timespec='seconds'),
+        'environnement': environment(),
+        'parametres': {'iterations': iterations, 'warmup': warmup, 'cache': warm_cache},
+        'resultats': results,
+        'exclues': {name: reason for name, reason in EXCLUDED.items() if name in names},
+        'non_couvertes': [name for name in names if name not in all_scenarios and name not in EXCLUDED],
+    }
+
+
+def compare(report, reference, tolerance=0.25):
+    """
+    Régressions de `report` par rapport à `reference` : toute requête SQL
+    en plus, ou p95 plus lent de plus de `tolerance` (0.25 = +25 %).
+    """
+    regressions = []
+    for key, result in report['resultats'].items():
+        before = reference.get('resultats', {}).get(key)
+        if before is None:
+            continue
+        if result['requetes_sql'] > before['requetes_sql']:
+            regressions.append({'scenario': key, 'mesure': 'requetes_sql',
+                                'avant': before['requetes_sql'], 'apres': result['requetes_sql']})
+        if before['p95_ms'] and result['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append({'scenario': key, 'mesure': 'p95_ms',
+                                'avant': before['p95_ms'], 'apres': result['p95_ms']})
+    return regressions
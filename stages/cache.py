@@ -0,0 +1,142 @@
+import hashlib
+import time
+from datetime import date
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
+
+from . import routers
+
+VERSION_KEY = 'stages:version:{}'
+RESPONSE_KEY = 'stages:response:{}'
+
+
+def get_cache():
+    return caches[getattr(settings, 'STAGES_CACHE_ALIAS', 'default')]
+
+
+def enabled():
+    """
+    STAGES_CACHE_ENABLED, ou par défaut (None) : actif sauf sur LocMemCache.
+    Un cache propre à chaque processus ne verrait pas les bump_version des
+    autres workers et servirait des réponses périmées.
+    """
+    setting = getattr(settings, 'STAGES_CACHE_ENABLED', None)
+    if setting is None:
+        return not isinstance(get_cache(), LocMemCache)
+    return setting
+
+
+def _version_key(model):
+    return VERSION_KEY.format(model._meta.label_lower)
+
+
+def get_versions(models):
+    """Compteurs de version des modèles, lus en un seul aller-retour."""
+    cache = get_cache()
+    keys = [_version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Valeur initiale horodatée : un compteur évincé puis recréé ne
+            # retombe jamais sur une version déjà utilisée dans une clé
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_version(model):
+    cache = get_cache()
+    key = _version_key(model)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def _lookup(request, models):
+    """Renvoie (etag, clé, réponse) ; réponse est None si la vue doit être appelée."""
+    versions = get_versions(models)
+    # La date du jour fait partie de la clé : le statut des stages en dépend
+    raw_key = '|'.join([
+        request.get_full_path(), request.headers.get('Accept', ''), date.today().isoformat(),
+        *(str(version) for version in versions),
+    ])
+    digest = hashlib.sha256(raw_key.encode()).hexdigest()
+    etag = quote_etag(digest)
+    key = RESPONSE_KEY.format(digest)
+
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        return etag, key, HttpResponseNotModified()
+    cached = get_cache().get(key)
+    if cached is not None:
+        content, status, content_type = cached
+        return etag, key, HttpResponse(content, status=status, content_type=content_type)
+    return etag, key, None
+
+
+def _cacheable(response):
+    # Les exports en flux (?stream=1) et les erreurs ne sont pas mis en cache
+    return response.status_code == 200 and not response.streaming
+
+
+def _store(key, response):
+    timeout = getattr(settings, 'STAGES_CACHE_TIMEOUT', 300)
+    if routers.used_replica():
+        # Lue sur un réplica, la réponse peut précéder la dernière écriture :
+        # pas plus longtemps en cache que le retard toléré
+        timeout = min(timeout, routers.max_lag())
+    get_cache().set(key, (response.content, response.status_code, response['Content-Type']), timeout)
+
+
+def _finish(response, etag):
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+
+def cached_response(*models):
+    """
+    Met en cache les réponses GET d'une vue. La clé combine l'URL complète,
+    l'en-tête Accept et les versions des modèles lus par la vue : toute
+    écriture sur l'un d'eux (signaux post_save/post_delete) invalide les
+    réponses concernées. L'ETag est dérivé de la clé, si bien qu'un client
+    à jour reçoit un 304 sans requête SQL ni sérialisation. Fonctionne aussi
+    sur les vues async. Sans cache partagé entre les workers (voir enabled),
+    la vue est appelée à chaque fois.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD') or not enabled():
+                    return await view(request, *args, **kwargs)
+                etag, key, response = await sync_to_async(_lookup, thread_sensitive=False)(request, models)
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                    if not _cacheable(response):
+                        return response
+                    await sync_to_async(_store, thread_sensitive=False)(key, response)
+                return _finish(response, etag)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or not enabled():
+                return view(request, *args, **kwargs)
+            etag, key, response = _lookup(request, models)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if not _cacheable(response):
+                    return response
+                _store(key, response)
+            return _finish(response, etag)
+        return wrapper
+    return decorator
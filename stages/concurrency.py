@@ -0,0 +1,53 @@
+from django.forms import modelform_factory
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+
+
+def version_etag(instance):
+    # Le statut d'un stage change avec la date sans nouvelle version :
+    # il entre dans l'ETag (la clé du cache des réponses inclut la date)
+    if hasattr(instance, 'get_statut_effectif'):
+        return quote_etag(f'{instance.version}-{instance.get_statut_effectif()}')
+    return quote_etag(str(instance.version))
+
+
+def check_preconditions(request, instance):
+    """
+    If-None-Match (GET : 304) et If-Match (écritures : 412) comparés à la
+    version courante. Renvoie la réponse à envoyer, ou None pour continuer.
+    """
+    return get_conditional_response(request, etag=version_etag(instance))
+
+
+def conflict_response(request):
+    # 412 si le client avait posé une précondition If-Match, 409 sinon
+    if 'If-Match' in request.headers:
+        return JsonResponse({"error": "La ressource a été modifiée entre-temps."}, status=412)
+    return JsonResponse({"error": "Modification concurrente : rechargez la ressource."}, status=409)
+
+
+def versioned(response, instance):
+    response['ETag'] = version_etag(instance)
+    return response
+
+
+def patch_instance(instance, form_class, data, extra_fields=()):
+    """
+    Mise à jour partielle : seuls les champs présents dans `data` sont
+    validés (formulaire restreint à ces champs) et seuls ceux qui ont
+    réellement changé sont écrits, par save(update_fields=...). Renvoie
+    (champs écrits, erreurs) ; lève VersionConflict si la ligne a changé
+    depuis sa lecture.
+    """
+    fields = [field for field in data if field in form_class.base_fields]
+    if not fields:
+        return [], None
+    form = modelform_factory(instance.__class__, form=form_class, fields=fields)(data, instance=instance)
+    if not form.is_valid():
+        return [], form.errors
+    changed = form.changed_data
+    if changed:
+        form.save(commit=False).save(update_fields=[*changed, 'updated_at', *extra_fields])
+    return changed, None
+
@@ -0,0 +1,168 @@
+import mimetypes
+import os
+import re
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+CHUNK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _file_etag(fieldfile, size, modified):
+    # Nom adressé par le contenu : le SHA-256 est un ETag fort tout trouvé
+    digest = getattr(fieldfile.instance, 'sha256', None)
+    if digest:
+        return quote_etag(digest)
+    return quote_etag(f'{size:x}-{int(modified.timestamp()):x}')
+
+
+class UnsatisfiableRange(ValueError):
+    pass
+
+
+def _parse_range(header, size):
+    """
+    Renvoie (début, fin) inclusifs pour un en-tête Range d'un seul
+    intervalle. None si l'en-tête est à ignorer (plusieurs intervalles,
+    autre unité, syntaxe invalide) : le fichier est alors envoyé en entier.
+    Lève UnsatisfiableRange si l'intervalle est hors du fichier (416).
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match or not any(match.groups()):
+        return None
+    start, end = match.groups()
+    if not start:
+        # bytes=-500 : les 500 derniers octets
+        length = int(end)
+        if length == 0 or size == 0:
+            raise UnsatisfiableRange(header)
+        return max(size - length, 0), size - 1
+    start = int(start)
+    if end and int(end) < start:
+        return None
+    if start >= size:
+        raise UnsatisfiableRange(header)
+    end = min(int(end), size - 1) if end else size - 1
+    return start, end
+
+
+def _read_range(f, start, length):
+    try:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+async def _aread_range(f, start, length):
+    # Lecture dans un thread, envoi dans la boucle : aucun worker n'est
+    # immobilisé pendant que le client télécharge
+    read = sync_to_async(f.read, thread_sensitive=False)
+    try:
+        await sync_to_async(f.seek, thread_sensitive=False)(start)
+        while length > 0:
+            chunk = await read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def _sendfile_response(fieldfile, content_type):
+    backend = getattr(settings, 'STAGES_SENDFILE_BACKEND', None)
+    if backend == 'nginx':
+        # location interne nginx qui pointe sur MEDIA_ROOT
+        prefix = getattr(settings, 'STAGES_SENDFILE_URL_PREFIX', '/protected-media/')
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + fieldfile.name
+        return response
+    if backend in ('apache', 'lighttpd'):
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = fieldfile.path
+        return response
+    return None
+
+
+def serve_file(request, fieldfile, filename, asynchronous=False):
+    """
+    Sert un fichier de rapport : 304 si le client a déjà la bonne version
+    (If-None-Match / If-Modified-Since), délégation au proxy avec
+    X-Accel-Redirect / X-Sendfile si STAGES_SENDFILE_BACKEND est défini,
+    sinon FileResponse avec prise en charge des requêtes Range (reprise).
+    asynchronous=True produit un corps itérable de façon asynchrone (ASGI).
+    """
+    storage = fieldfile.storage
+    size = storage.size(fieldfile.name)
+    modified = storage.get_modified_time(fieldfile.name)
+    etag = _file_etag(fieldfile, size, modified)
+    last_modified = int(modified.timestamp())
+    content_type = mimetypes.guess_type(fieldfile.name)[0] or 'application/octet-stream'
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = _sendfile_response(fieldfile, content_type)
+    if response is None:
+        response = _file_response(request, fieldfile, size, etag, last_modified, content_type, asynchronous)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Accept-Ranges'] = 'bytes'
+    response['Cache-Control'] = 'private, max-age=%d' % getattr(settings, 'STAGES_DOWNLOAD_MAX_AGE', 3600)
+    if response.status_code != 304:
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+async def aserve_file(request, fieldfile, filename):
+    # stat() et open() dans un thread, le contenu est ensuite lu par _aread_range
+    return await sync_to_async(serve_file, thread_sensitive=False)(request, fieldfile, filename, True)
+
+
+def _file_response(request, fieldfile, size, etag, last_modified, content_type, asynchronous=False):
+    header = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    # If-Range : la reprise n'a de sens que si le fichier n'a pas changé
+    if header and if_range and if_range.strip() not in (etag, http_date(last_modified)):
+        header = None
+
+    try:
+        byte_range = _parse_range(header, size) if header else None
+    except UnsatisfiableRange:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    if byte_range:
+        start, end = byte_range
+        f = fieldfile.storage.open(fieldfile.name, 'rb')
+        read_range = _aread_range if asynchronous else _read_range
+        response = StreamingHttpResponse(read_range(f, start, end - start + 1),
+                                         status=206, content_type=content_type)
+        response['Content-Length'] = str(end - start + 1)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        return response
+
+    f = fieldfile.storage.open(fieldfile.name, 'rb')
+    if asynchronous:
+        # FileResponse n'a qu'un itérateur synchrone, que Django sous ASGI lit en entier en mémoire
+        response = StreamingHttpResponse(_aread_range(f, 0, size), content_type=content_type)
+        response['Content-Length'] = str(size)
+        return response
+    return FileResponse(f, content_type=content_type)
+
+
+def download_filename(rapport):
+    extension = os.path.splitext(rapport.fichier.name)[1].lower()
+    return f'rapport_{rapport.pk}{extension}'
@@ -0,0 +1,152 @@
+import asyncio
+import itertools
+import json
+import threading
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+# Marqueur déposé dans la file d'un abonné trop lent : le flux lui envoie
+# « resync » puis se ferme, le client rattrape son retard via /sync/
+RESYNC = object()
+
+
+class Subscription:
+    """
+    Abonnement d'un client au flux d'événements, consommé dans la boucle
+    asyncio qui l'a créé. La file est bornée (STAGES_EVENTS_QUEUE_SIZE) :
+    un client qui ne suit pas est déconnecté au lieu de faire grossir la
+    mémoire du serveur ou de ralentir les autres.
+    """
+
+    def __init__(self, broker, encadrant_ids=None, maxsize=100):
+        self.broker = broker
+        self.encadrant_ids = set(encadrant_ids or ())
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.loop = asyncio.get_running_loop()
+        self.overflowed = False
+
+    def matches(self, event):
+        return not self.encadrant_ids or event.get('encadrant_id') in self.encadrant_ids
+
+    def offer(self, event):
+        # Toujours appelé dans self.loop (call_soon_threadsafe)
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+    async def get(self, timeout):
+        """Prochain événement, RESYNC, ou None si rien n'arrive avant `timeout`."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InMemoryBroker:
+    """
+    Diffusion des événements aux abonnés du même processus. Un autre backend
+    (Redis pub/sub, PostgreSQL LISTEN/NOTIFY...) se branche via
+    STAGES_EVENTS_BROKER en fournissant subscribe(), unsubscribe() et publish().
+    Avec plusieurs processus, seul un backend partagé voit tous les événements.
+    """
+
+    def __init__(self):
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def subscribe(self, encadrant_ids=None):
+        subscription = Subscription(
+            self, encadrant_ids, getattr(settings, 'STAGES_EVENTS_QUEUE_SIZE', 100),
+        )
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, event):
+        # Appelable depuis n'importe quel thread (vues synchrones, commandes)
+        event = {'id': next(self._ids), **event}
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            if not subscription.matches(event):
+                continue
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, event)
+            except RuntimeError:
+                # Boucle fermée : client parti sans se désabonner
+                self.unsubscribe(subscription)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                path = getattr(settings, 'STAGES_EVENTS_BROKER', 'stages.events.InMemoryBroker')
+                _broker = import_string(path)()
+    return _broker
+
+
+def publish(type, action, **data):
+    """
+    Publie un événement compact après le commit de la transaction en cours
+    (rien n'est envoyé si elle est annulée).
+    """
+    event = {'type': type, 'action': action, **data}
+    transaction.on_commit(lambda: get_broker().publish(event))
+
+
+def rapport_event(action, rapport_id, stage_id, encadrant_id, etat):
+    publish('rapport', action, rapport_id=rapport_id, stage_id=stage_id, encadrant_id=encadrant_id, etat=etat)
+
+
+def stage_event(action, stage_id, encadrant_id, statut):
+    publish('stage', action, stage_id=stage_id, encadrant_id=encadrant_id, statut=statut)
+
+
+def format_sse(event):
+    data = json.dumps(event, cls=DjangoJSONEncoder, separators=(',', ':'))
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n"
+
+
+async def sse_stream(subscription):
+    """
+    Corps d'une réponse text/event-stream. Un commentaire est envoyé toutes
+    les STAGES_EVENTS_HEARTBEAT secondes pour garder la connexion ouverte à
+    travers les proxys et détecter les clients partis.
+    """
+    heartbeat = getattr(settings, 'STAGES_EVENTS_HEARTBEAT', 15)
+    try:
+        yield f"retry: {heartbeat * 1000}\n\n"
+        while True:
+            event = await subscription.get(heartbeat)
+            if event is None:
+                yield ": ping\n\n"
+            elif event is RESYNC:
+                yield "event: resync\ndata: {}\n\n"
+                return
+            else:
+                yield format_sse(event)
+    finally:
+        subscription.close()
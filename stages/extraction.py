@@ -0,0 +1,248 @@
+import hashlib
+import logging
+import re
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree.ElementTree import iterparse
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from .models import Rapport
+from . import cache, search
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+TEXT_NS = '{urn:oasis:names:tc:opendocument:xmlns:text:1.0}'
+
+_executor = None
+
+
+def get_max_chars():
+    # Un tsvector PostgreSQL est limité à 1 Mo : on tronque le texte extrait
+    return getattr(settings, 'STAGES_EXTRACTION_MAX_CHARS', 500_000)
+
+
+def get_max_inflated():
+    # Octets décompressés au plus par PDF : une « bombe » deflate de
+    # quelques Mo se décompresserait en plusieurs Go
+    return getattr(settings, 'STAGES_EXTRACTION_MAX_INFLATED', 32 * 1024 * 1024)
+
+
+def file_sha256(fichier):
+    digest = hashlib.sha256()
+    with fichier.open('rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class _TextBuffer:
+    def __init__(self, limit):
+        self.parts = []
+        self.size = 0
+        self.limit = limit
+
+    def add(self, text):
+        if text and self.size < self.limit:
+            text = text[:self.limit - self.size]
+            self.parts.append(text)
+            self.size += len(text)
+
+    @property
+    def full(self):
+        return self.size >= self.limit
+
+    def value(self):
+        return ''.join(self.parts).strip()
+
+
+def _extract_paragraphs(stream, paragraph_tags, paragraph_text, limit):
+    # iterparse + clear() : le XML n'est jamais chargé en entier en mémoire
+    buffer = _TextBuffer(limit)
+    for _, element in iterparse(stream, events=('end',)):
+        if element.tag in paragraph_tags:
+            buffer.add(paragraph_text(element))
+            buffer.add('\n')
+            element.clear()
+            if buffer.full:
+                break
+    return buffer.value()
+
+
+def extract_docx(f, limit):
+    with zipfile.ZipFile(f) as archive, archive.open('word/document.xml') as xml:
+        return _extract_paragraphs(
+            xml, {W_NS + 'p'},
+            lambda p: ''.join(t.text or '' for t in p.iter(W_NS + 't')),
+            limit,
+        )
+
+
+def extract_odt(f, limit):
+    with zipfile.ZipFile(f) as archive, archive.open('content.xml') as xml:
+        return _extract_paragraphs(
+            xml, {TEXT_NS + 'p', TEXT_NS + 'h'},
+            lambda p: ''.join(p.itertext()),
+            limit,
+        )
+
+
+_PDF_STREAM_START = re.compile(rb'stream\r?\n')
+_PDF_STREAM_END = b'\nendstream'
+_PDF_TEXT = re.compile(rb'\((?:\\.|[^\\)])*\)\s*Tj|\[(?:\\.|[^\]])*\]\s*TJ|T\*|Td|TD')
+_PDF_STRING = re.compile(rb'\(((?:\\.|[^\\)])*)\)')
+_PDF_ESCAPES = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'(': b'(', b')': b')', b'\\': b'\\'}
+
+# Les flux de texte font quelques Ko ; au-delà, c'est une image ou une police
+PDF_MAX_STREAM = 4 * 1024 * 1024
+
+
+def _pdf_unescape(raw):
+    return re.sub(rb'\\([nrt()\\]|[0-7]{1,3})',
+                  lambda m: _PDF_ESCAPES.get(m.group(1)) or bytes([int(m.group(1), 8) & 0xFF]),
+                  raw)
+
+
+def _pdf_streams(f, max_stream=PDF_MAX_STREAM):
+    """
+    Contenu des blocs `stream ... endstream` du PDF, lu par morceaux de
+    CHUNK_SIZE. Le tampon ne garde que le flux en cours ; un flux plus gros
+    que `max_stream` est sauté sans être gardé.
+    """
+    pending = b''
+    inside = skipping = False
+    scanned = 0
+    for chunk in f.chunks(CHUNK_SIZE):
+        pending += chunk
+        while True:
+            if not inside:
+                start = _PDF_STREAM_START.search(pending)
+                if start is None:
+                    # Garder de quoi reconnaître un « stream\r\n » coupé en deux
+                    pending = pending[-len('stream\r'):]
+                    break
+                pending = pending[start.end():]
+                inside, skipping, scanned = True, False, 0
+            end = pending.find(_PDF_STREAM_END, scanned)
+            if end < 0:
+                scanned = max(0, len(pending) - len(_PDF_STREAM_END))
+                if skipping or len(pending) > max_stream:
+                    skipping = True
+                    pending, scanned = pending[scanned:], 0
+                break
+            if not skipping:
+                content = pending[:end]
+                yield content[:-1] if content.endswith(b'\r') else content
+            pending = pending[end + len(_PDF_STREAM_END):]
+            inside = False
+
+
+def _pdf_inflate(content, max_length):
+    """Flux décompressé, tronqué à `max_length` octets ; tel quel s'il n'est pas compressé."""
+    try:
+        return zlib.decompressobj().decompress(content, max_length)
+    except zlib.error:
+        return content[:max_length]
+
+
+def extract_pdf(f, limit):
+    """
+    Extraction simple des opérateurs de texte (Tj/TJ) des flux PDF, sans
+    dépendance externe. Suffit pour l'indexation ; les polices à encodage
+    personnalisé donnent un texte partiel. Le fichier est lu par morceaux
+    et la lecture s'arrête dès que `limit` caractères sont extraits, ou
+    dès que les flux décompressés dépassent get_max_inflated() octets.
+    """
+    buffer = _TextBuffer(limit)
+    budget = get_max_inflated()
+    for content in _pdf_streams(f):
+        content = _pdf_inflate(content, budget)
+        budget -= len(content)
+        for op in _PDF_TEXT.finditer(content):
+            token = op.group(0)
+            if token in (b'T*', b'Td', b'TD'):
+                buffer.add(' ')
+                continue
+            for string in _PDF_STRING.findall(token):
+                buffer.add(_pdf_unescape(string).decode('latin-1'))
+        buffer.add('\n')
+        if buffer.full or budget <= 0:
+            break
+    return re.sub(r'[ \t]+', ' ', buffer.value())
+
+
+EXTRACTORS = {
+    '.docx': extract_docx,
+    '.odt': extract_odt,
+    '.pdf': extract_pdf,
+}
+
+
+def extract_text(fichier):
+    name = fichier.name.lower()
+    extractor = next((func for ext, func in EXTRACTORS.items() if name.endswith(ext)), None)
+    if extractor is None:
+        return ''
+    with fichier.open('rb') as f:
+        return extractor(f, get_max_chars())
+
+
+def extract_rapport(rapport_id, force=False):
+    """
+    Extrait le texte du fichier d'un rapport et met à jour son index de
+    recherche. Rien n'est fait si le contenu du fichier n'a pas changé
+    depuis la dernière extraction (même SHA-256).
+    """
+    rapport = Rapport.objects.only('id', 'fichier', 'contenu_hash').filter(pk=rapport_id).first()
+    if rapport is None or not rapport.fichier:
+        return False
+    try:
+        # Fichiers du stockage adressé par le contenu : le nom donne déjà le hash
+        digest = rapport.sha256 or file_sha256(rapport.fichier)
+        if digest == rapport.contenu_hash and not force:
+            return False
+        contenu = extract_text(rapport.fichier)
+    except OSError as exc:
+        logger.warning("Fichier illisible pour le rapport %s : %s", rapport_id, exc)
+        return False
+    except (zipfile.BadZipFile, KeyError, SyntaxError, ValueError) as exc:
+        logger.warning("Extraction impossible pour le rapport %s : %s", rapport_id, exc)
+        contenu = ''
+    # update() : pas de post_save, donc pas de nouvelle extraction planifiée,
+    # mais les réponses en cache (recherche ?q=) doivent être invalidées
+    with transaction.atomic():
+        Rapport.objects.filter(pk=rapport_id).update(contenu=contenu, contenu_hash=digest)
+        search.refresh_rapport_vectors([rapport_id])
+        transaction.on_commit(lambda: cache.bump_version(Rapport))
+    return True
+
+
+def _run(rapport_id):
+    try:
+        extract_rapport(rapport_id)
+    except Exception:
+        logger.exception("Échec de l'extraction du rapport %s", rapport_id)
+    finally:
+        # Chaque thread du pool a sa propre connexion
+        connections.close_all()
+
+
+def schedule_extraction(rapport_id):
+    """
+    Lance l'extraction hors du cycle requête/réponse selon
+    STAGES_EXTRACTION_MODE : 'thread' (pool en arrière-plan), 'sync'
+    (immédiat, pour les tests) ou 'off' (commande extract_rapports).
+    """
+    global _executor
+    mode = getattr(settings, 'STAGES_EXTRACTION_MODE', 'thread')
+    if mode == 'sync':
+        extract_rapport(rapport_id)
+    elif mode == 'thread':
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='extraction')
+        _executor.submit(_run, rapport_id)
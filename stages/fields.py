@@ -0,0 +1,52 @@
+import unicodedata
+
+from django.db import models
+
+
+def normalize(text):
+    """Minuscules, sans accents ni espaces superflus : « Ouédraogo  Pélagie » -> « ouedraogo pelagie »."""
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return ' '.join(''.join(c for c in decomposed if not unicodedata.combining(c)).lower().split())
+
+
+class NormalizedField(models.CharField):
+    """
+    Copie normalisée (normalize) du champ `source`, indexée pour la recherche
+    par préfixe (autocomplétion). Recalculée à chaque sauvegarde, bulk_create
+    compris ; NormalizedFieldsMixin l'ajoute à update_fields avec sa source.
+    """
+
+    def __init__(self, *args, source, **kwargs):
+        self.source = source
+        kwargs.setdefault('editable', False)
+        kwargs.setdefault('default', '')
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs['source'] = self.source
+        del kwargs['editable']
+        if kwargs.get('default') == '':
+            del kwargs['default']
+        return name, path, args, kwargs
+
+    def pre_save(self, model_instance, add):
+        value = normalize(getattr(model_instance, self.source))[:self.max_length]
+        setattr(model_instance, self.attname, value)
+        return value
+
+
+class NormalizedFieldsMixin:
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, *(
+                field.name for field in self._meta.concrete_fields
+                if isinstance(field, NormalizedField) and field.source in update_fields
+            )}
+        return super().save(*args, **kwargs)
+
+
+def public_columns(model):
+    """Colonnes de `model` sans les copies normalisées, pour les .values() exposés par l'API."""
+    return [field.attname for field in model._meta.concrete_fields if not isinstance(field, NormalizedField)]
@@ -0,0 +1,68 @@
+from datetime import date
+
+
+class InvalidParameter(ValueError):
+    pass
+
+
+def get_int(request, name):
+    # Comme ?annee= sur rapports_api : une valeur non numérique est ignorée
+    try:
+        return int(request.GET[name])
+    except (KeyError, ValueError):
+        return None
+
+
+def get_date(request, name):
+    try:
+        return date.fromisoformat(request.GET[name])
+    except (KeyError, ValueError):
+        return None
+
+
+def get_fields(request, allowed):
+    """Colonnes demandées par ?fields=a,b (toutes par défaut), dans l'ordre demandé."""
+    value = request.GET.get('fields')
+    if not value:
+        return list(allowed)
+    fields = list(dict.fromkeys(field.strip() for field in value.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in allowed]
+    if unknown or not fields:
+        raise InvalidParameter(f"Champ inconnu : {', '.join(unknown)}" if unknown else "Paramètre fields vide.")
+    return fields
+
+
+def get_ordering(request, allowed, default):
+    """
+    Tri demandé par ?ordering=-date_debut,theme parmi `allowed` (colonnes
+    non nulles, exigé par la pagination par clé). id est toujours ajouté
+    en dernier pour que la clé de tri soit unique.
+    """
+    value = request.GET.get('ordering')
+    if not value:
+        return list(default)
+    ordering = []
+    for field in value.split(','):
+        field = field.strip()
+        if field.lstrip('-') not in allowed:
+            raise InvalidParameter(f"Tri impossible sur : {field}")
+        if field.lstrip('-') not in (f.lstrip('-') for f in ordering):
+            ordering.append(field)
+    if not any(field.lstrip('-') == 'id' for field in ordering):
+        ordering.append('id')
+    return ordering
+
+
+def sparse_values(queryset, fields, ordering, keep=(), extra=()):
+    """
+    values() réduit aux colonnes demandées et à `keep` (les jointures
+    inutiles disparaissent avec elles). Les colonnes de tri et `extra` sont
+    lues (curseur, annotations) puis retirées par le sérialiseur renvoyé.
+    """
+    columns = [*fields, *keep]
+    hidden = [field.lstrip('-') for field in ordering if field.lstrip('-') not in columns]
+    hidden += [name for name in extra if name not in hidden]
+
+    def serialize(row):
+        return {key: row[key] for key in columns}
+    return queryset.values(*columns, *hidden), serialize
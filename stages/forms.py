@@ -1,5 +1,36 @@
 from django import forms
-from .models import Stagiaire, Stage,Encadrant,Rapport
+from django.urls import reverse
+from .models import Stagiaire, Stage,Encadrant,Rapport, FichierRapport
+
+
+class AutocompleteSelect(forms.Select):
+    """
+    <select> réduit à l'option choisie : les autres sont proposées au fil de
+    la frappe par la vue d'autocomplétion `url_name` (attribut
+    data-autocomplete-url, voir add_stage.html). Le rendu ne lit plus toute
+    la table liée.
+    """
+
+    def __init__(self, url_name, attrs=None):
+        super().__init__(attrs)
+        self.url_name = url_name
+
+    def build_attrs(self, base_attrs, extra_attrs=None):
+        attrs = super().build_attrs(base_attrs, extra_attrs)
+        attrs['data-autocomplete-url'] = reverse(self.url_name)
+        return attrs
+
+    def optgroups(self, name, value, attrs=None):
+        options = []
+        if not self.is_required:
+            options.append(self.create_option(name, '', '---------', False, 0))
+        selected = [v for v in value if v not in self.choices.field.empty_values]
+        if selected:
+            for obj in self.choices.queryset.filter(pk__in=selected):
+                options.append(self.create_option(
+                    name, obj.pk, self.choices.field.label_from_instance(obj), True, len(options)))
+        return [(None, options, 0)]
+
 
 class StagiaireForm(forms.ModelForm):
     class Meta:
@@ -10,6 +41,10 @@ class StageForm(forms.ModelForm):
     class Meta:
         model = Stage
         fields = ['theme', 'type_stage', 'date_debut', 'date_fin', 'statut', 'stagiaire', 'encadrant']
+        widgets = {
+            'stagiaire': AutocompleteSelect('stagiaires_autocomplete'),
+            'encadrant': AutocompleteSelect('encadrants_autocomplete'),
+        }
 
 
 class EncadrantForm(forms.ModelForm):
@@ -17,11 +52,35 @@ class EncadrantForm(forms.ModelForm):
         model = Encadrant
         fields = '__all__'
 
+# Refus d'un dépôt sur un stage en cours (voir Stage.accepte_rapport)
+DEPOT_REFUSE = "Impossible de déposer un rapport : le stage doit être Terminé ou Validé."
+
+# Un rapport ne se modifie ou ne se supprime que tant qu'il est en attente
+MODIFICATION_REFUSEE = "Impossible de modifier : rapport déjà validé ou archivé."
+SUPPRESSION_REFUSEE = "Impossible de supprimer : seul un rapport en attente peut être supprimé."
+
+
+def refus_rapport(rapport, op):
+    """Message de refus de l'opération 'update' ou 'delete' sur `rapport`, None si elle est permise."""
+    if rapport.etat == 'En attente':
+        return None
+    return SUPPRESSION_REFUSEE if op == 'delete' else MODIFICATION_REFUSEE
+
 class RapportForm(forms.ModelForm):
+    # Alternative à l'envoi du fichier : SHA-256 d'un fichier déjà stocké
+    sha256 = forms.CharField(required=False, max_length=64)
+
     class Meta:
         model = Rapport
         fields = ['stage', 'fichier']
-    
+        widgets = {'stage': AutocompleteSelect('stages_autocomplete')}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # rapport_to_dict lit stage.stagiaire : on le charge avec le stage
+        self.fields['stage'].queryset = Stage.objects.select_related('stagiaire')
+        self.fields['fichier'].required = False
+
     def clean_fichier(self):
         f = self.cleaned_data.get('fichier')
         if f:
@@ -31,3 +90,18 @@ class RapportForm(forms.ModelForm):
             if f.size > 15 * 1024 * 1024:
                 raise forms.ValidationError("Taille du fichier supérieure à 15 Mo.")
         return f
+
+    def clean(self):
+        cleaned_data = super().clean()
+        sha256 = (cleaned_data.get('sha256') or '').lower()
+        if cleaned_data.get('fichier') or 'fichier' in self.errors:
+            return cleaned_data
+        if sha256:
+            blob = FichierRapport.objects.filter(sha256=sha256).first()
+            if blob is None:
+                self.add_error('sha256', "Fichier inconnu : envoyez le fichier.")
+            else:
+                cleaned_data['fichier'] = blob.fichier
+        elif not (self.instance.pk and self.instance.fichier):
+            self.add_error('fichier', "Ce champ est obligatoire.")
+        return cleaned_data
@@ -0,0 +1,149 @@
+import csv
+import io
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .models import Stagiaire, Encadrant, Stage
+from . import cache, search, stats
+
+# Colonnes acceptées par ressource ; pour les stages, stagiaire et encadrant
+# sont désignés par leur email
+FIELDS = {
+    'stagiaires': ['nom', 'prenom', 'ecole', 'filiere', 'email', 'telephone'],
+    'encadrants': ['nom', 'prenom', 'institution', 'email', 'telephone'],
+    'stages': ['theme', 'type_stage', 'date_debut', 'date_fin', 'statut', 'stagiaire', 'encadrant'],
+}
+
+MODELS = {
+    'stagiaires': Stagiaire,
+    'encadrants': Encadrant,
+    'stages': Stage,
+}
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+def parse_rows(content, fmt):
+    """Lit un tableau JSON d'objets ou un CSV avec ligne d'en-tête."""
+    if isinstance(content, bytes):
+        content = content.decode('utf-8-sig')
+    if fmt == 'json':
+        try:
+            rows = json.loads(content)
+        except ValueError as exc:
+            raise ImportFormatError(f"JSON invalide : {exc}")
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise ImportFormatError("Un tableau JSON d'objets est attendu.")
+        return rows
+    sample = content[:4096]
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    return list(csv.DictReader(io.StringIO(content), dialect=dialect))
+
+
+def _clean_value(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _resolve_emails(model, rows, column):
+    # Une seule requête pour toutes les références de la colonne
+    emails = {_clean_value(row.get(column)) for row in rows} - {None}
+    if not emails:
+        return {}
+    return dict(model.objects.filter(email__in=emails).values_list('email', 'id'))
+
+
+def build_instances(resource, rows):
+    """
+    Valide toutes les lignes en mémoire. Renvoie (instances, erreurs) où
+    erreurs est une liste de {"ligne": n, "errors": {...}} (n à partir de 1).
+    """
+    model = MODELS[resource]
+    fields = FIELDS[resource]
+    errors = []
+    instances = []
+
+    existing_emails = set()
+    stagiaires, encadrants = {}, {}
+    if resource == 'stages':
+        stagiaires = _resolve_emails(Stagiaire, rows, 'stagiaire')
+        encadrants = _resolve_emails(Encadrant, rows, 'encadrant')
+    else:
+        existing_emails = set(_resolve_emails(model, rows, 'email'))
+    seen_emails = set()
+
+    for line, row in enumerate(rows, start=1):
+        data = {field: _clean_value(row.get(field)) for field in fields}
+        row_errors = {}
+        exclude = []
+
+        if resource == 'stages':
+            stagiaire = data.pop('stagiaire')
+            encadrant = data.pop('encadrant')
+            if data['statut'] is None:
+                data.pop('statut')
+            data['stagiaire_id'] = stagiaires.get(stagiaire)
+            data['encadrant_id'] = encadrants.get(encadrant) if encadrant else None
+            if data['stagiaire_id'] is None:
+                row_errors['stagiaire'] = [f"Stagiaire introuvable : {stagiaire or '(vide)'}"]
+            if encadrant and data['encadrant_id'] is None:
+                row_errors['encadrant'] = [f"Encadrant introuvable : {encadrant}"]
+            exclude = ['stagiaire', 'encadrant']
+        else:
+            email = data.get('email')
+            if email in existing_emails:
+                row_errors['email'] = ["Cet email existe déjà."]
+            elif email and email in seen_emails:
+                row_errors['email'] = ["Email en double dans le fichier."]
+            seen_emails.add(email)
+
+        instance = model(**data)
+        try:
+            # Unicité et clés étrangères sont vérifiées ci-dessus en une requête
+            instance.full_clean(exclude=exclude, validate_unique=False)
+        except ValidationError as exc:
+            for field, messages in exc.message_dict.items():
+                row_errors.setdefault(field, []).extend(messages)
+
+        if row_errors:
+            errors.append({'ligne': line, 'errors': row_errors})
+        else:
+            if resource == 'stages':
+                instance.update_statut()
+            instances.append(instance)
+    return instances, errors
+
+
+def import_rows(resource, rows, dry_run=False):
+    """
+    Importe les lignes en tout ou rien : si une ligne est invalide, rien
+    n'est inséré et les erreurs sont renvoyées ligne par ligne. Sinon les
+    lignes sont insérées par bulk_create (STAGES_IMPORT_BATCH_SIZE) dans
+    une seule transaction.
+    """
+    instances, errors = build_instances(resource, rows)
+    result = {'lignes': len(rows), 'created': 0, 'errors': errors}
+    if errors or dry_run:
+        return result
+
+    model = MODELS[resource]
+    batch_size = getattr(settings, 'STAGES_IMPORT_BATCH_SIZE', 1000)
+    with transaction.atomic():
+        created = model.objects.bulk_create(instances, batch_size=batch_size)
+        # bulk_create n'envoie pas post_save : index de recherche et cache à la main
+        if resource == 'stages':
+            search.refresh_search_vectors(stage.pk for stage in created if stage.pk)
+            stats.apply(stats.count_stages(created))
+        transaction.on_commit(lambda: cache.bump_version(model))
+    result['created'] = len(created)
+    return result
@@ -0,0 +1,103 @@
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+from django.core.management.base import BaseCommand
+
+from stages.benchmark import percentile
+
+READ_PATHS = ['/stagiaires/api/', '/stages/api/', '/rapports/api/', '/rapports/api/?stream=1']
+
+
+def multipart(fields, filename, content):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="fichier"; filename="{filename}"\r\n'
+        f'Content-Type: application/octet-stream\r\n\r\n'.encode()
+    )
+    parts.append(content)
+    parts.append(f'\r\n--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class Command(BaseCommand):
+    help = (
+        "Charge un serveur en cours d'exécution (lectures + dépôts concurrents) et affiche "
+        "requêtes/s et latences p50/p99 en JSON. Lancer une fois contre le serveur WSGI "
+        "(gunicorn gestion_stages.wsgi) et une fois contre le serveur ASGI "
+        "(uvicorn gestion_stages.asgi) avec les mêmes paramètres pour comparer."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('base_url', help="Ex. : http://127.0.0.1:8000")
+        parser.add_argument('--stage', type=int, required=True, help="Stage Terminé ou Validé recevant les dépôts")
+        parser.add_argument('--duration', type=float, default=30, help="Durée en secondes")
+        parser.add_argument('--readers', type=int, default=32, help="Clients en lecture simultanés")
+        parser.add_argument('--uploaders', type=int, default=4, help="Clients en dépôt simultanés")
+        parser.add_argument('--upload-size', type=int, default=15 * 1024 * 1024, help="Taille des fichiers déposés (octets)")
+        parser.add_argument('--label', default='', help="Nom du run (ex. wsgi, asgi) repris dans le JSON")
+
+    def handle(self, *args, **options):
+        base = options['base_url'].rstrip('/')
+        deadline = time.monotonic() + options['duration']
+        results = {'lecture': [], 'depot': []}
+        errors = {'lecture': 0, 'depot': 0}
+        lock = threading.Lock()
+
+        def call(kind, request):
+            start = time.perf_counter()
+            try:
+                with urlopen(request, timeout=120) as response:
+                    while response.read(64 * 1024):
+                        pass
+                ok = True
+            except (HTTPError, URLError, OSError):
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                if ok:
+                    results[kind].append(elapsed)
+                else:
+                    errors[kind] += 1
+
+        def reader(index):
+            i = index
+            while time.monotonic() < deadline:
+                call('lecture', Request(base + READ_PATHS[i % len(READ_PATHS)]))
+                i += 1
+
+        def uploader(index):
+            while time.monotonic() < deadline:
+                # Contenu aléatoire : pas de dédoublonnage qui fausserait le coût du dépôt
+                content = os.urandom(options['upload_size'])
+                body, content_type = multipart({'stage': options['stage']}, f'bench_{index}.pdf', content)
+                call('depot', Request(base + '/rapports/api/create/', data=body,
+                                      headers={'Content-Type': content_type}, method='POST'))
+
+        workers = options['readers'] + options['uploaders']
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for i in range(options['readers']):
+                pool.submit(reader, i)
+            for i in range(options['uploaders']):
+                pool.submit(uploader, i)
+        duration = time.monotonic() - started
+
+        report = {'label': options['label'], 'base_url': base, 'duration_s': round(duration, 2)}
+        for kind, latencies in results.items():
+            report[kind] = {
+                'requests': len(latencies),
+                'errors': errors[kind],
+                'rps': round(len(latencies) / duration, 2),
+                'p50_ms': round(percentile(latencies, 50) * 1000, 1) if latencies else None,
+                'p99_ms': round(percentile(latencies, 99) * 1000, 1) if latencies else None,
+            }
+        self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,64 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from stages.benchmark import EmptyDatabase, compare, run
+
+
+class Command(BaseCommand):
+    help = (
+        "Mesure chaque route de stages.urls par le client de test (p50/p95/p99, requêtes SQL, "
+        "pic mémoire) sur la base courante remplie par generate_data, et écrit un rapport JSON. "
+        "Avec --compare, signale les régressions par rapport à un rapport précédent."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--route', action='append', dest='routes', help="Nom d'URL à mesurer (répétable)")
+        parser.add_argument('--warm-cache', action='store_true',
+                            help="Garder le cache des réponses entre les itérations (vidé par défaut)")
+        parser.add_argument('--output', help="Fichier JSON de sortie (sortie standard par défaut)")
+        parser.add_argument('--compare', help="Rapport JSON de référence")
+        parser.add_argument('--tolerance', type=float, default=0.25, help="Ralentissement p95 toléré (0.25 = +25 %%)")
+        parser.add_argument('--fail-on-regression', action='store_true', help="Code de sortie non nul en cas de régression")
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError("--iterations doit valoir au moins 1.")
+        reference = None
+        if options['compare']:
+            try:
+                reference = json.loads(Path(options['compare']).read_text())
+            except (OSError, ValueError) as exc:
+                raise CommandError(f"Rapport de référence illisible : {exc}")
+
+        try:
+            report = run(
+                iterations=options['iterations'], warmup=options['warmup'], routes=options['routes'],
+                warm_cache=options['warm_cache'], log=lambda message: self.stderr.write(message),
+            )
+        except EmptyDatabase as exc:
+            raise CommandError(str(exc))
+
+        if reference is not None:
+            if reference.get('environnement', {}).get('donnees') != report['environnement']['donnees']:
+                self.stderr.write(self.style.WARNING(
+                    "Volumes de données différents de la référence : comparaison indicative."))
+            report['regressions'] = compare(report, reference, options['tolerance'])
+
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            Path(options['output']).write_text(output)
+        else:
+            self.stdout.write(output)
+
+        for name in report['non_couvertes']:
+            self.stderr.write(self.style.WARNING(f"Route sans scénario : {name}"))
+        for regression in report.get('regressions', []):
+            self.stderr.write(self.style.ERROR(
+                f"Régression {regression['scenario']} ({regression['mesure']}) : "
+                f"{regression['avant']} -> {regression['apres']}"))
+        if report.get('regressions') and options['fail_on_regression']:
+            raise CommandError(f"{len(report['regressions'])} régression(s).")
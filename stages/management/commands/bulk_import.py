@@ -0,0 +1,33 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from stages.imports import FIELDS, ImportFormatError, import_rows, parse_rows
+
+
+class Command(BaseCommand):
+    help = "Importe en masse des stagiaires, encadrants ou stages depuis un fichier CSV ou JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('resource', choices=sorted(FIELDS))
+        parser.add_argument('path', help="Fichier .csv ou .json")
+        parser.add_argument('--dry-run', action='store_true', help="Valider sans rien insérer")
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        fmt = 'json' if path.suffix.lower() == '.json' else 'csv'
+        try:
+            rows = parse_rows(path.read_bytes(), fmt)
+        except (OSError, ImportFormatError, UnicodeDecodeError) as exc:
+            raise CommandError(str(exc))
+
+        result = import_rows(options['resource'], rows, dry_run=options['dry_run'])
+        for error in result['errors']:
+            self.stderr.write(f"Ligne {error['ligne']} : {json.dumps(error['errors'], ensure_ascii=False)}")
+        if result['errors']:
+            raise CommandError(f"{len(result['errors'])} ligne(s) invalide(s), rien n'a été importé.")
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f"{result['lignes']} ligne(s) valides."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{result['created']} ligne(s) importée(s)."))
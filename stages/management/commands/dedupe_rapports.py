@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from stages import storage, cache
+from stages.models import Rapport
+
+
+class Command(BaseCommand):
+    help = "Range les fichiers de rapports existants dans le stockage adressé par le contenu (dédoublonnage)."
+
+    def handle(self, *args, **options):
+        moved = 0
+        legacy = (
+            Rapport.objects.exclude(fichier='')
+            .values_list('fichier', flat=True).distinct().order_by('fichier')
+        )
+        for name in list(legacy):
+            if storage.sha256_from_name(name):
+                continue
+            if not storage.rapport_storage.exists(name):
+                self.stderr.write(f"Fichier introuvable : {name}")
+                continue
+            with transaction.atomic():
+                with storage.rapport_storage.open(name, 'rb') as f:
+                    blob_name = storage.rapport_storage.save(name, f)
+                rapports = Rapport.objects.filter(fichier=name)
+                # update() : pas de signaux, les références sont comptées ici
+                count = rapports.update(fichier=blob_name, derniere_modif=timezone.now())
+                storage.acquire(blob_name, count)
+            storage.rapport_storage.delete(name)
+            moved += 1
+            self.stdout.write(f"{name} -> {blob_name} ({count} rapport(s))")
+        if moved:
+            # update() ne déclenche pas les signaux : fichier_url a changé
+            cache.bump_version(Rapport)
+        self.stdout.write(self.style.SUCCESS(f"{moved} fichier(s) déplacé(s)."))
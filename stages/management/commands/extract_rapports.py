@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from stages.extraction import extract_rapport
+from stages.models import Rapport
+
+
+class Command(BaseCommand):
+    help = "Extrait le texte des fichiers de rapports pour la recherche plein texte."
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', type=int, help="Rapports à traiter (par défaut : ceux jamais extraits)")
+        parser.add_argument('--all', action='store_true', help="Vérifier tous les rapports (fichiers modifiés)")
+        parser.add_argument('--force', action='store_true', help="Ré-extraire même si le fichier est inchangé")
+
+    def handle(self, *args, **options):
+        rapports = Rapport.objects.exclude(fichier='')
+        if options['ids']:
+            rapports = rapports.filter(pk__in=options['ids'])
+        elif not (options['all'] or options['force']):
+            rapports = rapports.filter(contenu_hash='')
+
+        done = 0
+        for pk in rapports.values_list('pk', flat=True).iterator():
+            if extract_rapport(pk, force=options['force']):
+                done += 1
+        self.stdout.write(self.style.SUCCESS(f"{done} rapport(s) indexé(s)."))
@@ -0,0 +1,41 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from stages.synthetic import generate
+
+
+class Command(BaseCommand):
+    help = (
+        "Génère un jeu de données synthétique (stagiaires, encadrants, stages, rapports "
+        "avec petits fichiers factices) par bulk_create, pour les mesures de performance. "
+        "Ex. : generate_data --stagiaires 100000 --rapports 500000"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stagiaires', type=int, default=1000)
+        parser.add_argument('--encadrants', type=int, default=None, help="Par défaut : un pour dix stagiaires")
+        parser.add_argument('--stages', type=int, default=None, help="Par défaut : un par stagiaire")
+        parser.add_argument('--rapports', type=int, default=None, help="Par défaut : cinq par stagiaire")
+        parser.add_argument('--fichiers', type=int, default=20, help="Nombre de fichiers distincts partagés par les rapports")
+        parser.add_argument('--taille', type=int, default=2048, help="Taille des fichiers factices (octets)")
+        parser.add_argument('--seed', type=int, default=0, help="Graine : même graine, mêmes données")
+        parser.add_argument('--batch-size', type=int, default=None, help="Par défaut : STAGES_IMPORT_BATCH_SIZE")
+
+    def handle(self, *args, **options):
+        stagiaires = options['stagiaires']
+        encadrants = options['encadrants'] if options['encadrants'] is not None else max(1, stagiaires // 10)
+        values = [stagiaires, encadrants, options['stages'], options['rapports'], options['fichiers'], options['taille']]
+        if any(value is not None and value < 0 for value in values):
+            raise CommandError("Les nombres doivent être positifs.")
+        if options['rapports'] != 0 and options['fichiers'] < 1:
+            raise CommandError("--fichiers doit valoir au moins 1 pour générer des rapports.")
+
+        counts = generate(
+            stagiaires=stagiaires, encadrants=encadrants,
+            stages=options['stages'], rapports=options['rapports'],
+            fichiers=options['fichiers'], taille=options['taille'],
+            seed=options['seed'], batch_size=options['batch_size'],
+            log=lambda message: self.stderr.write(message),
+        )
+        self.stdout.write(json.dumps(counts))
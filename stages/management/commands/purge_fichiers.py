@@ -0,0 +1,17 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from stages.storage import purge_orphans
+
+
+class Command(BaseCommand):
+    help = "Supprime les fichiers de rapports qu'aucun rapport ne référence (dépôts annulés)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24,
+                            help="Âge minimal des fichiers supprimés, en heures (défaut : 24)")
+
+    def handle(self, *args, **options):
+        count = purge_orphans(timedelta(hours=options['hours']))
+        self.stdout.write(self.style.SUCCESS(f"{count} fichier(s) supprimé(s)."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from stages.sync import purge
+
+
+class Command(BaseCommand):
+    help = "Supprime les traces de suppression plus anciennes que STAGES_SYNC_RETENTION_DAYS."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help="Durée de conservation en jours (par défaut : STAGES_SYNC_RETENTION_DAYS)")
+
+    def handle(self, *args, **options):
+        count = purge(options['days'])
+        self.stdout.write(self.style.SUCCESS(f"{count} trace(s) supprimée(s)."))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from stages import cache, stats
+from stages.models import Statistique
+
+
+class Command(BaseCommand):
+    help = "Recalcule entièrement les compteurs du tableau de bord (/stats/) depuis les stages et les rapports."
+
+    def handle(self, *args, **options):
+        lignes = stats.rebuild()
+        cache.bump_version(Statistique)
+        self.stdout.write(self.style.SUCCESS(f"{lignes} compteur(s) recalculé(s)."))
@@ -0,0 +1,16 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from stages.workflow import terminer_stages_echus
+
+
+class Command(BaseCommand):
+    help = "Passe à « Terminé » les stages en cours dont la date de fin est dépassée (à lancer chaque jour)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=date.fromisoformat, help="Date de référence AAAA-MM-JJ (par défaut : aujourd'hui)")
+
+    def handle(self, *args, **options):
+        ids = terminer_stages_echus(options['date'])
+        self.stdout.write(self.style.SUCCESS(f"{len(ids)} stage(s) terminé(s)."))
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stages', '0004_remove_rapport_titre_alter_rapport_date_depot'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rapport',
+            index=models.Index(fields=['-date_depot', 'id'], name='rapport_depot_id_idx'),
+        ),
+    ]
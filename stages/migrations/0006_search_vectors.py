@@ -0,0 +1,83 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:39
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension, UnaccentExtension
+from django.db import migrations
+
+from stages.operations import AddPostgresIndex, PostgresRunSQL
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stages', '0005_rapport_depot_id_idx'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        UnaccentExtension(),
+        PostgresRunSQL(
+            sql="""
+                CREATE TEXT SEARCH CONFIGURATION french_unaccent (COPY = french);
+                ALTER TEXT SEARCH CONFIGURATION french_unaccent
+                    ALTER MAPPING FOR hword, hword_part, word WITH unaccent, french_stem;
+            """,
+            reverse_sql="DROP TEXT SEARCH CONFIGURATION IF EXISTS french_unaccent;",
+        ),
+        migrations.AddField(
+            model_name='rapport',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='stage',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        AddPostgresIndex(
+            model_name='encadrant',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['nom'], name='encadrant_nom_trgm', opclasses=['gin_trgm_ops']),
+        ),
+        AddPostgresIndex(
+            model_name='encadrant',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['prenom'], name='encadrant_prenom_trgm', opclasses=['gin_trgm_ops']),
+        ),
+        AddPostgresIndex(
+            model_name='rapport',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='rapport_search_idx'),
+        ),
+        AddPostgresIndex(
+            model_name='stage',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='stage_search_idx'),
+        ),
+        AddPostgresIndex(
+            model_name='stage',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['theme'], name='stage_theme_trgm', opclasses=['gin_trgm_ops']),
+        ),
+        AddPostgresIndex(
+            model_name='stagiaire',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['nom'], name='stagiaire_nom_trgm', opclasses=['gin_trgm_ops']),
+        ),
+        AddPostgresIndex(
+            model_name='stagiaire',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['prenom'], name='stagiaire_prenom_trgm', opclasses=['gin_trgm_ops']),
+        ),
+        # Remplissage initial des vecteurs pour les lignes existantes
+        PostgresRunSQL(
+            sql="""
+                UPDATE stages_stage AS s SET search_vector =
+                    setweight(to_tsvector('french_unaccent', coalesce(s.theme, '')), 'A')
+                    || setweight(to_tsvector('french_unaccent', st.prenom || ' ' || st.nom), 'B')
+                    || setweight(to_tsvector('french_unaccent', coalesce(
+                        (SELECT e.prenom || ' ' || e.nom FROM stages_encadrant AS e WHERE e.id = s.encadrant_id), ''
+                    )), 'C')
+                FROM stages_stagiaire AS st
+                WHERE st.id = s.stagiaire_id;
+                UPDATE stages_rapport AS r SET search_vector = s.search_vector
+                FROM stages_stage AS s
+                WHERE s.id = r.stage_id;
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
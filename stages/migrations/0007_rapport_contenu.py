@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stages', '0006_search_vectors'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rapport',
+            name='contenu',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='rapport',
+            name='contenu_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+    ]
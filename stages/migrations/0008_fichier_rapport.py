@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:42
+
+import stages.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stages', '0007_rapport_contenu'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FichierRapport',
+            fields=[
+                ('sha256', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('fichier', models.CharField(max_length=255)),
+                ('taille', models.BigIntegerField()),
+                ('nb_references', models.PositiveIntegerField(default=0)),
+                ('date_creation', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='rapport',
+            name='fichier',
+            field=models.FileField(storage=stages.storage.get_rapport_storage, upload_to='rapports/'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stages', '0008_fichier_rapport'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stage',
+            index=models.Index(fields=['statut', 'date_fin'], name='stage_statut_fin_idx'),
+        ),
+    ]
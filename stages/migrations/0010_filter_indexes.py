@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stages', '0009_stage_statut_fin_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rapport',
+            index=models.Index(fields=['etat', '-date_depot', 'id'], name='rapport_etat_depot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stage',
+            index=models.Index(fields=['encadrant', 'date_debut'], name='stage_encadrant_debut_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stagiaire',
+            index=models.Index(fields=['filiere', 'ecole'], name='stagiaire_filiere_ecole_idx'),
+        ),
+    ]
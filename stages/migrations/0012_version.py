@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stages', '0011_sync_feed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='encadrant',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='stage',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='stagiaire',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
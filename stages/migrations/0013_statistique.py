@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:09
+
+from django.db import migrations, models
+
+from stages import stats
+
+
+def fill_statistiques(apps, schema_editor):
+    # Compteurs des stages et rapports existants
+    stats.rebuild(apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stages', '0012_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Statistique',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('annee', models.PositiveSmallIntegerField()),
+                ('dimension', models.CharField(max_length=20)),
+                ('valeur', models.CharField(blank=True, default='', max_length=150)),
+                ('total', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('annee', 'dimension', 'valeur'), name='statistique_cle')],
+            },
+        ),
+        migrations.RunPython(fill_statistiques, migrations.RunPython.noop),
+    ]
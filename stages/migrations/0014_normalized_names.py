@@ -0,0 +1,83 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:17
+
+import stages.fields
+from django.db import migrations, models
+
+
+SOURCES = {
+    'stagiaire': {'nom_normalise': 'nom', 'prenom_normalise': 'prenom'},
+    'encadrant': {'nom_normalise': 'nom', 'prenom_normalise': 'prenom'},
+    'stage': {'theme_normalise': 'theme'},
+}
+
+
+def fill_normalized(apps, schema_editor):
+    # Lignes existantes : par lots, avant la création des index
+    for model_name, fields in SOURCES.items():
+        model = apps.get_model('stages', model_name)
+        rows = model.objects.only('id', *fields.values()).order_by('id').iterator(chunk_size=2000)
+        batch = []
+        for row in rows:
+            for target, source in fields.items():
+                setattr(row, target, stages.fields.normalize(getattr(row, source)))
+            batch.append(row)
+            if len(batch) == 1000:
+                model.objects.bulk_update(batch, list(fields))
+                batch = []
+        model.objects.bulk_update(batch, list(fields))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stages', '0013_statistique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='encadrant',
+            name='nom_normalise',
+            field=stages.fields.NormalizedField(max_length=100, source='nom'),
+        ),
+        migrations.AddField(
+            model_name='encadrant',
+            name='prenom_normalise',
+            field=stages.fields.NormalizedField(max_length=100, source='prenom'),
+        ),
+        migrations.AddField(
+            model_name='stage',
+            name='theme_normalise',
+            field=stages.fields.NormalizedField(max_length=255, source='theme'),
+        ),
+        migrations.AddField(
+            model_name='stagiaire',
+            name='nom_normalise',
+            field=stages.fields.NormalizedField(max_length=100, source='nom'),
+        ),
+        migrations.AddField(
+            model_name='stagiaire',
+            name='prenom_normalise',
+            field=stages.fields.NormalizedField(max_length=100, source='prenom'),
+        ),
+        migrations.RunPython(fill_normalized, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='encadrant',
+            index=models.Index(fields=['nom_normalise'], name='encadrant_nom_norm_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='encadrant',
+            index=models.Index(fields=['prenom_normalise'], name='encadrant_prenom_norm_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='stage',
+            index=models.Index(fields=['theme_normalise'], name='stage_theme_norm_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='stagiaire',
+            index=models.Index(fields=['nom_normalise'], name='stagiaire_nom_norm_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='stagiaire',
+            index=models.Index(fields=['prenom_normalise'], name='stagiaire_prenom_norm_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stages', '0014_normalized_names'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stage',
+            index=models.Index(fields=['date_debut', 'id'], name='stage_debut_idx'),
+        ),
+    ]
@@ -1,38 +1,159 @@
-from django.db import models
+from django.db import models, transaction
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from datetime import date
 from django.utils import timezone
 from datetime import date, datetime
 
+from .fields import NormalizedField, NormalizedFieldsMixin
+from .storage import get_rapport_storage, sha256_from_name
 
 
-class Stagiaire(models.Model):
+
+class VersionConflict(Exception):
+    """La ligne a été modifiée depuis sa lecture (verrouillage optimiste)."""
+
+
+class VersionedModel(models.Model):
+    """
+    Verrouillage optimiste : chaque sauvegarde d'une ligne existante est un
+    UPDATE ... WHERE id = ... AND version = <version lue>, qui incrémente la
+    version. Si la ligne a changé entre-temps, VersionConflict est levée au
+    lieu d'écraser silencieusement l'autre écriture.
+    """
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            return super().save(*args, **kwargs)
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
+        self._expected_version = self.version
+        self.version += 1
+        try:
+            super().save(*args, **kwargs)
+        except Exception:
+            self.version = self._expected_version
+            raise
+        finally:
+            self._expected_version = None
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        expected = getattr(self, '_expected_version', None)
+        if expected is None:
+            return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+        if base_qs.filter(pk=pk_val, version=expected)._update(values) > 0:
+            return True
+        if base_qs.filter(pk=pk_val).exists():
+            raise VersionConflict(f"{self._meta.label} #{pk_val} : version {expected} périmée")
+        return False
+
+
+class TracksLoadedValues:
+    """
+    Garde les valeurs lues en base des champs `tracked_fields`, pour savoir
+    à la sauvegarde ce qui a changé sans relire la ligne (stages.stats).
+    """
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {
+            name: value for name, value in zip(field_names, values) if name in cls.tracked_fields
+        }
+        return instance
+
+
+class Stagiaire(TracksLoadedValues, NormalizedFieldsMixin, VersionedModel):
     nom = models.CharField(max_length=100)
     prenom = models.CharField(max_length=100)
+    # Noms sans accents ni majuscules, pour l'autocomplétion (stages.search)
+    nom_normalise = NormalizedField(max_length=100, source='nom')
+    prenom_normalise = NormalizedField(max_length=100, source='prenom')
     ecole = models.CharField(max_length=150, blank=True, null=True)
     filiere = models.CharField(max_length=150, blank=True, null=True)
     email = models.EmailField(unique=True)
     telephone = models.CharField(max_length=20, blank=True, null=True)
+    # Date de dernière modification, pour la synchronisation incrémentale (/sync/)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    tracked_fields = ('ecole', 'filiere')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['filiere', 'ecole'], name='stagiaire_filiere_ecole_idx'),
+            GinIndex(fields=['nom'], opclasses=['gin_trgm_ops'], name='stagiaire_nom_trgm'),
+            GinIndex(fields=['prenom'], opclasses=['gin_trgm_ops'], name='stagiaire_prenom_trgm'),
+            # Recherche par préfixe (LIKE 'abc%') quelle que soit la collation
+            models.Index(fields=['nom_normalise'], opclasses=['varchar_pattern_ops'], name='stagiaire_nom_norm_idx'),
+            models.Index(fields=['prenom_normalise'], opclasses=['varchar_pattern_ops'], name='stagiaire_prenom_norm_idx'),
+        ]
 
     def __str__(self):
         return f"{self.prenom} {self.nom}"
 
 
-class Encadrant(models.Model):
+class Encadrant(NormalizedFieldsMixin, VersionedModel):
     nom = models.CharField(max_length=100)
     prenom = models.CharField(max_length=100)
+    nom_normalise = NormalizedField(max_length=100, source='nom')
+    prenom_normalise = NormalizedField(max_length=100, source='prenom')
     institution = models.CharField(
         max_length=20,
         choices=[('Interne', 'Interne'), ('Externe', 'Externe')]
     )
     email = models.EmailField(unique=True)
     telephone = models.CharField(max_length=20, blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['nom'], opclasses=['gin_trgm_ops'], name='encadrant_nom_trgm'),
+            GinIndex(fields=['prenom'], opclasses=['gin_trgm_ops'], name='encadrant_prenom_trgm'),
+            models.Index(fields=['nom_normalise'], opclasses=['varchar_pattern_ops'], name='encadrant_nom_norm_idx'),
+            models.Index(fields=['prenom_normalise'], opclasses=['varchar_pattern_ops'], name='encadrant_prenom_norm_idx'),
+        ]
 
     def __str__(self):
         return f"{self.prenom} {self.nom}"
 
 
-class Stage(models.Model):
+class StageQuerySet(models.QuerySet):
+    def with_statut_effectif(self, today=None):
+        """
+        Annote statut_effectif, le statut calculé en SQL à partir de date_fin :
+        juste même pour les stages échus que update_statuts n'a pas encore traités.
+        """
+        today = today or date.today()
+        return self.annotate(statut_effectif=models.Case(
+            models.When(statut='Validé', then=models.Value('Validé')),
+            models.When(date_fin__lt=today, then=models.Value('Terminé')),
+            default=models.Value('En cours'),
+            output_field=models.CharField(),
+        ))
+
+    def filter_statut(self, statut, today=None):
+        """
+        Filtre sur le statut effectif, écrit sur les colonnes elles-mêmes
+        (et non sur l'annotation) pour profiter de l'index (statut, date_fin).
+        """
+        today = today or date.today()
+        if statut == 'Validé':
+            return self.filter(statut='Validé')
+        if statut == 'Terminé':
+            return self.filter(statut__in=['En cours', 'Terminé'], date_fin__lt=today)
+        if statut == 'En cours':
+            return self.filter(statut__in=['En cours', 'Terminé'], date_fin__gte=today)
+        return self.none()
+
+
+class Stage(TracksLoadedValues, NormalizedFieldsMixin, VersionedModel):
     theme = models.CharField(max_length=255)
+    theme_normalise = NormalizedField(max_length=255, source='theme')
     type_stage = models.CharField(
         max_length=20,
         choices=[('Academique', 'Académique'), ('Professionnel', 'Professionnel')]
@@ -47,18 +168,50 @@ class Stage(models.Model):
     )
     stagiaire = models.ForeignKey('Stagiaire', on_delete=models.CASCADE)
     encadrant = models.ForeignKey('Encadrant', on_delete=models.SET_NULL, null=True)
+    # Thème + noms du stagiaire et de l'encadrant, tenu à jour par stages.search
+    search_vector = SearchVectorField(null=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = StageQuerySet.as_manager()
+
+    tracked_fields = ('date_debut', 'statut', 'type_stage', 'stagiaire_id')
+
+    class Meta:
+        indexes = [
+            # Stages échus encore « En cours » (update_statuts)
+            models.Index(fields=['statut', 'date_fin'], name='stage_statut_fin_idx'),
+            # Stages d'un encadrant triés par date (filtre ?encadrant= de stages_api)
+            models.Index(fields=['encadrant', 'date_debut'], name='stage_encadrant_debut_idx'),
+            # Hiérarchie par date de l'admin (bornes min/max, années) et filtres ?du= / ?au=
+            models.Index(fields=['date_debut', 'id'], name='stage_debut_idx'),
+            GinIndex(fields=['search_vector'], name='stage_search_idx'),
+            GinIndex(fields=['theme'], opclasses=['gin_trgm_ops'], name='stage_theme_trgm'),
+            models.Index(fields=['theme_normalise'], opclasses=['varchar_pattern_ops'], name='stage_theme_norm_idx'),
+        ]
+
+    def get_statut_effectif(self, today=None):
+        today = today or date.today()
+        # Statut calculé automatiquement (sauf si déjà validé)
+        if self.statut == "Validé":
+            return self.statut
+        if today <= self.date_fin:
+            return "En cours"
+        return "Terminé"
+
+    def update_statut(self):
+        self.statut = self.get_statut_effectif()
+
+    def accepte_rapport(self):
+        # Un rapport ne se dépose que sur un stage Terminé ou Validé
+        return self.get_statut_effectif() in ('Terminé', 'Validé')
 
     def save(self, *args, **kwargs):
-        today = date.today()
+        if isinstance(self.date_debut, str):
+            self.date_debut = datetime.strptime(self.date_debut, "%Y-%m-%d").date()
         if isinstance(self.date_fin, str):
             self.date_fin = datetime.strptime(self.date_fin, "%Y-%m-%d").date()
         
-        # Statut calculé automatiquement (sauf si déjà validé)
-        if self.statut != "Validé":
-            if today <= self.date_fin:
-                self.statut = "En cours"
-            else:
-                self.statut = "Terminé"
+        self.update_statut()
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -66,7 +219,7 @@ class Stage(models.Model):
 
 
 
-class Rapport(models.Model):
+class Rapport(TracksLoadedValues, models.Model):
     ETAT_CHOICES = [
         ('En attente', 'En attente'),
         ('Validé', 'Validé'),
@@ -76,8 +229,75 @@ class Rapport(models.Model):
     stage = models.ForeignKey('Stage', on_delete=models.CASCADE, related_name='rapports')
     etat = models.CharField(max_length=20, choices=ETAT_CHOICES, default='En attente')
     date_depot = models.DateTimeField(auto_now_add=True)
-    derniere_modif = models.DateTimeField(auto_now=True)
-    fichier = models.FileField(upload_to='rapports/')
+    derniere_modif = models.DateTimeField(auto_now=True, db_index=True)
+    # Stockage adressé par le contenu : le nom du fichier contient son SHA-256
+    fichier = models.FileField(upload_to='rapports/', storage=get_rapport_storage)
+    # Texte extrait du fichier (stages.extraction) et SHA-256 du fichier extrait
+    contenu = models.TextField(blank=True, default='', editable=False)
+    contenu_hash = models.CharField(max_length=64, blank=True, default='', editable=False)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    tracked_fields = ('date_depot', 'etat')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-date_depot', 'id'], name='rapport_depot_id_idx'),
+            # Filtre ?etat= avec le tri par défaut de rapports_api
+            models.Index(fields=['etat', '-date_depot', 'id'], name='rapport_etat_depot_idx'),
+            GinIndex(fields=['search_vector'], name='rapport_search_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Écriture du fichier (stockage adressé) et référence (post_save,
+        # storage.acquire) dans une même transaction, sous le verrou du contenu
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    @property
+    def sha256(self):
+        return sha256_from_name(self.fichier.name)
+
+    def __str__(self):
+        return f"Rapport pour {self.stage.theme} ({self.stage.stagiaire.nom})"
+
+
+class FichierRapport(models.Model):
+    # Un fichier stocké une seule fois, partagé par tous les rapports de même contenu
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    fichier = models.CharField(max_length=255)
+    taille = models.BigIntegerField()
+    nb_references = models.PositiveIntegerField(default=0)
+    date_creation = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.fichier
+
+class Suppression(models.Model):
+    # Trace d'une suppression, pour que /sync/ la transmette aux clients
+    modele = models.CharField(max_length=50)
+    objet_id = models.BigIntegerField()
+    date_suppression = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.modele} #{self.objet_id}"
+
+
+class Statistique(models.Model):
+    """
+    Compteurs du tableau de bord par année et par dimension (statut,
+    type_stage, ecole, filiere des stages ; etat des rapports ; « stages » et
+    « rapports » pour les totaux), tenus à jour par stages.stats.
+    """
+    annee = models.PositiveSmallIntegerField()
+    dimension = models.CharField(max_length=20)
+    valeur = models.CharField(max_length=150, blank=True, default='')
+    total = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # Sert aussi d'index pour la lecture d'une plage d'années
+            models.UniqueConstraint(fields=['annee', 'dimension', 'valeur'], name='statistique_cle'),
+        ]
 
     def __str__(self):
-        return f"Rapport pour {self.stage.theme} ({self.stage.stagiaire.nom})"
\ No newline at end of file
+        return f"{self.annee} {self.dimension}={self.valeur} : {self.total}"
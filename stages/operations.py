@@ -0,0 +1,20 @@
+from django.db import migrations
+
+
+class PostgresOnlyMixin:
+    # Opération ignorée hors PostgreSQL (SQLite pour les tests)
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class AddPostgresIndex(PostgresOnlyMixin, migrations.AddIndex):
+    pass
+
+
+class PostgresRunSQL(PostgresOnlyMixin, migrations.RunSQL):
+    pass
@@ -0,0 +1,135 @@
+import base64
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.http import JsonResponse
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _json_default(value):
+    # isoformat() complet : DjangoJSONEncoder tronque les microsecondes,
+    # ce qui fausserait la comparaison sur date_depot
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} non sérialisable')
+
+
+def get_page_size(request):
+    # Taille de page demandée via ?limit=, bornée par STAGES_MAX_PAGE_SIZE
+    default = getattr(settings, 'STAGES_PAGE_SIZE', 50)
+    maximum = getattr(settings, 'STAGES_MAX_PAGE_SIZE', 500)
+    try:
+        limit = int(request.GET.get('limit', default))
+    except (TypeError, ValueError):
+        limit = default
+    return max(1, min(limit, maximum))
+
+
+def encode_cursor(values, direction):
+    payload = json.dumps({'v': values, 'd': direction}, default=_json_default, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        values, direction = data['v'], data['d']
+    except (ValueError, TypeError, KeyError):
+        raise InvalidCursor(cursor)
+    if direction not in ('n', 'p') or not isinstance(values, list) or len(values) != size:
+        raise InvalidCursor(cursor)
+    return values, direction
+
+
+def _keyset_filter(ordering, values, reverse):
+    # (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y), en respectant le sens de chaque colonne
+    condition = Q()
+    for i, field in enumerate(ordering):
+        name = field.lstrip('-')
+        descending = field.startswith('-') != reverse
+        step = Q(**{f'{name}__{"lt" if descending else "gt"}': values[i]})
+        for previous, value in zip(ordering[:i], values):
+            step &= Q(**{previous.lstrip('-'): value})
+        condition |= step
+    return condition
+
+
+def _row_key(row, ordering):
+    if isinstance(row, dict):
+        return [row[field.lstrip('-')] for field in ordering]
+    return [getattr(row, field.lstrip('-')) for field in ordering]
+
+
+def _page_queryset(request, queryset, ordering):
+    limit = get_page_size(request)
+    cursor = request.GET.get('cursor')
+    backwards = False
+
+    qs = queryset.order_by(*ordering)
+    if cursor:
+        values, direction = decode_cursor(cursor, len(ordering))
+        backwards = direction == 'p'
+        try:
+            qs = qs.filter(_keyset_filter(ordering, values, reverse=backwards))
+        except (ValueError, ValidationError):
+            raise InvalidCursor(cursor)
+        if backwards:
+            qs = qs.reverse()
+    return qs[:limit + 1], limit, cursor, backwards
+
+
+def _build_page(rows, ordering, serialize, limit, cursor, backwards):
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if has_more or backwards:
+            next_cursor = encode_cursor(_row_key(rows[-1], ordering), 'n')
+        if cursor and (has_more or not backwards):
+            prev_cursor = encode_cursor(_row_key(rows[0], ordering), 'p')
+
+    if serialize is not None:
+        rows = [serialize(row) for row in rows]
+    return {'results': rows, 'next': next_cursor, 'prev': prev_cursor}
+
+
+def paginate(request, queryset, ordering, serialize=None):
+    """
+    Pagination par clé (keyset) : le curseur mémorise la clé de tri de la
+    dernière ligne renvoyée, la page suivante est donc un simple parcours
+    d'index quel que soit son rang, contrairement à OFFSET.
+    """
+    qs, limit, cursor, backwards = _page_queryset(request, queryset, ordering)
+    return _build_page(list(qs), ordering, serialize, limit, cursor, backwards)
+
+
+async def apaginate(request, queryset, ordering, serialize=None):
+    # Variante asynchrone de paginate() pour les vues async (ORM asynchrone)
+    qs, limit, cursor, backwards = _page_queryset(request, queryset, ordering)
+    rows = [row async for row in qs]
+    return _build_page(rows, ordering, serialize, limit, cursor, backwards)
+
+
+def paginated_response(request, queryset, ordering, serialize=None):
+    try:
+        page = paginate(request, queryset, ordering, serialize)
+    except InvalidCursor:
+        return JsonResponse({'error': 'Curseur invalide'}, status=400)
+    return JsonResponse(page)
+
+
+async def apaginated_response(request, queryset, ordering, serialize=None):
+    try:
+        page = await apaginate(request, queryset, ordering, serialize)
+    except InvalidCursor:
+        return JsonResponse({'error': 'Curseur invalide'}, status=400)
+    return JsonResponse(page)
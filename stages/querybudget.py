@@ -0,0 +1,119 @@
+import logging
+import re
+from contextlib import ExitStack, contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Contrôle de transaction : émis par SQLite (BEGIN) et pour les savepoints
+# imbriqués, mais pas par PostgreSQL en autocommit. Non comptés, pour que
+# les budgets soient les mêmes sur les deux bases.
+TRANSACTION_STATEMENT = re.compile(r'\s*(BEGIN|COMMIT|ROLLBACK|SAVEPOINT|RELEASE\b)', re.IGNORECASE)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if not TRANSACTION_STATEMENT.match(sql):
+            self.count += 1
+            if len(self.statements) < 50:
+                self.statements.append(sql)
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def count_queries(counter=None):
+    # Compte les requêtes émises sur toutes les bases configurées
+    counter = counter or QueryCounter()
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(counter))
+        yield counter
+
+
+@contextmanager
+def query_budget(limit, label=''):
+    """
+    Lève QueryBudgetExceeded si le bloc dépasse `limit` requêtes SQL.
+    Utilisable dans les tests :
+
+        with query_budget(3):
+            client.get('/rapports/api/')
+    """
+    with count_queries() as counter:
+        yield counter
+    if counter.count > limit:
+        raise QueryBudgetExceeded(
+            f"{label or 'bloc'} : {counter.count} requêtes pour un budget de {limit}\n"
+            + '\n'.join(counter.statements)
+        )
+
+
+def get_budget(url_name):
+    budgets = getattr(settings, 'STAGES_QUERY_BUDGETS', {})
+    return budgets.get(url_name, getattr(settings, 'STAGES_QUERY_BUDGET', 10))
+
+
+class QueryBudgetMiddleware:
+    """
+    Contrôle le nombre de requêtes SQL de chaque vue (STAGES_QUERY_BUDGETS par
+    nom d'URL, STAGES_QUERY_BUDGET par défaut). Un dépassement est journalisé,
+    ou lève une erreur si STAGES_QUERY_BUDGET_STRICT est activé (tests).
+    Les réponses en flux sont comptées jusqu'à la fin de l'envoi.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with count_queries() as counter:
+            response = self.get_response(request)
+
+        match = getattr(request, 'resolver_match', None)
+        # Seules les vues de l'application sont contrôlées (pas l'admin)
+        if match is None or not match.url_name or not match.func.__module__.startswith('stages.'):
+            return response
+        limit = get_budget(match.url_name)
+        if limit is None:
+            return response
+        if response.streaming and not response.is_async:
+            # Les exports en flux lisent la base pendant l'envoi
+            response.streaming_content = self._counted(response.streaming_content, counter, match.url_name, limit)
+            return response
+        self._check(counter, match.url_name, limit)
+        return response
+
+    def _counted(self, content, counter, url_name, limit):
+        with count_queries(counter):
+            yield from content
+        self._check(counter, url_name, limit)
+
+    def _check(self, counter, url_name, limit):
+        if counter.count > limit:
+            message = f'{url_name} : {counter.count} requêtes SQL (budget {limit})'
+            if getattr(settings, 'STAGES_QUERY_BUDGET_STRICT', False):
+                raise QueryBudgetExceeded(message + '\n' + '\n'.join(counter.statements))
+            logger.warning(message)
+
+    async def __acall__(self, request):
+        # Pile asynchrone (ASGI) : les requêtes partent des threads de
+        # sync_to_async, hors de portée de execute_wrapper. Pas de contrôle
+        # ici : les budgets se vérifient en WSGI et dans les tests.
+        return await self.get_response(request)
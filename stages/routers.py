@@ -0,0 +1,210 @@
+"""
+Lectures des API sur les réplicas (STAGES_DB_REPLICAS).
+
+Seules les requêtes GET/HEAD des vues de STAGES_REPLICA_VIEWS lisent sur un
+réplica, le même pour toute la requête. Tout le reste part sur le primaire :
+écritures, autres méthodes et autres vues (admin, sync...), et toute lecture
+qui suit une écriture dans la même requête. Après une écriture, un cookie
+épingle aussi le client au primaire pendant STAGES_REPLICA_LAG secondes, le
+temps que les réplicas rattrapent : il relit ce qu'il vient d'écrire.
+
+STAGES_REPLICA_LAG est aussi le retard toléré : un réplica PostgreSQL plus
+en retard est écarté (vérifié au plus toutes les STAGES_REPLICA_CHECK_INTERVAL
+secondes par processus) et une réponse lue sur un réplica n'est pas gardée
+en cache plus longtemps.
+
+En local, deux fichiers SQLite suffisent : le réplica est une copie du
+fichier du primaire, déclarée dans DATABASES et STAGES_DB_REPLICAS.
+"""
+import contextvars
+import logging
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+PRIMARY_COOKIE = 'stages_primary'
+
+# Routage de la requête en cours ; objet mutable pour que les threads de
+# sync_to_async (vues async) et la requête partagent le même état
+_current = contextvars.ContextVar('stages_db_routing', default=None)
+
+# Dernière mesure du retard de chaque réplica : {alias: (instant, retard)}
+_lags = {}
+
+
+def replicas():
+    return list(getattr(settings, 'STAGES_DB_REPLICAS', []))
+
+
+def max_lag():
+    return getattr(settings, 'STAGES_REPLICA_LAG', 2)
+
+
+class Routing:
+    __slots__ = ('use_replicas', 'replica', 'wrote')
+
+    def __init__(self, use_replicas):
+        self.use_replicas = use_replicas
+        self.replica = None
+        self.wrote = False
+
+
+def replica_lag(alias):
+    """Retard du réplica en secondes (0 hors PostgreSQL), None s'il est injoignable."""
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return 0
+    try:
+        with connection.cursor() as cursor:
+            # Réplica à jour de tout ce qu'il a reçu : pas de retard, même si
+            # le primaire n'a rien écrit depuis longtemps
+            cursor.execute(
+                "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+            )
+            return float(cursor.fetchone()[0] or 0)
+    except DatabaseError:
+        logger.warning("Réplica %s injoignable", alias, exc_info=True)
+        return None
+
+
+def _fresh(alias):
+    interval = getattr(settings, 'STAGES_REPLICA_CHECK_INTERVAL', 5)
+    checked, lag = _lags.get(alias, (None, None))
+    now = time.monotonic()
+    if checked is None or now - checked >= interval:
+        lag = replica_lag(alias)
+        _lags[alias] = (now, lag)
+    return lag is not None and lag <= max_lag()
+
+
+def _choose():
+    candidates = replicas()
+    random.shuffle(candidates)
+    for alias in candidates:
+        if _fresh(alias):
+            return alias
+    return DEFAULT_DB_ALIAS
+
+
+def used_replica():
+    """Vrai si la requête en cours a lu sur un réplica."""
+    routing = _current.get()
+    return routing is not None and routing.replica not in (None, DEFAULT_DB_ALIAS)
+
+
+class ReplicaRouter:
+    """Routeur de DATABASE_ROUTERS ; ne fait rien hors d'une requête éligible."""
+
+    def db_for_read(self, model, **hints):
+        routing = _current.get()
+        if routing is None or not routing.use_replicas or routing.wrote:
+            return DEFAULT_DB_ALIAS
+        if routing.replica is None:
+            routing.replica = _choose()
+        return routing.replica
+
+    def db_for_write(self, model, **hints):
+        routing = _current.get()
+        if routing is not None:
+            # Les lectures suivantes de la requête doivent voir cette écriture
+            routing.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Primaire et réplicas ont les mêmes données
+        pool = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+
+class ReplicaMiddleware:
+    """
+    Ouvre l'état de routage de chaque requête (voir le module) et pose le
+    cookie d'épinglage au primaire après une écriture. Sans réplica
+    configuré, le middleware se retire de la chaîne.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not replicas():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.views = set(getattr(settings, 'STAGES_REPLICA_VIEWS', ()))
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _start(self, request):
+        # Éligibilité définitive dans process_view, une fois l'URL résolue
+        eligible = request.method in ('GET', 'HEAD') and PRIMARY_COOKIE not in request.COOKIES
+        return _current.set(Routing(eligible))
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        routing = _current.get()
+        if routing is not None and request.resolver_match.url_name not in self.views:
+            routing.use_replicas = False
+
+    def _finish(self, response, token):
+        routing = _current.get()
+        if routing.wrote:
+            response.set_cookie(PRIMARY_COOKIE, '1', max_age=max_lag(), httponly=True, samesite='Lax')
+        if response.streaming:
+            # Les exports en flux lisent pendant l'envoi : même routage
+            if response.is_async:
+                response.streaming_content = self._arouted(response.streaming_content, routing)
+            else:
+                response.streaming_content = self._routed(response.streaming_content, routing)
+        _current.reset(token)
+        return response
+
+    def _routed(self, content, routing):
+        token = _current.set(routing)
+        try:
+            yield from content
+        finally:
+            _reset(token)
+
+    async def _arouted(self, content, routing):
+        token = _current.set(routing)
+        try:
+            async for chunk in content:
+                yield chunk
+        finally:
+            _reset(token)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = self._start(request)
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            _current.reset(token)
+            raise
+        return self._finish(response, token)
+
+    async def __acall__(self, request):
+        token = self._start(request)
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            _current.reset(token)
+            raise
+        return self._finish(response, token)
+
+
+def _reset(token):
+    try:
+        _current.reset(token)
+    except ValueError:
+        # Flux fermé depuis un autre contexte que celui qui l'a parcouru
+        pass
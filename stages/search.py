@@ -0,0 +1,166 @@
+import re
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.db import connection
+from django.db.models import F, FloatField, Q
+from django.db.models.functions import Cast
+
+from .fields import normalize
+from .models import Stagiaire, Encadrant, Stage, Rapport
+
+# Champs texte qui alimentent search_vector ; une sauvegarde limitée à
+# d'autres champs (statut, etat...) ne déclenche pas de recalcul
+STAGE_SEARCH_FIELDS = {'theme', 'stagiaire', 'encadrant'}
+PERSON_SEARCH_FIELDS = {'nom', 'prenom'}
+
+# Pondération : A = thème, B = stagiaire, C = encadrant
+STAGE_VECTOR_SQL = """
+UPDATE {stage} AS s SET search_vector =
+    setweight(to_tsvector(%(config)s::regconfig, coalesce(s.theme, '')), 'A')
+    || setweight(to_tsvector(%(config)s::regconfig, st.prenom || ' ' || st.nom), 'B')
+    || setweight(to_tsvector(%(config)s::regconfig, coalesce(
+        (SELECT e.prenom || ' ' || e.nom FROM {encadrant} AS e WHERE e.id = s.encadrant_id), ''
+    )), 'C')
+FROM {stagiaire} AS st
+WHERE st.id = s.stagiaire_id AND s.id = ANY(%(ids)s)
+"""
+
+# Vecteur du stage + contenu du fichier (poids D)
+RAPPORT_VECTOR_SQL = """
+UPDATE {rapport} AS r SET search_vector = s.search_vector
+    || setweight(to_tsvector(%(config)s::regconfig, r.contenu), 'D')
+FROM {stage} AS s
+WHERE s.id = r.stage_id AND r.{column} = ANY(%(ids)s)
+"""
+
+
+def search_enabled():
+    return connection.vendor == 'postgresql'
+
+
+def get_config():
+    return getattr(settings, 'STAGES_SEARCH_CONFIG', 'french_unaccent')
+
+
+def _tables():
+    return {
+        'stage': Stage._meta.db_table,
+        'rapport': Rapport._meta.db_table,
+        'stagiaire': Stagiaire._meta.db_table,
+        'encadrant': Encadrant._meta.db_table,
+    }
+
+
+def refresh_search_vectors(stage_ids):
+    """Recalcule search_vector des stages donnés et de leurs rapports."""
+    stage_ids = list(stage_ids)
+    if not stage_ids or not search_enabled():
+        return
+    params = {'config': get_config(), 'ids': stage_ids}
+    with connection.cursor() as cursor:
+        cursor.execute(STAGE_VECTOR_SQL.format(**_tables()), params)
+        cursor.execute(RAPPORT_VECTOR_SQL.format(column='stage_id', **_tables()), params)
+
+
+def refresh_rapport_vectors(rapport_ids):
+    """Recalcule search_vector des rapports donnés (après extraction du contenu)."""
+    rapport_ids = list(rapport_ids)
+    if not rapport_ids or not search_enabled():
+        return
+    params = {'config': get_config(), 'ids': rapport_ids}
+    with connection.cursor() as cursor:
+        cursor.execute(RAPPORT_VECTOR_SQL.format(column='id', **_tables()), params)
+
+
+def build_query(q):
+    # Recherche « au fil de la frappe » : chaque mot doit apparaître,
+    # le dernier pouvant être incomplet (préfixe)
+    words = re.findall(r'\w+', q)
+    if not words:
+        return None
+    terms = [f"'{word}'" for word in words]
+    terms[-1] += ':*'
+    return SearchQuery(' & '.join(terms), config=get_config(), search_type='raw')
+
+
+def _rank(expression):
+    # ts_rank et similarity sont des real (float4) : la pagination compare le
+    # rang à la valeur du curseur (un double JSON), en double precision pour
+    # que la comparaison soit exacte et qu'aucune ligne ne soit répétée ou
+    # sautée entre deux pages
+    return Cast(expression, FloatField())
+
+
+def search_rapports(queryset, q):
+    """
+    Filtre les rapports sur `q`. Renvoie (queryset, ordre) : sous PostgreSQL
+    les résultats sont classés par pertinence, sinon on garde le filtre
+    icontains d'origine et l'ordre par défaut (None).
+    """
+    if not search_enabled():
+        return queryset.filter(Q(stage__theme__icontains=q) |
+                               Q(stage__stagiaire__nom__icontains=q) |
+                               Q(stage__stagiaire__prenom__icontains=q) |
+                               Q(contenu__icontains=q)).distinct(), None
+    query = build_query(q)
+    if query is None:
+        return queryset.none(), None
+    queryset = queryset.filter(search_vector=query).annotate(rank=_rank(SearchRank(F('search_vector'), query)))
+    return queryset, ['-rank', 'id']
+
+
+def search_stages(queryset, q):
+    """Même principe que search_rapports, avec tolérance aux fautes (trigrammes)."""
+    if not search_enabled():
+        return queryset.filter(Q(theme__icontains=q) |
+                               Q(stagiaire__nom__icontains=q) |
+                               Q(stagiaire__prenom__icontains=q) |
+                               Q(encadrant__nom__icontains=q) |
+                               Q(encadrant__prenom__icontains=q)), None
+    query = build_query(q)
+    if query is None:
+        return queryset.none(), None
+    queryset = queryset.annotate(
+        rank=_rank(SearchRank(F('search_vector'), query) + TrigramSimilarity('theme', q)),
+    ).filter(
+        Q(search_vector=query) |
+        Q(theme__trigram_similar=q) |
+        Q(stagiaire__nom__trigram_similar=q) |
+        Q(encadrant__nom__trigram_similar=q)
+    )
+    return queryset, ['-rank', 'id']
+
+
+def _name_prefix(q, prefix=''):
+    # Chaque mot commence le nom ou le prénom (champs normalisés, indexés)
+    words = normalize(q).split()
+    if not words:
+        return None
+    return reduce(lambda condition, word: condition & (
+        Q(**{f'{prefix}nom_normalise__startswith': word}) |
+        Q(**{f'{prefix}prenom_normalise__startswith': word})
+    ), words, Q())
+
+
+def autocomplete_persons(queryset, q):
+    """
+    Autocomplétion des stagiaires ou encadrants : « dia ami » trouve
+    Aminata Diallo. Recherche par préfixe sur les index des noms normalisés
+    (sans accents ni majuscules), triée par nom.
+    """
+    condition = _name_prefix(q)
+    if condition is None:
+        return queryset.none()
+    return queryset.filter(condition).order_by('nom_normalise', 'prenom_normalise', 'id')
+
+
+def autocomplete_stages(queryset, q):
+    """Stages dont le thème commence par `q`, ou dont le stagiaire correspond (autocomplete_persons)."""
+    condition = _name_prefix(q, 'stagiaire__')
+    if condition is None:
+        return queryset.none()
+    condition |= Q(theme_normalise__startswith=normalize(q))
+    return queryset.filter(condition).order_by('theme_normalise', 'id')
@@ -0,0 +1,136 @@
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from .models import Stagiaire, Encadrant, Stage, Rapport
+from . import search, extraction, storage, cache, sync, events, stats
+
+# Champs dont dépendent les compteurs de stages.stats
+STAGE_STATS_FIELDS = {'date_debut', 'statut', 'type_stage', 'stagiaire', 'stagiaire_id'}
+RAPPORT_STATS_FIELDS = {'date_depot', 'etat'}
+STAGIAIRE_STATS_FIELDS = {'ecole', 'filiere'}
+
+
+def _touches(update_fields, fields):
+    # update_fields=None : sauvegarde complète, tous les champs ont pu changer
+    return update_fields is None or bool(fields & set(update_fields))
+
+
+def _encadrant_of(rapport):
+    # Stage déjà chargé (rapport_create, rapport_valider...) : pas de requête
+    if Rapport.stage.is_cached(rapport):
+        return rapport.stage.encadrant_id
+    return Stage.objects.filter(pk=rapport.stage_id).values_list('encadrant_id', flat=True).first()
+
+
+@receiver(pre_save, sender=Stage)
+def stage_saving(sender, instance, update_fields, **kwargs):
+    instance._stats_before = None
+    if not instance._state.adding and _touches(update_fields, STAGE_STATS_FIELDS):
+        instance._stats_before = stats.stage_before(instance)
+
+
+@receiver(post_save, sender=Stage)
+def stage_saved(sender, instance, created, update_fields, **kwargs):
+    if created or _touches(update_fields, search.STAGE_SEARCH_FIELDS):
+        search.refresh_search_vectors([instance.pk])
+    before = getattr(instance, '_stats_before', None)
+    if created or before:
+        stats.stage_saved(instance, before)
+    stats.remember(instance)
+    events.stage_event('created' if created else 'updated', instance.pk, instance.encadrant_id, instance.statut)
+
+
+@receiver(pre_delete, sender=Stage)
+def stage_deleting(sender, instance, **kwargs):
+    # Avant la suppression : le stagiaire (école, filière) est encore lisible
+    stats.stage_deleted(instance, stats.stage_before(instance))
+
+
+@receiver(post_delete, sender=Stage)
+def stage_deleted(sender, instance, **kwargs):
+    events.stage_event('deleted', instance.pk, instance.encadrant_id, instance.statut)
+
+
+@receiver(pre_save, sender=Rapport)
+def rapport_saving(sender, instance, update_fields, **kwargs):
+    # Nom du fichier remplacé, pour libérer sa référence après la sauvegarde
+    instance._previous_fichier = None
+    if instance.pk and _touches(update_fields, {'fichier'}):
+        instance._previous_fichier = (
+            Rapport.objects.filter(pk=instance.pk).values_list('fichier', flat=True).first()
+        )
+    instance._stats_before = None
+    if not instance._state.adding and _touches(update_fields, RAPPORT_STATS_FIELDS):
+        instance._stats_before = stats.rapport_before(instance)
+
+
+@receiver(post_save, sender=Rapport)
+def rapport_saved(sender, instance, created, update_fields, **kwargs):
+    previous = getattr(instance, '_previous_fichier', None)
+    if created or (previous is not None and previous != instance.fichier.name):
+        storage.acquire(instance.fichier.name)
+        if previous:
+            storage.release(previous)
+    if created or _touches(update_fields, {'stage'}):
+        search.refresh_search_vectors([instance.stage_id])
+    if instance.fichier and (created or _touches(update_fields, {'fichier'})):
+        # Extraction du texte après le commit, hors de la requête
+        transaction.on_commit(lambda: extraction.schedule_extraction(instance.pk))
+    before = getattr(instance, '_stats_before', None)
+    if created or before:
+        stats.rapport_saved(instance, before)
+    stats.remember(instance)
+    events.rapport_event(
+        'created' if created else 'updated', instance.pk, instance.stage_id,
+        _encadrant_of(instance), instance.etat,
+    )
+
+
+@receiver(pre_save, sender=Stagiaire)
+def stagiaire_saving(sender, instance, update_fields, **kwargs):
+    instance._stats_before = None
+    if not instance._state.adding and _touches(update_fields, STAGIAIRE_STATS_FIELDS):
+        instance._stats_before = stats.stagiaire_before(instance)
+
+
+@receiver(post_save, sender=Stagiaire)
+def stagiaire_saved(sender, instance, created, update_fields, **kwargs):
+    if not created and _touches(update_fields, search.PERSON_SEARCH_FIELDS):
+        search.refresh_search_vectors(instance.stage_set.values_list('id', flat=True))
+    stats.stagiaire_saved(instance, getattr(instance, '_stats_before', None))
+    stats.remember(instance)
+
+
+@receiver(post_save, sender=Encadrant)
+def encadrant_saved(sender, instance, created, update_fields, **kwargs):
+    if not created and _touches(update_fields, search.PERSON_SEARCH_FIELDS):
+        search.refresh_search_vectors(instance.stage_set.values_list('id', flat=True))
+
+
+@receiver(pre_delete, sender=Rapport)
+def rapport_deleting(sender, instance, **kwargs):
+    stats.rapport_deleted(stats.rapport_before(instance))
+
+
+@receiver(post_delete, sender=Rapport)
+def rapport_deleted(sender, instance, **kwargs):
+    storage.release(instance.fichier.name)
+    events.rapport_event('deleted', instance.pk, instance.stage_id, _encadrant_of(instance), instance.etat)
+
+
+def record_deletion(sender, instance, **kwargs):
+    # Aussi pour les suppressions en cascade (stages et rapports d'un stagiaire)
+    sync.record_deletion(instance)
+
+
+def invalidate_cache(sender, **kwargs):
+    # Après le commit : une lecture concurrente ne peut pas mettre en cache
+    # l'ancien état sous la nouvelle version
+    transaction.on_commit(lambda: cache.bump_version(sender))
+
+
+for model in (Stagiaire, Encadrant, Stage, Rapport):
+    post_save.connect(invalidate_cache, sender=model, dispatch_uid=f'invalidate_cache_save_{model.__name__}')
+    post_delete.connect(invalidate_cache, sender=model, dispatch_uid=f'invalidate_cache_delete_{model.__name__}')
+    post_delete.connect(record_deletion, sender=model, dispatch_uid=f'record_deletion_{model.__name__}')
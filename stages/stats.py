@@ -0,0 +1,263 @@
+"""
+Statistiques du tableau de bord (/stats/), pré-agrégées dans Statistique.
+
+Un stage compte dans l'année de sa date de début, pour son statut, son
+type et l'école et la filière de son stagiaire ; un rapport compte dans
+l'année de son dépôt, pour son état. Chaque écriture applique la
+différence entre l'ancienne et la nouvelle contribution de la ligne, par
+un seul INSERT ... ON CONFLICT (signaux de stages.signals, et à la main
+dans les chemins en update()/bulk_create). La commande rebuild_stats
+recalcule tout si les compteurs ont dérivé.
+"""
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+from django.db.models import Count
+from django.db.models.functions import ExtractYear
+from django.utils import timezone
+
+from .models import Stagiaire, Stage, Rapport, Statistique
+
+STAGE_DIMENSIONS = ('statut', 'type_stage', 'ecole', 'filiere')
+RAPPORT_DIMENSIONS = ('etat',)
+
+# Deltas mis en attente par batch() au lieu d'être écrits un par un
+_pending = contextvars.ContextVar('stages_stats_pending', default=None)
+
+
+def stage_keys(annee, statut, type_stage, ecole, filiere):
+    return [
+        (annee, 'stages', ''),
+        (annee, 'statut', statut),
+        (annee, 'type_stage', type_stage),
+        (annee, 'ecole', ecole or ''),
+        (annee, 'filiere', filiere or ''),
+    ]
+
+
+def rapport_keys(annee, etat):
+    return [(annee, 'rapports', ''), (annee, 'etat', etat)]
+
+
+def depot_year(moment):
+    # Même année que le filtre ?annee= de rapports_api (fuseau courant)
+    return timezone.localtime(moment).year if timezone.is_aware(moment) else moment.year
+
+
+def apply(delta):
+    """Ajoute `delta` ({(annee, dimension, valeur): n}) aux compteurs, en une requête."""
+    delta = {key: n for key, n in delta.items() if n}
+    if not delta:
+        return
+    pending = _pending.get()
+    if pending is not None:
+        pending.update(delta)
+        return
+    table = connection.ops.quote_name(Statistique._meta.db_table)
+    rows = ', '.join(['(%s, %s, %s, %s)'] * len(delta))
+    params = [value for (annee, dimension, valeur), n in delta.items() for value in (annee, dimension, valeur, n)]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} (annee, dimension, valeur, total) VALUES {rows} "
+            f"ON CONFLICT (annee, dimension, valeur) DO UPDATE SET total = {table}.total + excluded.total",
+            params,
+        )
+
+
+@contextmanager
+def batch():
+    """Regroupe les deltas du bloc en une seule écriture, à la sortie du bloc."""
+    if _pending.get() is not None:
+        yield
+        return
+    pending = Counter()
+    token = _pending.set(pending)
+    try:
+        yield
+    finally:
+        _pending.reset(token)
+    apply(pending)
+
+
+def _delta(before, after):
+    delta = Counter()
+    for key in before:
+        delta[key] -= 1
+    for key in after:
+        delta[key] += 1
+    return delta
+
+
+def _personne(stagiaire_id, stage=None):
+    # (ecole, filiere) du stagiaire ; sans requête s'il est déjà chargé
+    if stage is not None and Stage.stagiaire.is_cached(stage) and stage.stagiaire.pk == stagiaire_id:
+        return stage.stagiaire.ecole, stage.stagiaire.filiere
+    return Stagiaire.objects.filter(pk=stagiaire_id).values_list('ecole', 'filiere').first() or (None, None)
+
+
+def _loaded(instance, fields):
+    """Valeurs de `fields` telles que lues en base, relues si elles n'ont pas été chargées."""
+    loaded = getattr(instance, '_loaded_values', {})
+    if all(field in loaded for field in fields):
+        return loaded
+    return type(instance).objects.filter(pk=instance.pk).values(*fields).first()
+
+
+def remember(instance):
+    # Après écriture : les valeurs courantes deviennent les valeurs « lues »
+    instance._loaded_values = {field: getattr(instance, field) for field in instance.tracked_fields}
+
+
+def stage_before(stage):
+    """Contribution actuelle en base d'un stage existant, à relever avant sa sauvegarde."""
+    values = _loaded(stage, Stage.tracked_fields)
+    return values and {field: values[field] for field in Stage.tracked_fields}
+
+
+def stage_saved(stage, before):
+    after = {field: getattr(stage, field) for field in Stage.tracked_fields}
+    if before == after:
+        return
+    if before and before['date_debut'].year == after['date_debut'].year and before['stagiaire_id'] == after['stagiaire_id']:
+        # Même année, même stagiaire : seuls statut et type peuvent avoir changé
+        annee = after['date_debut'].year
+        apply(_delta(
+            [(annee, 'statut', before['statut']), (annee, 'type_stage', before['type_stage'])],
+            [(annee, 'statut', after['statut']), (annee, 'type_stage', after['type_stage'])],
+        ))
+        return
+    old = []
+    if before:
+        old = stage_keys(before['date_debut'].year, before['statut'], before['type_stage'],
+                         *_personne(before['stagiaire_id'], stage))
+    new = stage_keys(after['date_debut'].year, after['statut'], after['type_stage'],
+                     *_personne(after['stagiaire_id'], stage))
+    apply(_delta(old, new))
+
+
+def stage_deleted(stage, before):
+    if before:
+        apply(_delta(stage_keys(before['date_debut'].year, before['statut'], before['type_stage'],
+                                *_personne(before['stagiaire_id'], stage)), []))
+
+
+def rapport_before(rapport):
+    values = _loaded(rapport, Rapport.tracked_fields)
+    return values and rapport_keys(depot_year(values['date_depot']), values['etat'])
+
+
+def rapport_saved(rapport, before):
+    apply(_delta(before or [], rapport_keys(depot_year(rapport.date_depot), rapport.etat)))
+
+
+def rapport_deleted(before):
+    apply(_delta(before or [], []))
+
+
+def stagiaire_before(stagiaire):
+    values = _loaded(stagiaire, Stagiaire.tracked_fields)
+    return values and {field: values[field] for field in Stagiaire.tracked_fields}
+
+
+def stagiaire_saved(stagiaire, before):
+    """École ou filière changée : tous les stages du stagiaire changent de case."""
+    if not before or (before['ecole'], before['filiere']) == (stagiaire.ecole, stagiaire.filiere):
+        return
+    delta = Counter()
+    years = (
+        Stage.objects.filter(stagiaire=stagiaire).annotate(annee=ExtractYear('date_debut'))
+        .values_list('annee').annotate(n=Count('id')).order_by()
+    )
+    for annee, n in years:
+        for dimension in ('ecole', 'filiere'):
+            delta[(annee, dimension, before[dimension] or '')] -= n
+            delta[(annee, dimension, getattr(stagiaire, dimension) or '')] += n
+    apply(delta)
+
+
+def count_stages(stages):
+    """Contribution de stages insérés par bulk_create (une requête par lot de stagiaires)."""
+    stages = list(stages)
+    personnes = {}
+    ids = list({stage.stagiaire_id for stage in stages})
+    for start in range(0, len(ids), 500):
+        personnes.update(
+            (pk, (ecole, filiere)) for pk, ecole, filiere in
+            Stagiaire.objects.filter(pk__in=ids[start:start + 500]).values_list('id', 'ecole', 'filiere')
+        )
+    delta = Counter()
+    for stage in stages:
+        for key in stage_keys(stage.date_debut.year, stage.statut, stage.type_stage,
+                              *personnes.get(stage.stagiaire_id, (None, None))):
+            delta[key] += 1
+    return delta
+
+
+def rebuild(apps=None):
+    """
+    Recalcule toute la table depuis les stages et les rapports. Renvoie le
+    nombre de lignes. `apps` : registre d'une migration (modèles historiques).
+    """
+    if apps is None:
+        stage_model, rapport_model, statistique_model = Stage, Rapport, Statistique
+    else:
+        stage_model, rapport_model, statistique_model = (
+            apps.get_model('stages', name) for name in ('Stage', 'Rapport', 'Statistique')
+        )
+    delta = Counter()
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            # Les écritures concurrentes attendent la fin du recalcul
+            with connection.cursor() as cursor:
+                cursor.execute(f'LOCK TABLE {connection.ops.quote_name(statistique_model._meta.db_table)} IN EXCLUSIVE MODE')
+        statistique_model.objects.all().delete()
+        stages = (
+            stage_model.objects.annotate(annee=ExtractYear('date_debut'))
+            .values_list('annee', 'statut', 'type_stage', 'stagiaire__ecole', 'stagiaire__filiere')
+            .annotate(n=Count('id')).order_by()
+        )
+        for *values, n in stages:
+            for key in stage_keys(*values):
+                delta[key] += n
+        rapports = (
+            rapport_model.objects.annotate(annee=ExtractYear('date_depot'))
+            .values_list('annee', 'etat').annotate(n=Count('id')).order_by()
+        )
+        for *values, n in rapports:
+            for key in rapport_keys(*values):
+                delta[key] += n
+        statistique_model.objects.bulk_create(
+            statistique_model(annee=annee, dimension=dimension, valeur=valeur, total=n)
+            for (annee, dimension, valeur), n in delta.items() if n
+        )
+    return len(delta)
+
+
+def summary(annee_min=None, annee_max=None):
+    """
+    {"annees": {annee: {"stages": n, "statut": {...}, ..., "rapports": n, "etat": {...}}},
+    "total": {...}} : lecture d'une plage de l'index (annee, dimension, valeur).
+    """
+    rows = Statistique.objects.filter(total__gt=0)
+    if annee_min is not None:
+        rows = rows.filter(annee__gte=annee_min)
+    if annee_max is not None:
+        rows = rows.filter(annee__lte=annee_max)
+
+    def empty():
+        result = {'stages': 0, 'rapports': 0}
+        result.update((dimension, {}) for dimension in STAGE_DIMENSIONS + RAPPORT_DIMENSIONS)
+        return result
+
+    annees, total = {}, empty()
+    for annee, dimension, valeur, n in rows.order_by('annee', 'dimension', 'valeur').values_list(
+            'annee', 'dimension', 'valeur', 'total'):
+        year = annees.setdefault(annee, empty())
+        for target in (year, total):
+            if dimension in ('stages', 'rapports'):
+                target[dimension] += n
+            else:
+                target[dimension][valeur] = target[dimension].get(valeur, 0) + n
+    return {'annees': annees, 'total': total}
@@ -0,0 +1,181 @@
+import hashlib
+import os
+import posixpath
+import re
+import tempfile
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+CHUNK_SIZE = 64 * 1024
+
+BLOB_NAME = re.compile(r'(?:^|/)[0-9a-f]{2}/([0-9a-f]{64})(?:\.\w+)?$')
+
+
+def sha256_from_name(name):
+    match = BLOB_NAME.search(name or '')
+    return match.group(1) if match else None
+
+
+def lock_blob(digest):
+    """
+    Verrou consultatif PostgreSQL sur un contenu, jusqu'à la fin de la
+    transaction en cours : sérialise l'écriture d'un dépôt et sa référence
+    avec la suppression du fichier devenu inutile. Sans effet hors d'une
+    transaction ou hors PostgreSQL (SQLite : développement et tests).
+    """
+    if connection.vendor == 'postgresql' and connection.in_atomic_block:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [int(digest[:15], 16)])
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stockage adressé par le contenu : chaque fichier est rangé sous son
+    SHA-256 (rapports/ab/abcd...ef.docx), calculé pendant l'écriture. Un
+    contenu déjà connu n'est pas réécrit, le doublon est simplement jeté et
+    le fichier existant réutilisé, même sous une autre extension : un seul
+    fichier par SHA-256, comme dans FichierRapport.
+
+    L'écriture se fait sous lock_blob() : à appeler dans la transaction qui
+    enregistre la référence (Rapport.save, acquire), pour qu'une suppression
+    concurrente du même contenu (_delete_if_unused) ne puisse pas s'intercaler.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # Le nom définitif dépend du contenu, il est choisi dans _save()
+        return name
+
+    def _blob_name(self, name, digest):
+        directory, basename = posixpath.split(name)
+        folder = posixpath.join(directory, digest[:2])
+        try:
+            with os.scandir(self.path(folder)) as entries:
+                for entry in entries:
+                    if sha256_from_name(posixpath.join(folder, entry.name)) == digest:
+                        return posixpath.join(folder, entry.name)
+        except FileNotFoundError:
+            pass
+        extension = os.path.splitext(basename)[1].lower()
+        return posixpath.join(folder, digest + extension)
+
+    def _save(self, name, content):
+        tmp_dir = self.path('tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        digest = hashlib.sha256()
+
+        if hasattr(content, 'temporary_file_path'):
+            # Gros upload déjà sur disque : on le hache puis on le déplace
+            source = content.temporary_file_path()
+            with open(source, 'rb') as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+        else:
+            with tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False) as tmp:
+                for chunk in content.chunks(CHUNK_SIZE):
+                    digest.update(chunk)
+                    tmp.write(chunk)
+            source = tmp.name
+
+        digest = digest.hexdigest()
+        lock_blob(digest)
+        blob_name = self._blob_name(name, digest)
+        full_path = self.path(blob_name)
+        if os.path.exists(full_path):
+            if not hasattr(content, 'temporary_file_path'):
+                os.unlink(source)
+            return blob_name
+
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        file_move_safe(source, full_path, allow_overwrite=True)
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+        return blob_name
+
+
+rapport_storage = ContentAddressedStorage()
+
+
+def get_rapport_storage():
+    return rapport_storage
+
+
+def acquire(name, count=1):
+    """Ajoute `count` références au fichier `name` (créé au besoin dans FichierRapport)."""
+    from .models import FichierRapport
+
+    digest = sha256_from_name(name)
+    if digest is None:
+        return
+    table = connection.ops.quote_name(FichierRapport._meta.db_table)
+    # Une seule requête, sans course entre deux dépôts du même contenu
+    with transaction.atomic(), connection.cursor() as cursor:
+        lock_blob(digest)
+        cursor.execute(
+            f"INSERT INTO {table} (sha256, fichier, taille, nb_references, date_creation) "
+            f"VALUES (%s, %s, %s, %s, %s) "
+            f"ON CONFLICT (sha256) DO UPDATE SET nb_references = {table}.nb_references + excluded.nb_references",
+            [digest, name, rapport_storage.size(name), count, timezone.now()],
+        )
+
+
+def release(name):
+    """Retire une référence ; le fichier est supprimé quand plus aucun rapport ne l'utilise."""
+    from .models import FichierRapport
+
+    digest = sha256_from_name(name)
+    if digest is None:
+        return
+    with transaction.atomic():
+        blobs = FichierRapport.objects.filter(sha256=digest)
+        blobs.filter(nb_references__gt=0).update(nb_references=F('nb_references') - 1)
+        deleted, _ = blobs.filter(nb_references__lte=0).delete()
+    if deleted:
+        transaction.on_commit(lambda: _delete_if_unused(digest, name))
+
+
+def _delete_if_unused(digest, name):
+    from .models import FichierRapport
+
+    # Le même contenu a pu être redéposé entre-temps : le verrou attend la
+    # fin d'un dépôt en cours, qui aura alors enregistré sa référence
+    with transaction.atomic():
+        lock_blob(digest)
+        if not FichierRapport.objects.filter(sha256=digest).exists():
+            rapport_storage.delete(name)
+
+
+def purge_orphans(age):
+    """
+    Supprime les fichiers sans référence dans FichierRapport, plus vieux que
+    `age` (timedelta) : dépôts annulés par un rollback après l'écriture du
+    fichier, fichiers temporaires abandonnés. Renvoie le nombre de fichiers.
+    """
+    from .models import FichierRapport
+
+    limit = (timezone.now() - age).timestamp()
+    count = 0
+    for root, _, files in os.walk(rapport_storage.location):
+        for filename in files:
+            path = os.path.join(root, filename)
+            name = os.path.relpath(path, rapport_storage.location).replace(os.sep, '/')
+            digest = sha256_from_name(name)
+            if digest is None and not name.startswith('tmp/'):
+                # Fichiers hors du stockage adressé (médias, anciens rapports)
+                continue
+            try:
+                if os.path.getmtime(path) > limit:
+                    continue
+            except FileNotFoundError:
+                continue
+            with transaction.atomic():
+                if digest is not None:
+                    lock_blob(digest)
+                    if FichierRapport.objects.filter(sha256=digest).exists():
+                        continue
+                rapport_storage.delete(name)
+            count += 1
+    return count
@@ -0,0 +1,111 @@
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+NDJSON = 'application/x-ndjson'
+
+
+def wants_stream(request):
+    if request.GET.get('stream') in ('1', 'true', 'ndjson'):
+        return True
+    return NDJSON in request.headers.get('Accept', '')
+
+
+def _wants_ndjson(request):
+    return request.GET.get('stream') == 'ndjson' or NDJSON in request.headers.get('Accept', '')
+
+
+def _encoded_rows(queryset, serialize, chunk_size):
+    encoder = DjangoJSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    # .iterator() : curseur côté serveur sous PostgreSQL, pas de cache de queryset
+    for row in queryset.iterator(chunk_size=chunk_size):
+        if serialize is not None:
+            row = serialize(row)
+        yield encoder.encode(row)
+
+
+async def _aencoded_rows(queryset, serialize, chunk_size):
+    encoder = DjangoJSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    async for row in queryset.aiterator(chunk_size=chunk_size):
+        if serialize is not None:
+            row = serialize(row)
+        yield encoder.encode(row)
+
+
+async def _ablocks(rows, ndjson, chunk_size):
+    # Mêmes blocs que _json_array / _ndjson, pour un flux asynchrone
+    buffer = [] if ndjson else ['[']
+    first = True
+    async for row in rows:
+        if ndjson:
+            buffer.append(row + '\n')
+        else:
+            buffer.append(row if first else ',' + row)
+        first = False
+        if len(buffer) >= chunk_size:
+            yield ''.join(buffer)
+            buffer = []
+    if not ndjson:
+        buffer.append(']')
+    if buffer:
+        yield ''.join(buffer)
+
+
+def _json_array(rows, chunk_size):
+    yield '['
+    buffer = []
+    first = True
+    for row in rows:
+        buffer.append(row if first else ',' + row)
+        first = False
+        if len(buffer) >= chunk_size:
+            yield ''.join(buffer)
+            buffer = []
+    buffer.append(']')
+    yield ''.join(buffer)
+
+
+def _ndjson(rows, chunk_size):
+    buffer = []
+    for row in rows:
+        buffer.append(row + '\n')
+        if len(buffer) >= chunk_size:
+            yield ''.join(buffer)
+            buffer = []
+    if buffer:
+        yield ''.join(buffer)
+
+
+def streaming_response(request, queryset, serialize=None):
+    """
+    Export complet d'une liste sans la charger en mémoire : les lignes sont
+    lues par paquets de STAGES_STREAM_CHUNK_SIZE et encodées au fil de l'eau,
+    en tableau JSON (?stream=1) ou en NDJSON (Accept: application/x-ndjson).
+    """
+    chunk_size = getattr(settings, 'STAGES_STREAM_CHUNK_SIZE', 2000)
+    rows = _encoded_rows(queryset, serialize, chunk_size)
+    # Envoi par blocs d'environ 100 lignes : premier octet immédiat, peu d'écritures
+    if _wants_ndjson(request):
+        response = StreamingHttpResponse(_ndjson(rows, 100), content_type=NDJSON)
+    else:
+        response = StreamingHttpResponse(_json_array(rows, 100), content_type='application/json')
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def astreaming_response(request, queryset, serialize=None):
+    """
+    Variante de streaming_response pour les vues async : le flux est un
+    itérateur asynchrone (aiterator), consommé par le serveur ASGI sans
+    bloquer de thread pendant l'envoi.
+    """
+    chunk_size = getattr(settings, 'STAGES_STREAM_CHUNK_SIZE', 2000)
+    rows = _aencoded_rows(queryset, serialize, chunk_size)
+    ndjson = _wants_ndjson(request)
+    response = StreamingHttpResponse(
+        _ablocks(rows, ndjson, 100), content_type=NDJSON if ndjson else 'application/json',
+    )
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,144 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Stagiaire, Encadrant, Stage, Rapport, Suppression
+from .pagination import InvalidCursor, encode_cursor, decode_cursor
+
+# Clé de chaque modèle dans la réponse de /sync/ et colonne de date de modification
+MODELS = {
+    'stagiaires': (Stagiaire, 'updated_at'),
+    'encadrants': (Encadrant, 'updated_at'),
+    'stages': (Stage, 'updated_at'),
+    'rapports': (Rapport, 'derniere_modif'),
+}
+
+
+class InvalidToken(ValueError):
+    pass
+
+
+class ExpiredToken(ValueError):
+    pass
+
+
+def encode_token(moment):
+    # Microsecondes depuis l'epoch : un entier opaque pour le client
+    return str(int(moment.timestamp() * 1_000_000))
+
+
+def decode_token(token):
+    try:
+        micros = int(token)
+    except (TypeError, ValueError):
+        raise InvalidToken(token)
+    try:
+        moment = datetime.fromtimestamp(micros / 1_000_000, tz=dt_timezone.utc)
+    except (OverflowError, OSError, ValueError):
+        raise InvalidToken(token)
+    retention = getattr(settings, 'STAGES_SYNC_RETENTION_DAYS', 30)
+    if moment < timezone.now() - timedelta(days=retention):
+        # Les traces de suppression plus anciennes ont pu être purgées
+        raise ExpiredToken(token)
+    return moment
+
+
+def next_token():
+    """
+    Jeton à renvoyer au client. Il est pris avant les lectures et reculé de
+    STAGES_SYNC_MARGIN secondes : une transaction lente peut valider une
+    ligne datée d'avant le début de la lecture. Les lignes de la marge sont
+    renvoyées deux fois, ce qui est sans effet pour le client (upsert).
+    """
+    margin = getattr(settings, 'STAGES_SYNC_MARGIN', 5)
+    return encode_token(timezone.now() - timedelta(seconds=margin))
+
+
+def _page_cursor(cursor):
+    # Curseur de page : [clé de MODELS, dernier id renvoyé, jeton, since]
+    try:
+        key, last_id, token, since = decode_cursor(cursor, 4)[0]
+    except InvalidCursor:
+        raise InvalidToken(cursor)
+    if (key not in MODELS or not isinstance(last_id, int) or not isinstance(token, str)
+            or not isinstance(since, (str, type(None)))):
+        raise InvalidToken(cursor)
+    decode_token(token)
+    return key, last_id, token, since
+
+
+def page(sources, cursor=None, since=None):
+    """
+    Une page du flux : l'état initial sans `since`, sinon les lignes
+    modifiées depuis le jeton `since`. Les tables de MODELS sont parcourues
+    dans l'ordre, chacune par id croissant, au plus STAGES_SYNC_PAGE_SIZE
+    lignes en tout. `sources` associe chaque clé à (queryset, sérialiseur).
+    Le curseur retient la table, le dernier id, `since` et le jeton pris
+    avant la première page : une fois les pages parcourues, ?since=jeton
+    renvoie tout ce qui a changé entre-temps. Les suppressions sont sur la
+    première page. Renvoie (jeton, lignes par clé, ids supprimés par clé,
+    curseur suivant ou None).
+    """
+    keys = list(MODELS)
+    if cursor:
+        key, last_id, token, since = _page_cursor(cursor)
+    else:
+        key, last_id, token = keys[0], 0, next_token()
+    moment = decode_token(since) if since else None
+    removed = deleted(None if cursor else moment)
+    remaining = getattr(settings, 'STAGES_SYNC_PAGE_SIZE', 1000)
+    rows_by_key = {k: [] for k in keys}
+    for index in range(keys.index(key), len(keys)):
+        key = keys[index]
+        queryset, serialize = sources[key]
+        queryset = changed(key, queryset, moment).filter(id__gt=last_id).order_by('id')
+        rows = list(queryset[:remaining + 1])
+        more = len(rows) > remaining
+        rows = rows[:remaining]
+        remaining -= len(rows)
+        rows_by_key[key] = [serialize(row) for row in rows]
+        if more:
+            last = rows[-1]
+            last_id = last['id'] if isinstance(last, dict) else last.id
+            return token, rows_by_key, removed, encode_cursor([key, last_id, token, since], 'n')
+        last_id = 0
+        if not remaining and index + 1 < len(keys):
+            return token, rows_by_key, removed, encode_cursor([keys[index + 1], 0, token, since], 'n')
+    return token, rows_by_key, removed, None
+
+
+def changed(key, queryset, since):
+    """Lignes de `queryset` (modèle `key` de MODELS) modifiées depuis `since`."""
+    if since is None:
+        return queryset
+    field = MODELS[key][1]
+    return queryset.filter(**{f'{field}__gte': since})
+
+
+def deleted(since):
+    """Ids supprimés depuis `since`, regroupés par clé de MODELS."""
+    labels = {model._meta.label_lower: key for key, (model, _) in MODELS.items()}
+    result = {key: [] for key in MODELS}
+    if since is None:
+        return result
+    rows = (
+        Suppression.objects.filter(date_suppression__gte=since)
+        .order_by('id').values_list('modele', 'objet_id')
+    )
+    for modele, objet_id in rows:
+        if modele in labels:
+            result[labels[modele]].append(objet_id)
+    return result
+
+
+def record_deletion(instance):
+    Suppression.objects.create(modele=instance._meta.label_lower, objet_id=instance.pk)
+
+
+def purge(days=None):
+    days = getattr(settings, 'STAGES_SYNC_RETENTION_DAYS', 30) if days is None else days
+    deleted_count, _ = Suppression.objects.filter(
+        date_suppression__lt=timezone.now() - timedelta(days=days)
+    ).delete()
+    return deleted_count
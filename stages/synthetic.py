@@ -0,0 +1,192 @@
+"""
+Jeu de données synthétique pour les mesures de performance (commandes
+generate_data et bench_routes).
+
+Les lignes sont insérées par bulk_create, sans signaux : index de recherche,
+compteurs de références des fichiers, statistiques et cache sont mis à jour
+à la main, comme pour l'import en masse (stages.imports). À graine égale et
+base vide, deux générations produisent exactement les mêmes données.
+"""
+import random
+from collections import Counter, defaultdict
+from datetime import date, datetime, time, timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .models import Stagiaire, Encadrant, Stage, Rapport
+from . import cache, search, stats, storage
+
+NOMS = [
+    'Diallo', 'Traoré', 'Ouédraogo', 'Koné', 'Sawadogo', 'Zongo', 'Kaboré', 'Compaoré',
+    'Ilboudo', 'Kinda', 'Nikiema', 'Ouattara', 'Sanou', 'Tapsoba', 'Yaméogo', 'Zoungrana',
+    'Bationo', 'Dabiré', 'Guiro', 'Hien', 'Kambou', 'Lompo', 'Millogo', 'Somé',
+]
+PRENOMS = [
+    'Aminata', 'Issa', 'Mariam', 'Boukary', 'Fatimata', 'Moussa', 'Salimata', 'Adama',
+    'Awa', 'Souleymane', 'Rasmata', 'Ousmane', 'Bintou', 'Idrissa', 'Clarisse', 'Hamidou',
+    'Estelle', 'Drissa', 'Pélagie', 'Arouna', 'Nafissatou', 'Yacouba', 'Edwige', 'Lassané',
+]
+ECOLES = ['ESI', 'UJKZ', 'UNB', '2iE', 'ISGE', 'ENSP', 'IST', 'ESTA']
+FILIERES = [
+    'Informatique', 'Réseaux et télécoms', 'Génie civil', 'Électrotechnique', 'Gestion',
+    'Finance', 'Statistique', 'Mines', 'Agronomie', 'Droit',
+]
+SUJETS = [
+    'Mise en place', 'Conception', 'Audit', 'Optimisation', 'Étude', 'Déploiement',
+    'Migration', 'Supervision', 'Modélisation', 'Automatisation',
+]
+OBJETS = [
+    "d'un système d'information", "d'un réseau d'entreprise", "d'une application mobile",
+    "d'un entrepôt de données", "de la chaîne de facturation", "d'un ouvrage hydraulique",
+    "du parc informatique", "d'une plateforme de paiement", "de la gestion des stocks",
+    "d'un tableau de bord décisionnel",
+]
+CONTEXTES = [
+    'à la SONABEL', "à l'ONEA", 'dans une banque commerciale', 'dans une PME',
+    "dans un cabinet d'audit", 'dans une mairie', 'dans un opérateur mobile', 'dans un hôpital',
+]
+
+# Période couverte par les stages : les trois dernières années
+PERIODE_JOURS = 3 * 365
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def _email_offset(model):
+    # Emails uniques même si la base contient déjà des lignes
+    return (model.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+
+
+def _personnes(rng, model, count, domain, **champs):
+    offset = _email_offset(model)
+    for i in range(count):
+        nom, prenom = rng.choice(NOMS), rng.choice(PRENOMS)
+        email = f"{slugify(prenom)}.{slugify(nom)}.{offset + i}@{domain}"
+        yield model(
+            nom=nom, prenom=prenom, email=email,
+            telephone=f"+226 {rng.randint(50, 79)} {rng.randint(10, 99)} {rng.randint(10, 99)} {rng.randint(10, 99)}",
+            **{field: choose(rng) for field, choose in champs.items()},
+        )
+
+
+def _stages(rng, count, stagiaire_ids, encadrant_ids, today):
+    for _ in range(count):
+        debut = today - timedelta(days=rng.randint(0, PERIODE_JOURS))
+        stage = Stage(
+            theme=f"{rng.choice(SUJETS)} {rng.choice(OBJETS)} {rng.choice(CONTEXTES)}",
+            type_stage=rng.choice(['Academique', 'Professionnel']),
+            date_debut=debut,
+            date_fin=debut + timedelta(days=rng.choice([30, 60, 90, 120, 180])),
+            stagiaire_id=rng.choice(stagiaire_ids),
+            # Un stage sur dix sans encadrant
+            encadrant_id=rng.choice(encadrant_ids) if encadrant_ids and rng.random() > 0.1 else None,
+        )
+        stage.update_statut()
+        if stage.statut == 'Terminé' and rng.random() < 0.4:
+            stage.statut = 'Validé'
+        yield stage
+
+
+def _fichiers(rng, count, taille):
+    """Enregistre `count` fichiers factices distincts ; renvoie leurs noms de stockage."""
+    names = []
+    for i in range(count):
+        header = f"%PDF-1.4\n% Rapport de stage factice {i}\n".encode()
+        content = header + rng.randbytes(max(0, taille - len(header)))
+        names.append(storage.rapport_storage.save(f"rapports/rapport_{i}.pdf", ContentFile(content)))
+    return names
+
+
+def _rapports(rng, count, stages, fichiers, today):
+    for _ in range(count):
+        stage_id, statut, theme, date_fin = rng.choice(stages)
+        if statut == 'Validé':
+            etat = rng.choice(['Validé', 'Validé', 'Archivé'])
+        else:
+            etat = rng.choice(['En attente', 'En attente', 'Validé'])
+        rapport = Rapport(stage_id=stage_id, etat=etat, fichier=rng.choice(fichiers), contenu=f"{theme}. Rapport final.")
+        # Jour de dépôt : date_depot est en auto_now_add, corrigée après insertion
+        rapport.jour_depot = min(today, date_fin + timedelta(days=rng.randint(1, 30)))
+        yield rapport
+
+
+def generate(stagiaires=1000, encadrants=100, stages=None, rapports=None, fichiers=20,
+             taille=2048, seed=0, batch_size=None, log=None):
+    """
+    Génère stagiaires, encadrants, stages (un par stagiaire par défaut) et
+    rapports (cinq par stagiaire par défaut, sur les stages Terminés ou
+    Validés) reliés entre eux, avec `fichiers` fichiers factices de `taille`
+    octets partagés par les rapports. Renvoie le nombre de lignes créées par modèle.
+    """
+    stages = stagiaires if stages is None else stages
+    rapports = 5 * stagiaires if rapports is None else rapports
+    batch_size = batch_size or getattr(settings, 'STAGES_IMPORT_BATCH_SIZE', 1000)
+    log = log or (lambda message: None)
+    rng = random.Random(seed)
+    today = date.today()
+    counts = {}
+
+    def insert(model, instances):
+        created = []
+        for batch in _batches(instances, batch_size):
+            created.extend(model.objects.bulk_create(batch))
+        counts[model._meta.model_name] = len(created)
+        log(f"{model._meta.verbose_name_plural} : {len(created)}")
+        return created
+
+    with transaction.atomic():
+        stagiaire_ids = [obj.pk for obj in insert(Stagiaire, _personnes(
+            rng, Stagiaire, stagiaires, 'etudiant.bench.test',
+            ecole=lambda rng: rng.choice(ECOLES), filiere=lambda rng: rng.choice(FILIERES),
+        ))]
+        encadrant_ids = [obj.pk for obj in insert(Encadrant, _personnes(
+            rng, Encadrant, encadrants, 'encadrant.bench.test',
+            institution=lambda rng: rng.choice(['Interne', 'Externe']),
+        ))]
+        if not stagiaire_ids:
+            return counts
+
+        created = insert(Stage, _stages(rng, stages, stagiaire_ids, encadrant_ids, today))
+        stage_ids = [stage.pk for stage in created]
+        stats.apply(stats.count_stages(created))
+        deposables = [
+            (stage.pk, stage.statut, stage.theme, stage.date_fin)
+            for stage in created if stage.statut in ('Terminé', 'Validé')
+        ]
+        counts['rapport'] = 0
+        if deposables and rapports:
+            names = _fichiers(rng, fichiers, taille)
+            references = defaultdict(int)
+            jours = defaultdict(list)
+            compteurs = Counter()
+            for batch in _batches(_rapports(rng, rapports, deposables, names, today), batch_size):
+                for rapport in Rapport.objects.bulk_create(batch):
+                    references[rapport.fichier.name] += 1
+                    jours[rapport.jour_depot].append(rapport.pk)
+                    compteurs.update(stats.rapport_keys(rapport.jour_depot.year, rapport.etat))
+                counts['rapport'] += len(batch)
+            log(f"rapports : {counts['rapport']}")
+            # Une requête par jour de dépôt (et par lot), au plus PERIODE_JOURS + 30 jours
+            for jour, ids in jours.items():
+                moment = timezone.make_aware(datetime.combine(jour, time(10)))
+                for chunk in _batches(ids, batch_size):
+                    Rapport.objects.filter(pk__in=chunk).update(date_depot=moment, derniere_modif=moment)
+            for name, count in references.items():
+                storage.acquire(name, count)
+            stats.apply(compteurs)
+        # Stages et leurs rapports, en une passe
+        search.refresh_search_vectors(stage_ids)
+
+        for model in (Stagiaire, Encadrant, Stage, Rapport):
+            transaction.on_commit(lambda model=model: cache.bump_version(model))
+    return counts
@@ -1,3 +1,1122 @@
-from django.test import TestCase
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+import zlib
+from datetime import date, timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files import File
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connections, transaction
+from django.http import HttpResponse
+from django.test import (
+    AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+
+from gestion_stages import profiling
+
+from .admin import EstimatedCountPaginator
+from .forms import StageForm
+from .models import Stagiaire, Encadrant, Stage, Rapport, FichierRapport, VersionConflict
+from .querybudget import QueryBudgetExceeded
+from .views import STAGIAIRE_FIELDS, ENCADRANT_FIELDS
+from . import async_views, benchmark, cache, events, extraction, routers, search, stats, synthetic, workflow
+
+MEDIA_ROOT = tempfile.mkdtemp(prefix='stages-tests-')
+
+PDF = b'%PDF-1.4\n% Rapport de test\n' + b'0' * 512
+
+
+class Fixtures:
+    """Fabriques de données partagées par les classes de test."""
+
+    def make_stagiaire(self, nom='Diallo', prenom='Aminata', **champs):
+        champs.setdefault('email', f'{prenom}.{nom}.{Stagiaire.objects.count()}@test.bf'.lower())
+        return Stagiaire.objects.create(nom=nom, prenom=prenom, **champs)
+
+    def make_encadrant(self, nom='Traoré', prenom='Issa', **champs):
+        champs.setdefault('email', f'{prenom}.{nom}.{Encadrant.objects.count()}@test.bf'.lower())
+        champs.setdefault('institution', 'Interne')
+        return Encadrant.objects.create(nom=nom, prenom=prenom, **champs)
+
+    def make_stage(self, stagiaire=None, encadrant=None, debut=None, duree=90, **champs):
+        debut = debut or date.today() - timedelta(days=120)
+        champs.setdefault('theme', 'Audit du parc informatique')
+        champs.setdefault('type_stage', 'Academique')
+        return Stage.objects.create(
+            stagiaire=stagiaire or self.make_stagiaire(), encadrant=encadrant,
+            date_debut=debut, date_fin=debut + timedelta(days=duree), **champs,
+        )
+
+    def make_rapport(self, stage=None, etat='En attente', contenu=PDF):
+        return Rapport.objects.create(
+            stage=stage or self.make_stage(), etat=etat,
+            fichier=SimpleUploadedFile('rapport.pdf', contenu, 'application/pdf'),
+        )
+
+    def post_json(self, url, data):
+        return self.client.post(url, json.dumps(data), content_type='application/json')
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT, STAGES_EXTRACTION_MODE='sync',
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+)
+class StagesTestCase(Fixtures, TestCase):
+    """
+    Base des tests : fichiers dans un dossier temporaire, extraction
+    synchrone, cache de réponses désactivé (LocMemCache) sauf dans
+    ResponseCacheTests.
+    """
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+
+class BatchTests(StagesTestCase):
+    def test_rollback_on_error(self):
+        response = self.post_json('/batch/', [
+            {'op': 'create', 'resource': 'stagiaires',
+             'data': {'nom': 'Kaboré', 'prenom': 'Awa', 'email': 'awa@test.bf'}},
+            {'op': 'update', 'resource': 'stagiaires', 'id': 999999, 'data': {'nom': 'X'}},
+        ])
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()['index'], 1)
+        self.assertFalse(Stagiaire.objects.filter(email='awa@test.bf').exists())
+
+    def test_ref_to_created_object(self):
+        encadrant = self.make_encadrant()
+        response = self.post_json('/batch/', [
+            {'op': 'create', 'resource': 'stagiaires',
+             'data': {'nom': 'Kaboré', 'prenom': 'Awa', 'email': 'awa@test.bf'}},
+            {'op': 'create', 'resource': 'stages', 'data': {
+                'theme': 'Migration', 'type_stage': 'Academique', 'date_debut': '2024-01-01',
+                'date_fin': '2024-03-31', 'stagiaire': {'$ref': 0}, 'encadrant': encadrant.pk}},
+        ])
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual(Stage.objects.get(pk=results[1]['id']).stagiaire_id, results[0]['id'])
+
+    def test_rapport_rules_match_detail_view(self):
+        archive = self.make_rapport(etat='Archivé')
+        response = self.post_json('/batch/', [{'op': 'delete', 'resource': 'rapports', 'id': archive.pk}])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('etat', response.json()['errors'])
+        response = self.post_json('/batch/', [{'op': 'update', 'resource': 'rapports', 'id': archive.pk, 'data': {}}])
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(Rapport.objects.filter(pk=archive.pk).exists())
+        self.assertEqual(self.client.delete(f'/rapports/api/{archive.pk}/').status_code, 400)
+
+        en_attente = self.make_rapport()
+        response = self.post_json('/batch/', [{'op': 'delete', 'resource': 'rapports', 'id': en_attente.pk}])
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Rapport.objects.filter(pk=en_attente.pk).exists())
+
+
+class EventsTests(StagesTestCase):
+    def test_wsgi_refuses_stream(self):
+        # Sous WSGI, le flux sans fin bloquerait le worker
+        self.assertEqual(self.client.get('/events/').status_code, 501)
+
+    async def test_asgi_stream(self):
+        response = await self.async_client.get('/events/', {'encadrant': 7})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        content = response.streaming_content
+        try:
+            self.assertTrue((await anext(content)).startswith(b'retry:'))
+            events.get_broker().publish({'type': 'stage', 'action': 'updated', 'stage_id': 1, 'encadrant_id': 8})
+            events.get_broker().publish({'type': 'stage', 'action': 'updated', 'stage_id': 2, 'encadrant_id': 7})
+            chunk = await anext(content)
+        finally:
+            await content.aclose()
+        self.assertIn(b'event: stage', chunk)
+        self.assertIn(b'"stage_id":2', chunk)
+
+
+# Cache désactivé : le budget porte sur le calcul complet de la réponse.
+# TransactionTestCase : les on_commit (extraction, cache...) s'exécutent
+# pendant la requête, comme en production.
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT, STAGES_EXTRACTION_MODE='sync', STAGES_QUERY_BUDGET_STRICT=True,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+)
+class QueryBudgetTests(Fixtures, TransactionTestCase):
+    def setUp(self):
+        # Plusieurs lignes de chaque sorte : un N+1 dépasserait le budget
+        encadrants = [self.make_encadrant(nom=f'Encadrant{i}') for i in range(3)]
+        self.stages = [
+            self.make_stage(self.make_stagiaire(nom=f'Stagiaire{i}'), encadrants[i], theme=f'Audit {i}')
+            for i in range(3)
+        ]
+        self.rapports = {
+            etat: [self.make_rapport(stage, etat=etat, contenu=PDF + etat.encode() + bytes([i]))
+                   for i, stage in enumerate(self.stages)]
+            for etat in ('En attente', 'Validé', 'Archivé')
+        }
+
+    def requests(self):
+        en_attente, valides = self.rapports['En attente'], self.rapports['Validé']
+        upload = lambda: SimpleUploadedFile('depot.pdf', PDF + b'depot', 'application/pdf')
+        since = self.client.get('/sync/').json()['token']
+        return [
+            ('home', 'get', '/', {}),
+            ('stagiaires_api', 'get', '/stagiaires/api/', {}),
+            ('stagiaires_api', 'get', '/stagiaires/api/?stream=1', {}),
+            ('encadrants_api', 'get', '/encadrants/api/', {}),
+            ('encadrants_api', 'get', '/encadrants/api/?stream=1', {}),
+            ('stages_api', 'get', '/stages/api/', {}),
+            ('stages_api', 'get', '/stages/api/?stream=1', {}),
+            ('rapports_api', 'get', '/rapports/api/', {}),
+            ('rapports_api', 'get', '/rapports/api/?stream=1', {}),
+            ('rapports_zip', 'get', '/rapports/api/zip/', {}),
+            ('stages_search', 'get', '/stages/api/search/?q=audit', {}),
+            ('rapport_detail', 'get', f'/rapports/api/{en_attente[0].pk}/', {}),
+            ('rapport_detail', 'delete', f'/rapports/api/{en_attente[1].pk}/', {}),
+            ('rapport_create', 'post', '/rapports/api/create/',
+             {'data': {'stage': self.stages[0].pk, 'fichier': upload()}}),
+            ('rapport_valider', 'post', f'/rapports/api/{en_attente[2].pk}/valider/', {}),
+            ('rapport_archiver', 'post', f'/rapports/api/{valides[0].pk}/archiver/', {}),
+            ('rapport_download', 'get', f'/rapports/api/{valides[1].pk}/download/', {}),
+            ('rapport_fichier', 'get', f'/rapports/api/{valides[1].pk}/fichier/', {}),
+            ('rapports_valider', 'post', '/rapports/api/valider/',
+             {'data': json.dumps({'ids': [r.pk for r in self.rapports['Archivé']]}), 'content_type': 'application/json'}),
+            ('rapports_archiver', 'post', '/rapports/api/archiver/',
+             {'data': json.dumps({'ids': [r.pk for r in valides]}), 'content_type': 'application/json'}),
+            ('sync', 'get', '/sync/', {}),
+            ('sync', 'get', f'/sync/?since={since}', {}),
+            ('stats', 'get', '/stats/', {}),
+        ]
+
+    def test_budgeted_views_in_strict_mode(self):
+        covered = set()
+        for name, method, url, options in self.requests():
+            with self.subTest(view=name, method=method, url=url):
+                response = getattr(self.client, method)(url, **options)
+                # Flux : le budget est contrôlé à la fin de l'envoi
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                self.assertLess(response.status_code, 500)
+                covered.add(name)
+        budgeted = {name for name, limit in settings.STAGES_QUERY_BUDGETS.items() if limit is not None}
+        self.assertEqual(budgeted - covered, set())
+
+    @override_settings(STAGES_QUERY_BUDGETS={'stagiaires_api': 0})
+    def test_stream_is_counted(self):
+        response = self.client.get('/stagiaires/api/?stream=1')
+        with self.assertRaises(QueryBudgetExceeded):
+            b''.join(response.streaming_content)
+
+
+class ConcurrencyTests(StagesTestCase):
+    def test_stale_instance_conflicts(self):
+        stagiaire = self.make_stagiaire()
+        copie = Stagiaire.objects.get(pk=stagiaire.pk)
+        stagiaire.nom = 'Kaboré'
+        stagiaire.save()
+        copie.nom = 'Sawadogo'
+        with self.assertRaises(VersionConflict), transaction.atomic():
+            copie.save()
+        self.assertEqual(Stagiaire.objects.get(pk=stagiaire.pk).nom, 'Kaboré')
+
+    def test_if_match(self):
+        stagiaire = self.make_stagiaire()
+        url = f'/stagiaires/api/{stagiaire.pk}/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 304)
+        response = self.client.patch(url, json.dumps({'nom': 'Kaboré'}), content_type='application/json',
+                                     headers={'If-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        response = self.client.patch(url, json.dumps({'nom': 'Sawadogo'}), content_type='application/json',
+                                     headers={'If-Match': etag})
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(Stagiaire.objects.get(pk=stagiaire.pk).nom, 'Kaboré')
+
+    def test_stage_etag_follows_effective_statut(self):
+        stage = self.make_stage(debut=date.today() - timedelta(days=10), duree=30)
+        url = f'/stages/api/{stage.pk}/'
+        etag = self.client.get(url)['ETag']
+        # Échéance passée sans nouvelle version (le temps a passé)
+        Stage.objects.filter(pk=stage.pk).update(date_fin=date.today() - timedelta(days=1))
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['statut'], 'Terminé')
+
+    def test_batch_conflict(self):
+        with mock.patch('stages.batch._apply', side_effect=VersionConflict('périmée')):
+            response = self.post_json('/batch/', [{'op': 'delete', 'resource': 'stagiaires', 'id': 1}])
+        self.assertEqual(response.status_code, 409)
+        with mock.patch('stages.batch._apply', side_effect=VersionConflict('périmée')):
+            response = self.client.post('/batch/', '[{}]', content_type='application/json',
+                                        headers={'If-Match': '"1"'})
+        self.assertEqual(response.status_code, 412)
+
+
+class ExtractionTests(StagesTestCase):
+    def test_pdf_text(self):
+        texte = zlib.compress(b'BT (Rapport de stage) Tj T* [(Audit) -250 (r\\351seau)] TJ ET')
+        with self.captureOnCommitCallbacks(execute=True):
+            rapport = self.make_rapport(contenu=PDF + b'1 0 obj\nstream\r\n' + texte + b'\r\nendstream\n')
+        rapport.refresh_from_db()
+        self.assertEqual(rapport.contenu, 'Rapport de stage Auditréseau')
+
+    def test_pdf_read_stops_at_limit(self):
+        page = b'stream\n(' + b'mot ' * 100 + b') Tj\nendstream\n'
+        f = File(io.BytesIO(PDF + page * 1000))
+        self.assertEqual(len(extraction.extract_pdf(f, 50)), 50)
+        self.assertLess(f.tell(), 2 * extraction.CHUNK_SIZE)
+
+    def test_extraction_invalidates_cache(self):
+        with override_settings(STAGES_EXTRACTION_MODE='off'):
+            rapport = self.make_rapport()
+        [version] = cache.get_versions([Rapport])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(extraction.extract_rapport(rapport.pk))
+        self.assertNotEqual(cache.get_versions([Rapport]), [version])
+
+    @override_settings(STAGES_EXTRACTION_MAX_INFLATED=1024 * 1024)
+    def test_pdf_inflate_capped(self):
+        # 256 Mo de zéros en ~250 Ko compressés, suivis d'un flux de texte
+        bombe = zlib.compressobj()
+        bombe = b''.join([bombe.compress(bytes(1024 * 1024)) for _ in range(256)] + [bombe.flush()])
+        texte = b'stream\n(Conclusion) Tj\nendstream\n'
+        f = File(io.BytesIO(PDF + texte + b'stream\n' + bombe + b'\nendstream\n' + texte))
+        with mock.patch.object(zlib, 'decompress', side_effect=AssertionError):
+            self.assertEqual(extraction.extract_pdf(f, 1000), 'Conclusion')
+
+
+@override_settings(STAGES_STATUT_BATCH_SIZE=2)
+class StatutTests(StagesTestCase):
+    def test_terminer_stages_echus_by_batches(self):
+        echus = [self.make_stage(debut=date.today() - timedelta(days=10), duree=30) for _ in range(5)]
+        # Le temps passe : échus mais encore « En cours » en base
+        Stage.objects.filter(pk__in=[s.pk for s in echus]).update(date_fin=date.today() - timedelta(days=1))
+        valide = self.make_stage(statut='Validé', duree=10)
+        en_cours = self.make_stage(debut=date.today(), duree=30)
+
+        self.assertCountEqual(workflow.terminer_stages_echus(), [s.pk for s in echus])
+        self.assertEqual(Stage.objects.filter(statut='Terminé').count(), 5)
+        self.assertEqual(Stage.objects.get(pk=valide.pk).statut, 'Validé')
+        self.assertEqual(Stage.objects.get(pk=en_cours.pk).statut, 'En cours')
+        self.assertEqual(workflow.terminer_stages_echus(), [])
+        # Compteurs tenus par lot identiques à un recalcul complet
+        summary = stats.summary()
+        stats.rebuild()
+        self.assertEqual(stats.summary(), summary)
+
+    def test_one_cache_bump_per_batch(self):
+        stages = [self.make_stage(duree=10) for _ in range(5)]
+        Stage.objects.filter(pk__in=[s.pk for s in stages]).update(statut='En cours')
+        with mock.patch.object(cache, 'bump_version') as bump, self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(len(workflow.terminer_stages_echus()), 5)
+        # Lots de 2 : trois UPDATE, trois invalidations (et non une par stage)
+        self.assertEqual(bump.call_args_list, [mock.call(Stage)] * 3)
+
+    def test_recalculer_statuts(self):
+        stages = [self.make_stage(duree=10) for _ in range(3)]
+        Stage.objects.filter(pk=stages[0].pk).update(date_fin=date.today() + timedelta(days=30))
+        ids = workflow.recalculer_statuts(Stage.objects.values('pk'))
+        self.assertEqual(ids, [stages[0].pk])
+        self.assertEqual(Stage.objects.get(pk=stages[0].pk).statut, 'En cours')
+
+
+class ResponseCacheTests(StagesTestCase):
+    def setUp(self):
+        self.make_stagiaire()
+        cache.get_cache().clear()
+
+    def test_disabled_on_locmem(self):
+        # Cache propre au processus : chaque worker servirait ses propres réponses
+        self.assertFalse(cache.enabled())
+        self.client.get('/stagiaires/api/')
+        with self.assertNumQueries(1):
+            self.client.get('/stagiaires/api/')
+
+    def test_enabled_on_file_cache(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location, ignore_errors=True)
+        backend = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location}
+        with self.settings(CACHES={'default': backend}, STAGES_CACHE_ENABLED=None):
+            self.assertTrue(cache.enabled())
+            self.client.get('/stagiaires/api/')
+            with self.assertNumQueries(0):
+                self.client.get('/stagiaires/api/')
+            with self.captureOnCommitCallbacks(execute=True):
+                self.make_stagiaire(nom='Kaboré')
+            noms = [s['nom'] for s in self.client.get('/stagiaires/api/').json()['results']]
+            self.assertIn('Kaboré', noms)
+
+    @override_settings(STAGES_CACHE_ENABLED=True)
+    def test_cached_until_write(self):
+        etag = self.client.get('/stagiaires/api/')['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/stagiaires/api/').status_code, 200)
+            self.assertEqual(self.client.get('/stagiaires/api/', headers={'If-None-Match': etag}).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.make_stagiaire(nom='Kaboré')
+        response = self.client.get('/stagiaires/api/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Kaboré', [s['nom'] for s in response.json()['results']])
+
+
+class SyncTests(StagesTestCase):
+    def pages(self):
+        response = self.client.get('/sync/').json()
+        pages = [response]
+        while response['next']:
+            response = self.client.get('/sync/', {'cursor': response['next']}).json()
+            pages.append(response)
+        return pages
+
+    @override_settings(STAGES_SYNC_PAGE_SIZE=2)
+    def test_snapshot_pages(self):
+        stages = [self.make_stage() for _ in range(3)]
+        self.make_encadrant()
+        self.make_rapport(stages[0])
+        pages = self.pages()
+        self.assertEqual(len(pages), 4)
+        self.assertEqual({page['token'] for page in pages}, {pages[0]['token']})
+        for key, model in [('stagiaires', Stagiaire), ('encadrants', Encadrant), ('stages', Stage), ('rapports', Rapport)]:
+            ids = [row['id'] for page in pages for row in page[key]]
+            self.assertEqual(ids, list(model.objects.order_by('id').values_list('id', flat=True)))
+        self.assertNotIn('nom_normalise', pages[0]['stagiaires'][0])
+
+    def test_changes_and_tombstones_since_token(self):
+        stage = self.make_stage()
+        stagiaire = self.make_stagiaire(nom='Kaboré')
+        token = self.pages()[-1]['token']
+        stagiaire.nom = 'Sawadogo'
+        stagiaire.save()
+        stage_id = stage.pk
+        stage.delete()
+        response = self.client.get('/sync/', {'since': token}).json()
+        self.assertIn('Sawadogo', [row['nom'] for row in response['stagiaires']])
+        self.assertEqual(response['deleted']['stages'], [stage_id])
+        self.assertIsNone(response['next'])
+
+    def test_rows_reference_related_ids_only(self):
+        rapport = self.make_rapport()
+        row = self.client.get('/sync/').json()['rapports'][0]
+        self.assertEqual(row['stage_id'], rapport.stage_id)
+        self.assertEqual(row['sha256'], rapport.sha256)
+        self.assertNotIn('stage', row)
+        self.assertNotIn('stagiaire__nom', self.client.get('/sync/').json()['stages'][0])
+
+    @override_settings(STAGES_SYNC_PAGE_SIZE=2, STAGES_SYNC_MARGIN=0)
+    def test_changes_paged(self):
+        anciens = [self.make_stagiaire(nom=f'Ancien{i}') for i in range(2)]
+        token = self.pages()[-1]['token']
+        nouveaux = [self.make_stagiaire(nom=f'Nouveau{i}') for i in range(3)]
+        self.make_encadrant()
+        supprime = anciens[0].pk
+        anciens[0].delete()
+        pages = [self.client.get('/sync/', {'since': token}).json()]
+        while pages[-1]['next']:
+            pages.append(self.client.get('/sync/', {'cursor': pages[-1]['next']}).json())
+        sizes = [sum(len(page[key]) for key in ('stagiaires', 'encadrants', 'stages', 'rapports')) for page in pages]
+        self.assertEqual(sizes[:2], [2, 2])
+        self.assertEqual(sum(sizes), 4)
+        self.assertEqual([row['id'] for page in pages for row in page['stagiaires']], [s.pk for s in nouveaux])
+        self.assertEqual(pages[0]['deleted']['stagiaires'], [supprime])
+        self.assertEqual(pages[1]['deleted']['stagiaires'], [])
+
+    def test_bad_tokens(self):
+        self.assertEqual(self.client.get('/sync/', {'since': 'abc'}).status_code, 400)
+        self.assertEqual(self.client.get('/sync/', {'cursor': 'abc'}).status_code, 400)
+        self.assertEqual(self.client.get('/sync/', {'since': '1000000'}).status_code, 410)
+
+
+class StatsTests(StagesTestCase):
+    def assertMatchesRebuild(self):
+        summary = stats.summary()
+        stats.rebuild()
+        self.assertEqual(stats.summary(), summary)
+        return summary
+
+    def test_deltas_follow_writes(self):
+        stagiaire = self.make_stagiaire(ecole='ESI', filiere='Réseaux')
+        stage = self.make_stage(stagiaire, debut=date(2024, 2, 1))
+        rapport = self.make_rapport(stage)
+        total = self.assertMatchesRebuild()['total']
+        self.assertEqual((total['stages'], total['ecole'], total['etat']), (1, {'ESI': 1}, {'En attente': 1}))
+
+        stage.type_stage = 'Professionnel'
+        stage.save()
+        stagiaire.ecole = 'UJKZ'
+        stagiaire.save()
+        workflow.valider_rapports([rapport.pk])
+        total = self.assertMatchesRebuild()['total']
+        self.assertEqual(total['type_stage'], {'Professionnel': 1})
+        self.assertEqual(total['ecole'], {'UJKZ': 1})
+        self.assertEqual(total['statut'], {'Validé': 1})
+        self.assertEqual(total['etat'], {'Validé': 1})
+
+        # Suppression en cascade : stage et rapport retirés des compteurs
+        stagiaire.delete()
+        self.assertEqual(self.assertMatchesRebuild()['total']['rapports'], 0)
+        self.assertEqual(self.client.get('/stats/').json()['total']['stages'], 0)
+
+    def test_rebuild_from_migration_registry(self):
+        self.make_rapport()
+        expected = stats.summary()
+        stats.rebuild(apps)
+        self.assertEqual(stats.summary(), expected)
+
+
+class FieldListTests(StagesTestCase):
+    def setUp(self):
+        self.make_stagiaire(ecole='ESI')
+        self.make_stagiaire(nom='Kaboré', ecole='UJKZ')
+        self.make_encadrant()
+
+    def test_same_columns_for_all_lists(self):
+        for url, fields in [('/stagiaires/api/', STAGIAIRE_FIELDS), ('/encadrants/api/', ENCADRANT_FIELDS)]:
+            with self.subTest(url=url):
+                row = self.client.get(url).json()['results'][0]
+                self.assertEqual(list(row), list(fields))
+                # Ni version, ni updated_at, ni copies normalisées
+                self.assertNotIn('version', row)
+
+    def test_sparse_fields_and_filters(self):
+        results = self.client.get('/stagiaires/api/', {'fields': 'nom', 'ecole': 'UJKZ'}).json()['results']
+        self.assertEqual(results, [{'nom': 'Kaboré'}])
+        self.assertEqual(self.client.get('/encadrants/api/', {'fields': 'nom,email'}).json()['results'][0].keys(),
+                         {'nom', 'email'})
+        self.assertEqual(self.client.get('/encadrants/api/', {'fields': 'version'}).status_code, 400)
+
+    async def test_async_views_match(self):
+        for view, url in [(async_views.stagiaires_api, '/stagiaires/api/'),
+                          (async_views.encadrants_api, '/encadrants/api/')]:
+            response = await view(AsyncRequestFactory().get(url))
+            expected = await sync_to_async(self.client.get)(url)
+            self.assertEqual(json.loads(response.content), expected.json())
+
+
+class WorkflowEventsTests(StagesTestCase):
+    def test_valider_publishes_changed_stages_only(self):
+        deja_valide = self.make_stage(statut='Validé')
+        en_cours = self.make_stage(debut=date.today(), encadrant=self.make_encadrant())
+        rapports = [self.make_rapport(deja_valide).pk, self.make_rapport(en_cours).pk]
+        with mock.patch.object(events, 'publish') as publish:
+            updated, rejected = workflow.valider_rapports(rapports)
+        self.assertEqual((updated, rejected), (rapports, {}))
+        published = [(args[0], kwargs.get('stage_id')) for args, kwargs in publish.call_args_list]
+        self.assertCountEqual(published, [
+            ('rapport', deja_valide.pk), ('rapport', en_cours.pk), ('stage', en_cours.pk),
+        ])
+        stage_event = next(kwargs for args, kwargs in publish.call_args_list if args[0] == 'stage')
+        self.assertEqual(stage_event['encadrant_id'], en_cours.encadrant_id)
+
+
+class DownloadTests(StagesTestCase):
+    def setUp(self):
+        self.url = f'/rapports/api/{self.make_rapport(etat="Validé").pk}/fichier/'
+
+    def get(self, **headers):
+        response = self.client.get(self.url, headers=headers)
+        return response, b''.join(response.streaming_content) if response.streaming else response.content
+
+    def test_range(self):
+        response, body = self.get(Range='bytes=0-7')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, PDF[:8])
+        self.assertEqual(response['Content-Range'], f'bytes 0-7/{len(PDF)}')
+        response, body = self.get(Range='bytes=-4')
+        self.assertEqual(body, PDF[-4:])
+
+    def test_unsupported_range_sends_whole_file(self):
+        for header in ('bytes=0-1,4-5', 'bytes=9-3', 'items=0-1'):
+            with self.subTest(header=header):
+                response, body = self.get(Range=header)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(body, PDF)
+
+    def test_unsatisfiable_range(self):
+        response, _ = self.get(Range=f'bytes={len(PDF)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(PDF)}')
+
+    def test_etag_and_if_range(self):
+        response, _ = self.get()
+        etag = response['ETag']
+        self.assertEqual(self.get(**{'If-None-Match': etag})[0].status_code, 304)
+        self.assertEqual(self.get(Range='bytes=0-7', **{'If-Range': etag})[0].status_code, 206)
+        # Fichier changé depuis : envoi complet
+        self.assertEqual(self.get(Range='bytes=0-7', **{'If-Range': '"autre"'})[0].status_code, 200)
+
+    def test_en_attente_not_downloadable(self):
+        rapport = self.make_rapport()
+        self.assertEqual(self.client.get(f'/rapports/api/{rapport.pk}/fichier/').status_code, 403)
+
+
+class PaginationTests(StagesTestCase):
+    def walk(self, url, params, direction='next'):
+        pages = [self.client.get(url, params).json()]
+        while pages[-1][direction]:
+            pages.append(self.client.get(url, {**params, 'cursor': pages[-1][direction]}).json())
+        return pages
+
+    def test_cursor_walk_with_ties(self):
+        for theme in ('Réseau', 'Audit', 'Réseau', 'Audit', 'Cloud'):
+            self.make_stage(theme=theme)
+        params = {'ordering': '-theme', 'limit': 2, 'fields': 'id,theme'}
+        pages = self.walk('/stages/api/', params)
+        self.assertEqual([len(page['results']) for page in pages], [2, 2, 1])
+        ids = [row['id'] for page in pages for row in page['results']]
+        self.assertEqual(ids, list(Stage.objects.order_by('-theme', 'id').values_list('id', flat=True)))
+        self.assertIsNone(pages[0]['prev'])
+
+        # Retour en arrière depuis la dernière page : mêmes pages
+        back = [pages[-1]]
+        while back[-1]['prev']:
+            back.append(self.client.get('/stages/api/', {**params, 'cursor': back[-1]['prev']}).json())
+        self.assertEqual([page['results'] for page in reversed(back)], [page['results'] for page in pages])
+
+    def test_rapports_by_depot_date(self):
+        rapports = [self.make_rapport(contenu=PDF + bytes([i])) for i in range(3)]
+        ids = [row['id'] for page in self.walk('/rapports/api/', {'limit': 1}) for row in page['results']]
+        self.assertEqual(ids, [r.pk for r in reversed(rapports)])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/stagiaires/api/', {'cursor': 'xyz'}).status_code, 400)
+        self.assertEqual(self.client.get('/stages/api/', {'ordering': 'statut'}).status_code, 400)
+
+    @override_settings(STAGES_MAX_PAGE_SIZE=3)
+    def test_limit_is_capped(self):
+        for _ in range(5):
+            self.make_stagiaire()
+        page = self.client.get('/stagiaires/api/', {'limit': 100}).json()
+        self.assertEqual(len(page['results']), 3)
+        self.assertIsNotNone(page['next'])
+
+
+@override_settings(STAGES_STREAM_CHUNK_SIZE=2)
+class StreamingTests(StagesTestCase):
+    def read(self, response):
+        chunks = list(response.streaming_content)
+        return b''.join(chunks).decode(), chunks
+
+    def test_json_array_in_chunks(self):
+        for _ in range(5):
+            self.make_stagiaire()
+        body, chunks = self.read(self.client.get('/stagiaires/api/', {'stream': 1}))
+        self.assertEqual([row['id'] for row in json.loads(body)],
+                         list(Stagiaire.objects.order_by('id').values_list('id', flat=True)))
+        # Premier octet envoyé avant la lecture des lignes
+        self.assertEqual(chunks[0], b'[')
+        self.assertEqual(self.read(self.client.get('/encadrants/api/', {'stream': 1}))[0], '[]')
+
+    def test_ndjson(self):
+        stage = self.make_stage()
+        response = self.client.get('/stages/api/', headers={'Accept': 'application/x-ndjson'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = self.read(response)[0].splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [stage.pk])
+
+    async def test_async_stream(self):
+        await sync_to_async(self.make_stagiaire)()
+        response = await async_views.stagiaires_api(AsyncRequestFactory().get('/stagiaires/api/', {'stream': 'ndjson'}))
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(body.decode().splitlines()), 1)
+
+
+class SearchTests(StagesTestCase):
+    def setUp(self):
+        self.audit = self.make_stage(self.make_stagiaire(nom='Ouédraogo'), theme='Audit de sécurité réseau')
+        self.cloud = self.make_stage(theme='Migration vers le cloud')
+
+    def find(self, **params):
+        response = self.client.get('/stages/api/search/', params)
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.json()['results']]
+
+    def test_requires_q(self):
+        self.assertEqual(self.client.get('/stages/api/search/').status_code, 400)
+
+    def test_theme_and_person(self):
+        self.assertEqual(self.find(q='audit'), [self.audit.pk])
+        self.assertEqual(self.find(q='Ouédraogo'), [self.audit.pk])
+        self.assertEqual(self.find(q='cloud', fields='id,theme'), [self.cloud.pk])
+
+    def test_rapports(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            rapport = self.make_rapport(self.cloud)
+        response = self.client.get('/rapports/api/', {'q': 'cloud'})
+        self.assertEqual([row['id'] for row in response.json()['results']], [rapport.pk])
+
+    @skipUnless(search.search_enabled(), "plein texte PostgreSQL")
+    def test_prefix_and_typos(self):
+        self.assertEqual(self.find(q='secu'), [self.audit.pk])
+        # Faute de frappe rattrapée par les trigrammes
+        self.assertEqual(self.find(q='Migraton vers le clod'), [self.cloud.pk])
+
+    @skipUnless(search.search_enabled(), "plein texte PostgreSQL")
+    def test_rank_cursor_walk(self):
+        # Beaucoup d'ex aequo et des rangs float4 non représentables en décimal court
+        for i in range(30):
+            self.make_stage(theme=f"Audit {'réseau ' * (i % 4)}{'audit ' * (i % 3)}n{i}")
+        expected = self.find(q='audit', limit=500)
+        ids, cursor = [], None
+        while True:
+            params = {'q': 'audit', 'limit': 4, **({'cursor': cursor} if cursor else {})}
+            page = self.client.get('/stages/api/search/', params).json()
+            ids += [row['id'] for row in page['results']]
+            cursor = page['next']
+            if not cursor:
+                break
+        self.assertEqual(ids, expected)
+        self.assertEqual(len(set(ids)), Stage.objects.filter(theme__startswith='Audit').count())
+
+
+class StorageTests(StagesTestCase):
+    def test_same_content_stored_once(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            premier, second = self.make_rapport(), self.make_rapport()
+        self.assertEqual(premier.fichier.name, second.fichier.name)
+        digest = hashlib.sha256(PDF).hexdigest()
+        self.assertEqual(premier.sha256, digest)
+        self.assertTrue(premier.fichier.name.endswith(f'{digest[:2]}/{digest}.pdf'))
+        self.assertEqual(FichierRapport.objects.get(sha256=digest).nb_references, 2)
+        self.assertEqual(self.client.get(f'/rapports/api/fichiers/{digest}/').json(),
+                         {'sha256': digest, 'taille': len(PDF)})
+
+        path = premier.fichier.path
+        with self.captureOnCommitCallbacks(execute=True):
+            premier.delete()
+        self.assertEqual(FichierRapport.objects.get(sha256=digest).nb_references, 1)
+        self.assertTrue(os.path.exists(path))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(FichierRapport.objects.filter(sha256=digest).exists())
+        self.assertFalse(os.path.exists(path))
+
+    def test_one_blob_per_digest(self):
+        premier = self.make_rapport()
+        second = Rapport.objects.create(stage=premier.stage, fichier=SimpleUploadedFile('RAPPORT.odt', PDF))
+        self.assertEqual(second.fichier.name, premier.fichier.name)
+        self.assertEqual(FichierRapport.objects.get().nb_references, 2)
+
+    def test_purge_orphans(self):
+        garde = self.make_rapport()
+        # Dépôt annulé après l'écriture du fichier
+        with self.assertRaises(ValueError), transaction.atomic():
+            annule = self.make_rapport(contenu=PDF + b'annule')
+            raise ValueError
+        self.assertTrue(os.path.exists(annule.fichier.path))
+        call_command('purge_fichiers', '--hours=1', stdout=io.StringIO())
+        self.assertTrue(os.path.exists(annule.fichier.path))
+        call_command('purge_fichiers', '--hours=0', stdout=io.StringIO())
+        self.assertFalse(os.path.exists(annule.fichier.path))
+        self.assertTrue(os.path.exists(garde.fichier.path))
+
+
+class ZipTests(StagesTestCase):
+    def test_zip_of_downloadable_rapports(self):
+        info = self.make_stage(self.make_stagiaire(nom='Sawadogo', prenom='Ali', filiere='Info'))
+        reseau = self.make_stage(self.make_stagiaire(filiere='Réseaux'))
+        valide = self.make_rapport(info, etat='Validé', contenu=PDF + b'1')
+        self.make_rapport(info, etat='Archivé', contenu=PDF + b'2')
+        self.make_rapport(reseau, etat='Validé', contenu=PDF + b'3')
+        self.make_rapport(info, contenu=PDF + b'4')
+
+        response = self.client.get('/rapports/api/zip/', {'filiere': 'Info'})
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertIsNone(archive.testzip())
+        annee = valide.date_depot.year
+        names = archive.namelist()
+        self.assertEqual(len(names), 2)
+        self.assertIn(f'{annee}/Info/Sawadogo_Ali_rapport_{valide.pk}.pdf', names)
+        self.assertEqual(archive.read(names[0])[:len(PDF)], PDF)
+
+
+class ImportTests(StagesTestCase):
+    def test_csv_stagiaires(self):
+        csv_body = 'nom;prenom;ecole;filiere;email;telephone\nKaboré;Awa;ESI;Info;awa@test.bf;70000000\n' \
+                   'Sawadogo;Ali;ESI;Réseaux;ali@test.bf;70000001\n'
+        response = self.client.post('/stagiaires/api/import/', csv_body, content_type='text/csv')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['created'], 2)
+        self.assertEqual(Stagiaire.objects.get(email='awa@test.bf').nom_normalise, 'kabore')
+
+    def test_all_or_nothing_with_line_errors(self):
+        self.make_stagiaire(email='pris@test.bf')
+        rows = [
+            {'nom': 'A', 'prenom': 'B', 'email': 'ok@test.bf'},
+            {'nom': 'C', 'prenom': 'D', 'email': 'pris@test.bf'},
+            {'nom': 'E', 'prenom': 'F', 'email': 'double@test.bf'},
+            {'nom': 'G', 'prenom': 'H', 'email': 'double@test.bf'},
+            {'nom': 'I', 'prenom': 'J', 'email': 'pas-un-email'},
+        ]
+        response = self.post_json('/stagiaires/api/import/', rows)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['ligne'] for error in response.json()['errors']], [2, 4, 5])
+        self.assertFalse(Stagiaire.objects.filter(email='ok@test.bf').exists())
+
+    @override_settings(STAGES_IMPORT_MAX_BYTES=100)
+    def test_size_limit(self):
+        rows = [{'nom': 'A', 'prenom': 'B', 'email': f'{i}@test.bf'} for i in range(5)]
+        self.assertEqual(self.post_json('/stagiaires/api/import/', rows).status_code, 413)
+        fichier = SimpleUploadedFile('import.json', json.dumps(rows).encode())
+        self.assertEqual(self.client.post('/stagiaires/api/import/', {'fichier': fichier}).status_code, 413)
+        self.assertFalse(Stagiaire.objects.exists())
+
+    def test_stages_by_email_and_dry_run(self):
+        stagiaire = self.make_stagiaire()
+        rows = [{'theme': 'Audit', 'type_stage': 'Academique', 'date_debut': '2024-01-08',
+                 'date_fin': '2024-03-29', 'stagiaire': stagiaire.email}]
+        response = self.client.post('/stages/api/import/?dry_run=1', json.dumps(rows), content_type='application/json')
+        self.assertEqual((response.status_code, response.json()['created']), (200, 0))
+        self.assertFalse(Stage.objects.exists())
+
+        response = self.post_json('/stages/api/import/', rows + [{**rows[0], 'stagiaire': 'inconnu@test.bf'}])
+        self.assertEqual(response.json()['errors'][0]['errors'], {'stagiaire': ['Stagiaire introuvable : inconnu@test.bf']})
+        response = self.post_json('/stages/api/import/', rows)
+        self.assertEqual(response.status_code, 201)
+        stage = Stage.objects.get()
+        self.assertEqual((stage.stagiaire_id, stage.statut), (stagiaire.pk, 'Terminé'))
+        self.assertEqual(stats.summary()['total']['stages'], 1)
+
+    def test_invalid_format(self):
+        response = self.client.post('/stagiaires/api/import/', '{"nom": "A"}', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+            json.dump([{'nom': 'Traoré', 'prenom': 'Issa', 'institution': 'Externe', 'email': 'issa@test.bf'}], f)
+        path = f.name
+        self.addCleanup(os.unlink, path)
+        out = io.StringIO()
+        call_command('bulk_import', 'encadrants', path, stdout=out)
+        self.assertIn('1 ligne(s) importée(s)', out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('bulk_import', 'encadrants', path, stdout=io.StringIO(), stderr=io.StringIO())
+
+
+class TransitionTests(StagesTestCase):
+    def test_valider_and_archiver_by_batch(self):
+        stage = self.make_stage(debut=date.today())
+        en_attente, valide = self.make_rapport(stage), self.make_rapport(stage, etat='Validé')
+        response = self.post_json('/rapports/api/valider/', {'ids': [en_attente.pk, valide.pk, 999999]})
+        self.assertEqual(response.json(), {'updated': [en_attente.pk], 'rejected': [
+            {'id': valide.pk, 'error': 'Déjà validé.'}, {'id': 999999, 'error': 'Rapport introuvable.'},
+        ]})
+        stage.refresh_from_db()
+        self.assertEqual((stage.statut, stage.version), ('Validé', 2))
+
+        archive = self.make_rapport(stage, etat='Archivé')
+        response = self.post_json('/rapports/api/archiver/', {'ids': [en_attente.pk, archive.pk]})
+        self.assertEqual(response.json()['updated'], [en_attente.pk])
+        self.assertEqual([r['id'] for r in response.json()['rejected']], [archive.pk])
+        self.assertEqual(Rapport.objects.get(pk=en_attente.pk).etat, 'Archivé')
+        self.assertEqual(stats.summary()['total']['etat'], {'Validé': 1, 'Archivé': 2})
+
+    def test_single_transitions_under_lock(self):
+        rapport = self.make_rapport()
+        url = f'/rapports/api/{rapport.pk}/'
+        with CaptureQueriesContext(connections['default']) as queries:
+            self.assertEqual(self.client.post(url + 'valider/').status_code, 200)
+        if connections['default'].features.has_select_for_update:
+            self.assertIn('FOR UPDATE', queries[0]['sql'])
+        self.assertEqual(self.client.post(url + 'valider/').status_code, 400)
+        self.assertEqual(self.client.post(url + 'archiver/').status_code, 200)
+        self.assertEqual(self.client.post(url + 'archiver/').status_code, 400)
+        summary = stats.summary()
+        stats.rebuild()
+        self.assertEqual(stats.summary(), summary)
+
+    @override_settings(STAGES_BATCH_MAX_IDS=2)
+    def test_payload_checks(self):
+        self.assertEqual(self.post_json('/rapports/api/valider/', [1]).status_code, 400)
+        self.assertEqual(self.post_json('/rapports/api/valider/', {'ids': ['a']}).status_code, 400)
+        self.assertEqual(self.post_json('/rapports/api/valider/', {'ids': [1, 2, 3]}).status_code, 400)
+
+
+class AsyncViewsTests(StagesTestCase):
+    async def compare(self, view, url, params=None):
+        response = await view(AsyncRequestFactory().get(url, params or {}))
+        expected = await sync_to_async(self.client.get)(url, params or {})
+        self.assertEqual(json.loads(response.content), expected.json())
+        return response
+
+    async def test_lists_match_sync_views(self):
+        stage = await sync_to_async(self.make_stage)(encadrant=await sync_to_async(self.make_encadrant)())
+        await sync_to_async(self.make_rapport)(stage)
+        await self.compare(async_views.stages_api, '/stages/api/', {'ordering': '-date_debut', 'fields': 'id,statut'})
+        await self.compare(async_views.rapports_api, '/rapports/api/')
+        response = await async_views.stages_api(AsyncRequestFactory().get('/stages/api/', {'ordering': 'inconnu'}))
+        self.assertEqual(response.status_code, 400)
+
+    async def test_fichier_streams_in_event_loop(self):
+        rapport = await sync_to_async(self.make_rapport)(etat='Validé')
+        request = AsyncRequestFactory().get('/', headers={'Range': 'bytes=4-9'})
+        response = await async_views.rapport_fichier(request, rapport.pk)
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response.is_async)
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), PDF[4:10])
+
+        response = await async_views.rapport_fichier(AsyncRequestFactory().get('/'), rapport.pk)
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), PDF)
+
+    async def test_create(self):
+        stage = await sync_to_async(self.make_stage)()
+        request = AsyncRequestFactory().post('/rapports/api/create/', {
+            'stage': stage.pk, 'fichier': SimpleUploadedFile('depot.pdf', PDF, 'application/pdf'),
+        })
+        response = await async_views.rapport_create(request)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(await Rapport.objects.filter(stage=stage).acount(), 1)
+
+
+class BenchmarkTests(StagesTestCase):
+    def test_generate_data(self):
+        counts = synthetic.generate(stagiaires=30, encadrants=3, fichiers=2, taille=256, seed=1)
+        self.assertEqual((counts['stagiaire'], counts['encadrant'], counts['stage']), (30, 3, 30))
+        self.assertEqual(Rapport.objects.count(), counts['rapport'])
+        self.assertEqual(sum(FichierRapport.objects.values_list('nb_references', flat=True)), counts['rapport'])
+        summary = stats.summary()
+        stats.rebuild()
+        self.assertEqual(stats.summary(), summary)
+
+    def test_every_route_is_measured(self):
+        synthetic.generate(stagiaires=10, encadrants=2, fichiers=1, taille=256)
+        report = benchmark.run(iterations=1, warmup=0)
+        self.assertEqual(report['non_couvertes'], [])
+        failures = {key: result['status'] for key, result in report['resultats'].items()
+                    if max(result['status']) >= 500}
+        self.assertEqual(failures, {})
+
+        reference = json.loads(json.dumps(report))
+        key = next(iter(reference['resultats']))
+        reference['resultats'][key]['requetes_sql'] -= 1
+        self.assertEqual([r['scenario'] for r in benchmark.compare(report, reference)], [key])
+
+
+class ProfilingTests(StagesTestCase):
+    def test_disabled(self):
+        response = self.client.get('/stagiaires/api/')
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+    @override_settings(STAGES_PROFILING=True, STAGES_PROFILING_SAMPLE_RATE=1, STAGES_PROFILING_SLOW_MS=0,
+                       STAGES_PROFILING_DIR=os.path.join(MEDIA_ROOT, 'profiles'))
+    def test_server_timing_metrics_and_profiles(self):
+        self.make_stagiaire()
+        response = self.client.get('/stagiaires/api/')
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('desc="1 SQL"', response['Server-Timing'])
+        b''.join(self.client.get('/stagiaires/api/', {'stream': 1}).streaming_content)
+
+        metrics = self.client.get('/metrics').content.decode()
+        self.assertIn('stages_db_queries_bucket{view="stagiaires_api",le="1"}', metrics)
+        count = next(line for line in metrics.splitlines()
+                     if line.startswith('stages_request_duration_seconds_count{view="stagiaires_api"}'))
+        self.assertGreaterEqual(int(count.split()[-1]), 2)
+        self.assertTrue(any('_stagiaires_api_' in name for name in os.listdir(os.path.join(MEDIA_ROOT, 'profiles'))))
+
+
+@override_settings(STAGES_DB_REPLICAS=['replica'], STAGES_REPLICA_VIEWS=['stagiaires_api'], STAGES_REPLICA_LAG=2)
+class ReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        routers._lags.clear()
+        self.router = routers.ReplicaRouter()
+        self.middleware = routers.ReplicaMiddleware(self.view)
+        self.seen = []
+
+    def view(self, request):
+        self.middleware.process_view(request, None, (), {})
+        self.seen.append(self.router.db_for_read(Stagiaire))
+        if request.method == 'POST':
+            self.router.db_for_write(Stagiaire)
+            self.seen.append(self.router.db_for_read(Stagiaire))
+        return HttpResponse()
+
+    def call(self, method, url, lag=0, **cookies):
+        request = getattr(RequestFactory(), method)(url)
+        request.COOKIES.update(cookies)
+        request.resolver_match = resolve(url)
+        with mock.patch.object(routers, 'replica_lag', return_value=lag):
+            return self.middleware(request)
+
+    def test_listed_get_reads_replica(self):
+        response = self.call('get', '/stagiaires/api/')
+        self.assertEqual(self.seen, ['replica'])
+        self.assertNotIn(routers.PRIMARY_COOKIE, response.cookies)
+        # Hors requête : primaire
+        self.assertEqual(self.router.db_for_read(Stagiaire), 'default')
+
+    def test_primary_cases(self):
+        self.call('get', '/sync/')
+        self.call('get', '/stagiaires/api/', **{routers.PRIMARY_COOKIE: '1'})
+        self.call('get', '/stagiaires/api/', lag=10)
+        self.assertEqual(self.seen, ['default'] * 3)
+
+    def test_write_pins_to_primary(self):
+        response = self.call('post', '/stagiaires/api/')
+        self.assertEqual(self.seen, ['default', 'default'])
+        self.assertEqual(response.cookies[routers.PRIMARY_COOKIE]['max-age'], 2)
+
+    @override_settings(STAGES_DB_REPLICAS=[])
+    def test_removed_without_replicas(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            routers.ReplicaMiddleware(self.view)
+
+
+@skipUnless('replica' in settings.DATABASES, "réplica SQLite (STAGES_DB_SQLITE)")
+@override_settings(STAGES_DB_REPLICAS=['replica'], STAGES_REPLICA_LAG=2)
+class ReplicaDatabaseTests(StagesTestCase):
+    """Routage réel sur deux bases SQLite : le réplica n'a pas les mêmes lignes que le primaire."""
+    databases = {'default', 'replica'}
+
+    def noms(self):
+        return [row['nom'] for row in self.client.get('/stagiaires/api/').json()['results']]
+
+    def test_reads_replica_until_write(self):
+        self.make_stagiaire(nom='Primaire')
+        Stagiaire.objects.using('replica').bulk_create([Stagiaire(nom='Replica', prenom='R', email='r@test.bf')])
+        self.assertEqual(self.noms(), ['Replica'])
+        # Vue hors STAGES_REPLICA_VIEWS : primaire
+        self.assertEqual([row['nom'] for row in self.client.get('/sync/').json()['stagiaires']], ['Primaire'])
+
+        response = self.post_json('/stagiaires/api/create/', {
+            'nom': 'Nouveau', 'prenom': 'N', 'email': 'n@test.bf'})
+        self.assertEqual(response.status_code, 201)
+        self.assertIn(routers.PRIMARY_COOKIE, response.cookies)
+        # Client épinglé au primaire : il relit sa propre écriture
+        self.assertEqual(sorted(self.noms()), ['Nouveau', 'Primaire'])
+        self.assertFalse(Stagiaire.objects.using('replica').filter(nom='Nouveau').exists())
+
+        self.client.cookies.pop(routers.PRIMARY_COOKIE)
+        self.assertEqual(self.noms(), ['Replica'])
+
+
+class PoolMetricsTests(StagesTestCase):
+    def test_pool_stats_on_metrics(self):
+        pool = mock.Mock(closed=False)
+        pool.get_stats.return_value = {
+            'pool_min': 2, 'pool_max': 10, 'pool_size': 5, 'pool_available': 2,
+            'requests_waiting': 1, 'requests_num': 40, 'requests_wait_ms': 1500,
+        }
+        with mock.patch.object(connections['default'], 'pool', pool, create=True):
+            self.assertEqual(profiling.pool_stats()['default'], {
+                'min': 2, 'max': 10, 'size': 5, 'in_use': 3, 'available': 2, 'waiting': 1,
+                'requests': 40, 'wait_seconds': 1.5, 'timeouts': 0, 'connections_lost': 0,
+            })
+            # Servi même sans profilage
+            metrics = self.client.get('/metrics').content.decode().splitlines()
+        self.assertIn('stages_db_pool_in_use{alias="default"} 3', metrics)
+        self.assertIn('stages_db_pool_wait_seconds_total{alias="default"} 1.5', metrics)
+        self.assertIn('# TYPE stages_db_pool_requests_total counter', metrics)
+
+    def test_closed_pool_ignored(self):
+        with mock.patch.object(connections['default'], 'pool', mock.Mock(closed=True), create=True):
+            self.assertEqual(profiling.pool_stats(), {})
+
+
+class AutocompleteTests(StagesTestCase):
+    def complete(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return [result['text'] for result in response.json()['results']]
+
+    def test_prefix_without_accents_nor_case(self):
+        self.make_stagiaire()
+        self.make_stagiaire('Ouédraogo', 'Pélagie')
+        self.assertEqual(self.complete('/stagiaires/api/autocomplete/', q='dia ami'), ['Aminata Diallo'])
+        self.assertEqual(self.complete('/stagiaires/api/autocomplete/', q='OUED pel'), ['Pélagie Ouédraogo'])
+        self.assertEqual(self.complete('/stagiaires/api/autocomplete/', q='iallo'), [])
+        self.assertEqual(self.complete('/stagiaires/api/autocomplete/', q=''), [])
+        self.make_encadrant()
+        self.assertEqual(self.complete('/encadrants/api/autocomplete/', q='tra'), ['Issa Traoré'])
+
+    def test_stages_by_theme_or_stagiaire(self):
+        self.make_stage(theme='Réseaux')
+        self.make_stage(stagiaire=self.make_stagiaire('Sawadogo', 'Ali'), theme='Sécurité')
+        self.assertEqual(self.complete('/stages/api/autocomplete/', q='rese'), ['Réseaux (Aminata Diallo)'])
+        self.assertEqual(self.complete('/stages/api/autocomplete/', q='sawa'), ['Sécurité (Ali Sawadogo)'])
+
+    @override_settings(STAGES_AUTOCOMPLETE_LIMIT=2, STAGES_AUTOCOMPLETE_MAX_LIMIT=3)
+    def test_limit(self):
+        for i in range(5):
+            self.make_stagiaire(f'Diallo{i}')
+        self.assertEqual(len(self.complete('/stagiaires/api/autocomplete/', q='dia')), 2)
+        self.assertEqual(len(self.complete('/stagiaires/api/autocomplete/', q='dia', limit=1)), 1)
+        self.assertEqual(len(self.complete('/stagiaires/api/autocomplete/', q='dia', limit=100)), 3)
+
+    def test_widget_renders_selected_option_only(self):
+        stagiaire = self.make_stagiaire()
+        self.make_stagiaire('Ouédraogo', 'Pélagie')
+        html = str(StageForm(initial={'stagiaire': stagiaire.pk})['stagiaire'])
+        self.assertIn('data-autocomplete-url="/stagiaires/api/autocomplete/"', html)
+        self.assertIn('Aminata Diallo', html)
+        self.assertNotIn('Pélagie', html)
+
+
+class AdminTests(StagesTestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@test.bf', 'secret'))
+
+    def action(self, model, action, *objs):
+        return self.client.post(f'/admin/stages/{model}/', {
+            'action': action, '_selected_action': [obj.pk for obj in objs],
+        }, follow=True)
+
+    def test_changelists(self):
+        stage = self.make_stage(encadrant=self.make_encadrant(), theme='Réseaux')
+        self.make_rapport(stage)
+        for model in ('stagiaire', 'encadrant', 'stage', 'rapport'):
+            response = self.client.get(f'/admin/stages/{model}/')
+            self.assertEqual(response.status_code, 200, model)
+            self.assertEqual(response.context['cl'].result_count, 1)
+        response = self.client.get('/admin/stages/stage/', {'statut': 'Terminé', 'q': 'rése'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+    def test_autocomplete_by_prefix(self):
+        self.make_stagiaire()
+        self.make_stagiaire('Ouédraogo', 'Pélagie')
+        response = self.client.get('/admin/autocomplete/', {
+            'app_label': 'stages', 'model_name': 'stage', 'field_name': 'stagiaire', 'term': 'dia ami'})
+        self.assertEqual([r['text'] for r in response.json()['results']], ['Aminata Diallo'])
+
+    def test_actions_keep_stats(self):
+        stage = self.make_stage()
+        # Statut enregistré périmé, comme avant le passage de terminer_stages_echus
+        Stage.objects.filter(pk=stage.pk).update(statut='En cours')
+        stats.rebuild()
+        en_attente, valide = self.make_rapport(stage), self.make_rapport(stage, etat='Validé')
+
+        self.assertContains(self.action('stage', 'recalculer_statut', stage), '1 stage(s) mis à jour.')
+        stage.refresh_from_db()
+        self.assertEqual(stage.statut, 'Terminé')
+
+        response = self.action('rapport', 'valider', en_attente, valide)
+        self.assertContains(response, '1 rapport(s) validé(s).')
+        self.assertContains(response, '1 rapport(s) ignoré(s) : Déjà validé.')
+        self.assertContains(self.action('rapport', 'archiver', en_attente, valide), '2 rapport(s) archivé(s).')
+        stage.refresh_from_db()
+        self.assertEqual(stage.statut, 'Validé')
+
+        summary = stats.summary()
+        stats.rebuild()
+        self.assertEqual(stats.summary(), summary)
+
+    def test_exact_count_outside_postgresql(self):
+        for i in range(3):
+            self.make_stagiaire(f'Diallo{i}')
+        with override_settings(STAGES_ADMIN_EXACT_COUNT_LIMIT=1):
+            self.assertEqual(EstimatedCountPaginator(Stagiaire.objects.order_by('id'), 2).count, 3)
@@ -1,33 +1,58 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+# Sous ASGI (STAGES_ASYNC_VIEWS), lectures, dépôt et téléchargement passent
+# par les vues async de stages.async_views
+if getattr(settings, 'STAGES_ASYNC_VIEWS', False):
+    from . import async_views as api
+else:
+    api = views
+
 urlpatterns = [
     # Routes existantes pour stagiaires
     path('', views.home, name='home'),
     path('add_stagiaire/', views.add_stagiaire, name='add_stagiaire'),
-    path('stagiaires/api/', views.stagiaires_api, name='stagiaires_api'),
+    path('add_stage/', views.add_stage, name='add_stage'),
+    path('stagiaires/api/', api.stagiaires_api, name='stagiaires_api'),
+    path('stagiaires/api/autocomplete/', views.stagiaires_autocomplete, name='stagiaires_autocomplete'),
+    path('stagiaires/api/import/', views.bulk_import, {'resource': 'stagiaires'}, name='import_stagiaires'),
     path('stagiaires/api/create/', views.stagiaire_create, name='create_stagiaire'),
     path('stagiaires/api/<int:pk>/', views.stagiaire_detail, name='stagiaire_detail'),
 
     # Routes pour encadrants
-    path('encadrants/api/', views.encadrants_api, name='encadrants_api'),
+    path('encadrants/api/', api.encadrants_api, name='encadrants_api'),
+    path('encadrants/api/autocomplete/', views.encadrants_autocomplete, name='encadrants_autocomplete'),
+    path('encadrants/api/import/', views.bulk_import, {'resource': 'encadrants'}, name='import_encadrants'),
     path('encadrants/api/create/', views.add_encadrant, name='create_encadrant'),
     path('encadrants/api/<int:pk>/', views.encadrant_detail, name='encadrant_detail'),
 
  # Routes pour stages
 
-    path('stages/api/', views.stages_api, name='stages_api'),
+    path('stages/api/', api.stages_api, name='stages_api'),
+    path('stages/api/search/', views.stages_search, name='stages_search'),
+    path('stages/api/autocomplete/', views.stages_autocomplete, name='stages_autocomplete'),
+    path('stages/api/import/', views.bulk_import, {'resource': 'stages'}, name='import_stages'),
     path('stages/api/create/', views.stage_create, name='stage_create'),
     path('stages/api/<int:pk>/', views.stage_detail, name='stage_detail'),
 
  # Routes pour les rapports
    
 # Routes pour les rapports
-    path('rapports/api/', views.rapports_api, name='rapports_api'),
-    path('rapports/api/create/', views.rapport_create, name='rapport_create'),
+    path('rapports/api/', api.rapports_api, name='rapports_api'),
+    path('rapports/api/zip/', views.rapports_zip, name='rapports_zip'),
+    path('rapports/api/valider/', views.rapports_valider, name='rapports_valider'),
+    path('rapports/api/archiver/', views.rapports_archiver, name='rapports_archiver'),
+    path('rapports/api/create/', api.rapport_create, name='rapport_create'),
     path('rapports/api/<int:pk>/', views.rapport_detail, name='rapport_detail'), 
     path('rapports/api/<int:pk>/valider/', views.rapport_valider, name='rapport_valider'),
     path('rapports/api/<int:pk>/archiver/', views.rapport_archiver, name='rapport_archiver'),
-    path('rapports/api/<int:pk>/download/', views.rapport_download, name='rapport_download'),
+    path('rapports/api/<int:pk>/download/', api.rapport_download, name='rapport_download'),
+    path('rapports/api/<int:pk>/fichier/', api.rapport_fichier, name='rapport_fichier'),
+    path('rapports/api/fichiers/<str:sha256>/', views.fichier_rapport_detail, name='fichier_rapport_detail'),
+    path('sync/', views.sync, name='sync'),
+    path('stats/', views.stats_view, name='stats'),
+    path('batch/', views.batch_operations, name='batch_operations'),
+    path('events/', views.events_stream, name='events_stream'),
 
 ]
\ No newline at end of file
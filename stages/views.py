@@ -1,7 +1,26 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from .models import Stagiaire, Encadrant, Stage, Rapport
-from .forms import StagiaireForm, StageForm, EncadrantForm, RapportForm
-from django.http import JsonResponse, HttpResponse, Http404
+from django.urls import reverse
+from django.conf import settings
+from .models import Stagiaire, Encadrant, Stage, Rapport, FichierRapport, Statistique, VersionConflict
+from .forms import StagiaireForm, StageForm, EncadrantForm, RapportForm, DEPOT_REFUSE, refus_rapport
+from .pagination import paginated_response
+from .streaming import wants_stream, streaming_response
+from .search import search_rapports, search_stages, autocomplete_persons, autocomplete_stages
+from .downloads import serve_file, download_filename
+from .archives import iter_zip
+from .cache import cached_response
+from .imports import parse_rows, import_rows, ImportFormatError
+from .workflow import valider_rapports, archiver_rapports
+from . import sync as sync_feed
+from . import events
+from . import stats
+from .batch import run_batch, BatchError
+from .concurrency import check_preconditions, conflict_response, versioned, patch_instance
+from .fields import public_columns
+from .storage import get_rapport_storage, sha256_from_name
+from .filters import InvalidParameter, get_int, get_date, get_fields, get_ordering, sparse_values
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, HttpResponse, Http404, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.core.exceptions import ValidationError
@@ -10,10 +29,11 @@ from django.db.models import Q
 import json
 from datetime import datetime
 from django.db import models # Ajout de l'importation de models
+from django.db import IntegrityError, transaction
 
 # Page d'accueil
 def home(request):
-    stages = Stage.objects.all()
+    stages = Stage.objects.select_related('stagiaire', 'encadrant')
     return render(request, 'stages//home.html', {'stages': stages})
 
 # Ajouter un stagiaire
@@ -38,9 +58,35 @@ def add_stage(request):
         form = StageForm()
     return render(request, 'stages/add_stage.html', {'form': form})
 
+# Liste paginée, ou export complet en flux avec ?stream=1
+def list_response(request, queryset, ordering, serialize=None):
+    if wants_stream(request):
+        return streaming_response(request, queryset.order_by(*ordering), serialize)
+    return paginated_response(request, queryset, ordering, serialize)
+
+STAGIAIRE_FIELDS = ('id', 'nom', 'prenom', 'ecole', 'filiere', 'email', 'telephone')
+# Colonnes non nulles seulement : la pagination par clé ne sait pas comparer NULL
+STAGIAIRE_ORDERING = ('id', 'nom', 'prenom', 'email')
+
+# Requête de stagiaires_api (partagée avec la vue async) : (queryset, tri, sérialiseur).
+# Lève InvalidParameter pour un champ ou un tri inconnu.
+def stagiaires_query(request):
+    stagiaires = Stagiaire.objects.all()
+    for name in ('ecole', 'filiere'):
+        if request.GET.get(name):
+            stagiaires = stagiaires.filter(**{name: request.GET[name]})
+    fields = get_fields(request, STAGIAIRE_FIELDS)
+    ordering = get_ordering(request, STAGIAIRE_ORDERING, ['id'])
+    stagiaires, serialize = sparse_values(stagiaires, fields, ordering)
+    return stagiaires, ordering, serialize
+
+@cached_response(Stagiaire)
 def stagiaires_api(request):
-    stagiaires = list(Stagiaire.objects.values())
-    return JsonResponse(stagiaires, safe=False)
+    try:
+        stagiaires, ordering, serialize = stagiaires_query(request)
+    except InvalidParameter as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    return list_response(request, stagiaires, ordering, serialize)
 @csrf_exempt
 def stagiaire_create(request):
     if request.method == 'POST':
@@ -59,6 +105,35 @@ def stagiaire_create(request):
             }, status=201)
         return JsonResponse(form.errors, status=400)
     return JsonResponse({'error': 'Invalid request method'}, status=405)
+def stagiaire_to_dict(stagiaire):
+    return {
+        'id': stagiaire.id,
+        'nom': stagiaire.nom,
+        'prenom': stagiaire.prenom,
+        'email': stagiaire.email,
+        'ecole': stagiaire.ecole,
+        'filiere': stagiaire.filiere,
+        'telephone': stagiaire.telephone,
+        'version': stagiaire.version,
+    }
+
+# PATCH commun aux fiches versionnées : seuls les champs modifiés sont écrits,
+# et l'écriture échoue (409, ou 412 avec If-Match) si la ligne a changé entre-temps
+def patch_response(request, instance, form_class, to_dict, extra_fields=()):
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'error': 'Payload JSON invalide'}, status=400)
+    if not isinstance(data, dict):
+        return JsonResponse({'error': 'Un objet JSON est attendu'}, status=400)
+    try:
+        changed, errors = patch_instance(instance, form_class, data, extra_fields)
+    except VersionConflict:
+        return conflict_response(request)
+    if errors:
+        return JsonResponse(errors, status=400)
+    return versioned(JsonResponse(to_dict(instance)), instance)
+
 @csrf_exempt
 def stagiaire_detail(request, pk):
     try:
@@ -66,17 +141,16 @@ def stagiaire_detail(request, pk):
     except Stagiaire.DoesNotExist:
         return JsonResponse({'error': 'Stagiaire not found'}, status=404)
 
+    # If-None-Match -> 304, If-Match périmé -> 412
+    precondition = check_preconditions(request, stagiaire)
+    if precondition:
+        return precondition
+
     if request.method == 'GET':
-        data = {
-            'id': stagiaire.id,
-            'nom': stagiaire.nom,
-            'prenom': stagiaire.prenom,
-            'email': stagiaire.email,
-            'ecole': stagiaire.ecole,
-            'filiere': stagiaire.filiere,
-            'telephone': stagiaire.telephone,
-        }
-        return JsonResponse(data)
+        return versioned(JsonResponse(stagiaire_to_dict(stagiaire)), stagiaire)
+
+    elif request.method == 'PATCH':
+        return patch_response(request, stagiaire, StagiaireForm, stagiaire_to_dict)
 
     elif request.method == 'PUT':
         data = json.loads(request.body)
@@ -86,16 +160,11 @@ def stagiaire_detail(request, pk):
         stagiaire.ecole = data.get('ecole', stagiaire.ecole)
         stagiaire.filiere = data.get('filiere', stagiaire.filiere)
         stagiaire.telephone = data.get('telephone', stagiaire.telephone)
-        stagiaire.save()
-        return JsonResponse({
-            'id': stagiaire.id,
-            'nom': stagiaire.nom,
-            'prenom': stagiaire.prenom,
-            'email': stagiaire.email,
-            'ecole': stagiaire.ecole,
-            'filiere': stagiaire.filiere,
-            'telephone': stagiaire.telephone,
-        })
+        try:
+            stagiaire.save()
+        except VersionConflict:
+            return conflict_response(request)
+        return versioned(JsonResponse(stagiaire_to_dict(stagiaire)), stagiaire)
         
     elif request.method == 'DELETE':
         stagiaire.delete()
@@ -103,9 +172,21 @@ def stagiaire_detail(request, pk):
 
     return JsonResponse({'error': 'Invalid request method'}, status=405)
 
+ENCADRANT_FIELDS = ('id', 'nom', 'prenom', 'institution', 'email', 'telephone')
+
+# Requête de encadrants_api (partagée avec la vue async), comme stagiaires_query
+def encadrants_query(request):
+    fields = get_fields(request, ENCADRANT_FIELDS)
+    encadrants, serialize = sparse_values(Encadrant.objects.all(), fields, ['id'])
+    return encadrants, ['id'], serialize
+
+@cached_response(Encadrant)
 def encadrants_api(request):
-    encadrants = list(Encadrant.objects.values())
-    return JsonResponse(encadrants, safe=False)
+    try:
+        encadrants, ordering, serialize = encadrants_query(request)
+    except InvalidParameter as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    return list_response(request, encadrants, ordering, serialize)
 
 @csrf_exempt
 def add_encadrant(request):
@@ -124,6 +205,17 @@ def add_encadrant(request):
             })
         return JsonResponse(form.errors, status=400)
 
+def encadrant_to_dict(encadrant):
+    return {
+        'id': encadrant.id,
+        'nom': encadrant.nom,
+        'prenom': encadrant.prenom,
+        'institution': encadrant.institution,
+        'email': encadrant.email,
+        'telephone': encadrant.telephone,
+        'version': encadrant.version,
+    }
+
 @csrf_exempt
 def encadrant_detail(request, pk):
     try:
@@ -131,15 +223,15 @@ def encadrant_detail(request, pk):
     except Encadrant.DoesNotExist:
         return JsonResponse({'error': 'Encadrant not found'}, status=404)
 
+    precondition = check_preconditions(request, encadrant)
+    if precondition:
+        return precondition
+
     if request.method == 'GET':
-        return JsonResponse({
-            'id': encadrant.id,
-            'nom': encadrant.nom,
-            'prenom': encadrant.prenom,
-            'institution': encadrant.institution,
-            'email': encadrant.email,
-            'telephone': encadrant.telephone,
-        })
+        return versioned(JsonResponse(encadrant_to_dict(encadrant)), encadrant)
+
+    elif request.method == 'PATCH':
+        return patch_response(request, encadrant, EncadrantForm, encadrant_to_dict)
 
     elif request.method == 'PUT':
         data = json.loads(request.body)
@@ -148,15 +240,11 @@ def encadrant_detail(request, pk):
         encadrant.institution = data.get('institution', encadrant.institution)
         encadrant.email = data.get('email', encadrant.email)
         encadrant.telephone = data.get('telephone', encadrant.telephone)
-        encadrant.save()
-        return JsonResponse({
-            'id': encadrant.id,
-            'nom': encadrant.nom,
-            'prenom': encadrant.prenom,
-            'institution': encadrant.institution,
-            'email': encadrant.email,
-            'telephone': encadrant.telephone,
-        })
+        try:
+            encadrant.save()
+        except VersionConflict:
+            return conflict_response(request)
+        return versioned(JsonResponse(encadrant_to_dict(encadrant)), encadrant)
 
     elif request.method == 'DELETE':
         encadrant.delete()
@@ -164,14 +252,119 @@ def encadrant_detail(request, pk):
 
     return JsonResponse({'error': 'Invalid request method'}, status=405)
 
+STAGE_FIELDS = (
+    'id','theme','type_stage','date_debut','date_fin','statut',
+    'stagiaire_id','encadrant_id',
+    'stagiaire__nom','stagiaire__prenom',
+    'encadrant__nom','encadrant__prenom'
+)
+
+STAGE_ORDERING = (
+    'id', 'theme', 'type_stage', 'date_debut', 'date_fin',
+    'stagiaire__nom', 'stagiaire__prenom',
+)
+
+# Filtres communs à stages_api et stages_search :
+# statut (effectif), type_stage, encadrant, stagiaire, ecole, filiere,
+# et du/au pour les stages dont la période chevauche [du, au]
+def filter_stages(request, qs):
+    statut = request.GET.get('statut')
+    type_stage = request.GET.get('type_stage')
+    encadrant = get_int(request, 'encadrant')
+    stagiaire = get_int(request, 'stagiaire')
+    du = get_date(request, 'du')
+    au = get_date(request, 'au')
+
+    if statut:
+        qs = qs.filter_statut(statut)
+    if type_stage:
+        qs = qs.filter(type_stage=type_stage)
+    if encadrant is not None:
+        qs = qs.filter(encadrant_id=encadrant)
+    if stagiaire is not None:
+        qs = qs.filter(stagiaire_id=stagiaire)
+    for name in ('ecole', 'filiere'):
+        if request.GET.get(name):
+            qs = qs.filter(**{f'stagiaire__{name}': request.GET[name]})
+    if du:
+        qs = qs.filter(date_fin__gte=du)
+    if au:
+        qs = qs.filter(date_debut__lte=au)
+    return qs
+
+# ?fields= réduit le SELECT (et les jointures) aux colonnes demandées.
+# Le statut renvoyé est le statut effectif calculé en SQL (with_statut_effectif),
+# juste même si update_statuts n'est pas encore passé sur les stages échus
+def stage_values(qs, fields, ordering, keep=()):
+    extra = ()
+    if 'statut' in fields:
+        qs = qs.with_statut_effectif()
+        extra = ('statut_effectif',)
+    qs, serialize = sparse_values(qs, fields, ordering, keep, extra)
+
+    def stage_row(row):
+        if extra:
+            row['statut'] = row['statut_effectif']
+        return serialize(row)
+    return qs, stage_row
+
+# Requête de stages_api (partagée avec la vue async), comme stagiaires_query
+def stages_query(request):
+    fields = get_fields(request, STAGE_FIELDS)
+    ordering = get_ordering(request, STAGE_ORDERING, ['id'])
+    stages, serialize = stage_values(filter_stages(request, Stage.objects.all()), fields, ordering)
+    return stages, ordering, serialize
+
+@cached_response(Stage, Stagiaire, Encadrant)
 def stages_api(request):
-    stages = list(Stage.objects.select_related('stagiaire','encadrant').values(
-        'id','theme','type_stage','date_debut','date_fin','statut',
-        'stagiaire_id','encadrant_id',
-        'stagiaire__nom','stagiaire__prenom',
-        'encadrant__nom','encadrant__prenom'
-    ))
-    return JsonResponse(stages, safe=False)
+    try:
+        stages, ordering, serialize = stages_query(request)
+    except InvalidParameter as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    return list_response(request, stages, ordering, serialize)
+
+# Recherche de stages (plein texte + trigrammes sous PostgreSQL), classée par pertinence
+@require_http_methods(["GET"])
+@cached_response(Stage, Stagiaire, Encadrant)
+def stages_search(request):
+    q = request.GET.get('q', '').strip()
+    if not q:
+        return JsonResponse({"error": "Paramètre q requis."}, status=400)
+    try:
+        fields = get_fields(request, STAGE_FIELDS)
+    except InvalidParameter as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    stages, ordering = search_stages(filter_stages(request, Stage.objects.all()), q)
+    if ordering:
+        stages, serialize = stage_values(stages, fields, ordering, keep=('rank',))
+        return list_response(request, stages, ordering, serialize)
+    stages, serialize = stage_values(stages, fields, ['id'])
+    return list_response(request, stages, ['id'], serialize)
+
+# Autocomplétion des champs stagiaire, encadrant et stage des formulaires
+# (?q=, ?limit=) : les premiers résultats seulement, au format
+# {"results": [{"id": ..., "text": ...}]}
+def autocomplete_response(request, search, queryset):
+    default = getattr(settings, 'STAGES_AUTOCOMPLETE_LIMIT', 10)
+    limit = max(1, min(get_int(request, 'limit') or default, getattr(settings, 'STAGES_AUTOCOMPLETE_MAX_LIMIT', 50)))
+    results = search(queryset, request.GET.get('q', ''))[:limit]
+    return JsonResponse({'results': [{'id': obj.pk, 'text': str(obj)} for obj in results]})
+
+@require_http_methods(["GET"])
+@cached_response(Stagiaire)
+def stagiaires_autocomplete(request):
+    return autocomplete_response(request, autocomplete_persons, Stagiaire.objects.only('id', 'nom', 'prenom'))
+
+@require_http_methods(["GET"])
+@cached_response(Encadrant)
+def encadrants_autocomplete(request):
+    return autocomplete_response(request, autocomplete_persons, Encadrant.objects.only('id', 'nom', 'prenom'))
+
+@require_http_methods(["GET"])
+@cached_response(Stage, Stagiaire)
+def stages_autocomplete(request):
+    stages = Stage.objects.select_related('stagiaire').only('id', 'theme', 'stagiaire__nom', 'stagiaire__prenom')
+    return autocomplete_response(request, autocomplete_stages, stages)
 
 @csrf_exempt
 def stage_create(request):
@@ -192,13 +385,30 @@ def stage_create(request):
             'statut': stage.statut
         })
 
+def stage_to_dict(stage):
+    return {
+        'id': stage.id,
+        'theme': stage.theme,
+        'type_stage': stage.type_stage,
+        'date_debut': stage.date_debut,
+        'date_fin': stage.date_fin,
+        'statut': stage.get_statut_effectif(),
+        'stagiaire_id': stage.stagiaire_id,
+        'encadrant_id': stage.encadrant_id,
+        'version': stage.version,
+    }
+
 @csrf_exempt
 def stage_detail(request, pk):
     try:
-        stage = Stage.objects.get(pk=pk)
+        stage = Stage.objects.defer('search_vector').get(pk=pk)
     except Stage.DoesNotExist:
         return JsonResponse({'error': 'Stage not found'}, status=404)
 
+    precondition = check_preconditions(request, stage)
+    if precondition:
+        return precondition
+
     if request.method == 'PUT':
         data = json.loads(request.body)
         stage.theme = data.get('theme', stage.theme)
@@ -207,53 +417,57 @@ def stage_detail(request, pk):
         stage.date_fin = data.get('date_fin', stage.date_fin)
         if 'stagiaire' in data: stage.stagiaire_id = data['stagiaire']
         if 'encadrant' in data: stage.encadrant_id = data['encadrant']
-        stage.save()
-        return JsonResponse({'message': 'Stage updated', 'statut': stage.statut})
+        try:
+            stage.save()
+        except VersionConflict:
+            return conflict_response(request)
+        return versioned(JsonResponse({'message': 'Stage updated', 'statut': stage.statut, 'version': stage.version}), stage)
+
+    elif request.method == 'PATCH':
+        # statut est recalculé par Stage.save() (date_fin a pu changer)
+        return patch_response(request, stage, StageForm, stage_to_dict, extra_fields=['statut'])
 
     elif request.method == 'DELETE':
         stage.delete()
         return JsonResponse({'message': 'Stage deleted'}, status=204)
 
     elif request.method == 'GET':
-        return JsonResponse({
-            'id': stage.id,
-            'theme': stage.theme,
-            'type_stage': stage.type_stage,
-            'date_debut': stage.date_debut,
-            'date_fin': stage.date_fin,
-            'statut': stage.statut,
-            'stagiaire_id': stage.stagiaire_id,
-            'encadrant_id': stage.encadrant_id
-        })
+        return versioned(JsonResponse(stage_to_dict(stage)), stage)
 
     return JsonResponse({'error': 'Invalid request method'}, status=405)
 
+# Rapport avec son stage et son stagiaire en une seule requête (voir rapport_to_dict)
+# Texte extrait et vecteurs de recherche ne sont jamais renvoyés : on ne les lit pas
+RAPPORTS = Rapport.objects.select_related('stage__stagiaire').defer(
+    'contenu', 'search_vector', 'stage__search_vector',
+)
+
 def rapport_to_dict(rapport):
     return {
         "id": rapport.id,
         "stage": {
             "id": rapport.stage.id,
             "theme": rapport.stage.theme,
-            "statut": rapport.stage.statut,
+            "statut": rapport.stage.get_statut_effectif(),
             "stagiaire": {
                 "id": rapport.stage.stagiaire.id,
                 "nom": rapport.stage.stagiaire.nom,
                 "prenom": rapport.stage.stagiaire.prenom,
             },
-            "encadrant_id": rapport.stage.encadrant.id if rapport.stage.encadrant else None,
+            "encadrant_id": rapport.stage.encadrant_id,
         },
         "etat": rapport.etat,
         "date_depot": rapport.date_depot.isoformat(),
         "derniere_modif": rapport.derniere_modif.isoformat() if rapport.derniere_modif else None,
         "fichier_url": rapport.fichier.url if rapport.fichier else None,
+        "sha256": rapport.sha256,
     }
 
-@require_http_methods(["GET"])
-def rapports_api(request):
-    qs = Rapport.objects.select_related('stage__stagiaire', 'stage__encadrant').all().order_by('-date_depot')
-
+# Filtres communs à rapports_api et rapports_zip : etat, annee, filiere, q
+def filter_rapports(request, qs):
     etat = request.GET.get('etat')
     annee = request.GET.get('annee')
+    filiere = request.GET.get('filiere')
     q = request.GET.get('q')
 
     if etat:
@@ -266,17 +480,40 @@ def rapports_api(request):
         except ValueError:
             pass
 
+    if filiere:
+        qs = qs.filter(stage__stagiaire__filiere=filiere)
+
+    # Tri (-date_depot, id) couvert par l'index rapport_depot_id_idx,
+    # ou par pertinence en cas de recherche plein texte
+    ordering = None
     if q:
-        qs = qs.filter(Q(stage__theme__icontains=q) |
-                       Q(stage__stagiaire__nom__icontains=q) |
-                       Q(stage__stagiaire__prenom__icontains=q)).distinct()
+        qs, ordering = search_rapports(qs, q)
+    return qs, ordering or ['-date_depot', 'id']
+
+@require_http_methods(["GET"])
+@cached_response(Rapport, Stage, Stagiaire)
+def rapports_api(request):
+    qs, ordering = filter_rapports(request, RAPPORTS.all())
+    return list_response(request, qs, ordering, serialize=rapport_to_dict)
 
-    rapports = [rapport_to_dict(r) for r in qs]
-    return JsonResponse(rapports, safe=False)
+# Archive ZIP des rapports Validés/Archivés, générée au fil de l'eau
+@require_http_methods(["GET"])
+def rapports_zip(request):
+    qs, ordering = filter_rapports(request, RAPPORTS.filter(etat__in=['Validé', 'Archivé']).exclude(fichier=''))
+    rapports = qs.order_by(*ordering).iterator(chunk_size=500)
+    response = StreamingHttpResponse(iter_zip(rapports), content_type='application/zip')
+    annee = request.GET.get('annee')
+    response['Content-Disposition'] = f'attachment; filename="rapports{"_" + annee if annee and annee.isdigit() else ""}.zip"'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 @csrf_exempt
 @require_http_methods(["POST"])
 def rapport_create(request):
+    return deposer_rapport(request)
+
+# Dépôt d'un rapport, partagé avec la vue async (stages.async_views)
+def deposer_rapport(request):
     post = request.POST
     files = request.FILES
 
@@ -285,8 +522,8 @@ def rapport_create(request):
         return JsonResponse({"errors": form.errors}, status=400)
 
     stage = form.cleaned_data['stage']
-    if stage.statut not in ['Terminé', 'Validé']:
-        return JsonResponse({"error": "Impossible de déposer un rapport : le stage doit être Terminé ou Validé."}, status=400)
+    if not stage.accepte_rapport():
+        return JsonResponse({"error": DEPOT_REFUSE}, status=400)
 
     rapport = form.save(commit=False)
     rapport.date_depot = timezone.now()
@@ -295,8 +532,9 @@ def rapport_create(request):
     return JsonResponse(rapport_to_dict(rapport), status=201)
 
 @csrf_exempt
+@cached_response(Rapport, Stage, Stagiaire)
 def rapport_detail(request, pk):
-    rapport = get_object_or_404(Rapport, pk=pk)
+    rapport = get_object_or_404(RAPPORTS, pk=pk)
     if request.method == "GET":
         return JsonResponse(rapport_to_dict(rapport))
     elif request.method == "PUT":
@@ -304,8 +542,9 @@ def rapport_detail(request, pk):
             form = RapportForm(request.POST, request.FILES, instance=rapport)
             if not form.is_valid():
                 return JsonResponse({"errors": form.errors}, status=400)
-            if rapport.etat != 'En attente':
-                return JsonResponse({"error": "Impossible de modifier : rapport déjà validé ou archivé."}, status=400)
+            refus = refus_rapport(rapport, 'update')
+            if refus:
+                return JsonResponse({"error": refus}, status=400)
             rapport = form.save(commit=False)
             rapport.derniere_modif = timezone.now()
             rapport.save()
@@ -317,43 +556,240 @@ def rapport_detail(request, pk):
                 return JsonResponse({"error": "Payload JSON invalide"}, status=400)
             return JsonResponse({"error": "Aucune donnée à mettre à jour"}, status=400)
     elif request.method == "DELETE":
-        if rapport.etat != 'En attente':
-            return JsonResponse({"error": "Impossible de supprimer : seul un rapport en attente peut être supprimé."}, status=400)
+        refus = refus_rapport(rapport, 'delete')
+        if refus:
+            return JsonResponse({"error": refus}, status=400)
         rapport.delete()
         return JsonResponse({"deleted": True})
     else:
         return JsonResponse({"error": "Méthode non autorisée"}, status=405)
 
+# Transitions unitaires : rapport et stage relus sous verrou, comme dans
+# workflow._transition ; deux validations simultanées du même rapport
+# compteraient sinon deux fois la transition dans /stats/
+RAPPORTS_VERROUILLES = RAPPORTS.select_for_update(of=('self', 'stage'))
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def rapport_valider(request, pk):
-    rapport = get_object_or_404(Rapport, pk=pk)
-    if rapport.etat == 'Validé':
-        return JsonResponse({"error": "Déjà validé."}, status=400)
-    rapport.etat = 'Validé'
-    rapport.save()
-    stage = rapport.stage
-    if stage.statut != 'Validé':
-        stage.statut = 'Validé'
-        stage.save()
+    # Rapport et stage : une seule écriture des compteurs de /stats/
+    with transaction.atomic(), stats.batch():
+        rapport = get_object_or_404(RAPPORTS_VERROUILLES, pk=pk)
+        if rapport.etat == 'Validé':
+            return JsonResponse({"error": "Déjà validé."}, status=400)
+        rapport.etat = 'Validé'
+        rapport.save(update_fields=['etat', 'derniere_modif'])
+        stage = rapport.stage
+        if stage.statut != 'Validé':
+            stage.statut = 'Validé'
+            stage.save(update_fields=['statut', 'updated_at'])
     return JsonResponse(rapport_to_dict(rapport))
 
 @csrf_exempt
 @require_http_methods(["POST"])
 def rapport_archiver(request, pk):
-    rapport = get_object_or_404(Rapport, pk=pk)
-    if rapport.etat != 'Validé':
-        return JsonResponse({"error": "Un rapport ne peut être archivé que s'il est Validé."}, status=400)
-    rapport.etat = 'Archivé'
-    rapport.save()
+    with transaction.atomic():
+        rapport = get_object_or_404(RAPPORTS_VERROUILLES, pk=pk)
+        if rapport.etat != 'Validé':
+            return JsonResponse({"error": "Un rapport ne peut être archivé que s'il est Validé."}, status=400)
+        rapport.etat = 'Archivé'
+        rapport.save(update_fields=['etat', 'derniere_modif'])
     return JsonResponse(rapport_to_dict(rapport))
 
-@require_http_methods(["GET"])
-def rapport_download(request, pk):
-    rapport = get_object_or_404(Rapport, pk=pk)
+def batch_transition(request, transition):
+    # Corps attendu : {"ids": [1, 2, ...]}
+    try:
+        ids = json.loads(request.body)['ids']
+        ids = [int(pk) for pk in ids]
+    except (ValueError, TypeError, KeyError):
+        return JsonResponse({"error": "Payload attendu : {\"ids\": [...]}"}, status=400)
+    max_ids = getattr(settings, 'STAGES_BATCH_MAX_IDS', 5000)
+    if len(ids) > max_ids:
+        return JsonResponse({"error": f"{max_ids} rapports au maximum par lot."}, status=400)
+    updated, rejected = transition(ids)
+    return JsonResponse({
+        "updated": updated,
+        "rejected": [{"id": pk, "error": error} for pk, error in rejected.items()],
+    })
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def rapports_valider(request):
+    return batch_transition(request, valider_rapports)
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def rapports_archiver(request):
+    return batch_transition(request, archiver_rapports)
+
+RAPPORTS_TELECHARGEABLES = Rapport.objects.only('id', 'etat', 'fichier')
+
+def check_telechargeable(rapport):
+    # Renvoie la réponse d'erreur, ou None si le fichier peut être servi
     if rapport.etat not in ['Validé', 'Archivé']:
         return JsonResponse({"error": "Téléchargement autorisé uniquement pour les rapports Validés ou Archivés."}, status=403)
-    f = rapport.fichier
-    if not f:
+    if not rapport.fichier or not rapport.fichier.storage.exists(rapport.fichier.name):
         return JsonResponse({"error": "Fichier non trouvé."}, status=404)
-    return JsonResponse({"download_url": f.url})
\ No newline at end of file
+    return None
+
+def get_rapport_telechargeable(pk):
+    # Renvoie (rapport, None) ou (None, réponse d'erreur)
+    rapport = get_object_or_404(RAPPORTS_TELECHARGEABLES, pk=pk)
+    error = check_telechargeable(rapport)
+    if error:
+        return None, error
+    return rapport, None
+
+@require_http_methods(["GET"])
+def rapport_download(request, pk):
+    rapport, error = get_rapport_telechargeable(pk)
+    if error:
+        return error
+    return JsonResponse({"download_url": reverse('rapport_fichier', args=[rapport.pk])})
+
+# Contenu du fichier : Range, ETag/304, ou X-Accel-Redirect/X-Sendfile
+@require_http_methods(["GET", "HEAD"])
+def rapport_fichier(request, pk):
+    rapport, error = get_rapport_telechargeable(pk)
+    if error:
+        return error
+    return serve_file(request, rapport.fichier, download_filename(rapport))
+
+# Fichier déjà stocké ? Le client peut alors déposer avec sha256 au lieu du fichier
+@require_http_methods(["GET", "HEAD"])
+def fichier_rapport_detail(request, sha256):
+    blob = FichierRapport.objects.filter(sha256=sha256.lower()).first()
+    if blob is None:
+        return JsonResponse({"error": "Fichier inconnu."}, status=404)
+    return JsonResponse({"sha256": blob.sha256, "taille": blob.taille})
+
+# Import en masse (CSV ou tableau JSON) de stagiaires, encadrants ou stages.
+# Corps brut (Content-Type text/csv ou application/json) ou fichier multipart,
+# de STAGES_IMPORT_MAX_BYTES au plus (413 au-delà).
+@csrf_exempt
+@require_http_methods(["POST"])
+def bulk_import(request, resource):
+    max_bytes = getattr(settings, 'STAGES_IMPORT_MAX_BYTES', 20 * 1024 * 1024)
+    too_large = JsonResponse({"error": f"Import limité à {max_bytes} octets."}, status=413)
+    try:
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        length = 0
+    if length > max_bytes:
+        return too_large
+    if 'fichier' in request.FILES:
+        upload = request.FILES['fichier']
+        if upload.size > max_bytes:
+            return too_large
+        content = upload.read()
+        fmt = 'json' if upload.name.lower().endswith('.json') else 'csv'
+    else:
+        # read() plutôt que body : DATA_UPLOAD_MAX_MEMORY_SIZE est remplacée
+        # par STAGES_IMPORT_MAX_BYTES, vérifiée aussi à la lecture (ASGI :
+        # corps transmis par morceaux, sans Content-Length)
+        content = request.read(max_bytes + 1)
+        if len(content) > max_bytes:
+            return too_large
+        fmt = 'json' if request.content_type == 'application/json' else 'csv'
+    try:
+        rows = parse_rows(content, fmt)
+    except (ImportFormatError, UnicodeDecodeError) as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+
+    dry_run = request.GET.get('dry_run') in ('1', 'true')
+    try:
+        result = import_rows(resource, rows, dry_run=dry_run)
+    except IntegrityError:
+        return JsonResponse({"error": "Conflit avec des données enregistrées entre-temps, réessayez."}, status=409)
+    status = 400 if result['errors'] else (200 if dry_run else 201)
+    return JsonResponse(result, status=status)
+
+# Synchronisation incrémentale : lignes modifiées et ids supprimés depuis le
+# jeton ?since= renvoyé par l'appel précédent, ou l'état initial sans jeton.
+# Les réponses sont paginées : suivre ?cursor= (champ next) jusqu'à next nul,
+# puis repartir de ?since= avec le jeton reçu. Chaque ligne ne porte que ses
+# propres colonnes et les ids des lignes liées (pas de nom de stagiaire dans
+# un stage ou un rapport) : modifier un stagiaire ne renvoie que lui. Le
+# statut des stages est celui enregistré, mis à jour (et donc renvoyé) par
+# update_statuts.
+SYNC_STAGE_FIELDS = (
+    'id', 'theme', 'type_stage', 'date_debut', 'date_fin', 'statut',
+    'stagiaire_id', 'encadrant_id', 'updated_at',
+)
+SYNC_RAPPORT_FIELDS = ('id', 'stage_id', 'etat', 'date_depot', 'derniere_modif', 'fichier')
+
+def rapport_sync_row(row):
+    fichier = row.pop('fichier')
+    row['fichier_url'] = get_rapport_storage().url(fichier) if fichier else None
+    row['sha256'] = sha256_from_name(fichier)
+    return row
+
+@require_http_methods(["GET"])
+def sync(request):
+    sources = {
+        'stagiaires': (Stagiaire.objects.values(*public_columns(Stagiaire)), dict),
+        'encadrants': (Encadrant.objects.values(*public_columns(Encadrant)), dict),
+        'stages': (Stage.objects.values(*SYNC_STAGE_FIELDS), dict),
+        'rapports': (Rapport.objects.values(*SYNC_RAPPORT_FIELDS), rapport_sync_row),
+    }
+    try:
+        token, rows, deleted, next_cursor = sync_feed.page(
+            sources, request.GET.get('cursor'), request.GET.get('since') or None)
+    except sync_feed.ExpiredToken:
+        return JsonResponse({"error": "Jeton expiré : recharger toutes les données."}, status=410)
+    except sync_feed.InvalidToken:
+        return JsonResponse({"error": "Jeton invalide."}, status=400)
+    return JsonResponse({"token": token, **rows, "deleted": deleted, "next": next_cursor})
+
+# Tableau de bord : compteurs par année (stages.stats), ?annee_min= / ?annee_max=
+@require_http_methods(["GET"])
+# (Statistique : invalidé par rebuild_stats)
+@cached_response(Statistique, Stage, Rapport, Stagiaire)
+def stats_view(request):
+    return JsonResponse(stats.summary(get_int(request, 'annee_min'), get_int(request, 'annee_max')))
+
+# Flux Server-Sent Events des changements de rapports et de stages.
+# ?encadrant=<id> (répétable) ne transmet que les événements de ces encadrants.
+# ASGI seulement (gestion_stages.asgi) : chaque client garde la connexion
+# ouverte. En WSGI, Django lirait le flux sans fin en mémoire et bloquerait
+# le worker : la vue répond 501.
+@require_http_methods(["GET"])
+async def events_stream(request):
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({"error": "Flux d'événements disponible uniquement en ASGI."}, status=501)
+    try:
+        encadrant_ids = [int(value) for value in request.GET.getlist('encadrant')]
+    except ValueError:
+        return JsonResponse({"error": "Paramètre encadrant invalide."}, status=400)
+    subscription = events.get_broker().subscribe(encadrant_ids)
+    response = StreamingHttpResponse(events.sse_stream(subscription), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+# Lot d'opérations create/update/delete sur les quatre ressources, dans une
+# seule transaction (voir stages.batch.run_batch). Corps JSON {"operations": [...]},
+# ou multipart avec un champ "operations" et les fichiers des rapports.
+@csrf_exempt
+@require_http_methods(["POST"])
+def batch_operations(request):
+    try:
+        if request.content_type == 'multipart/form-data':
+            operations = json.loads(request.POST.get('operations', ''))
+        else:
+            operations = json.loads(request.body)
+            if isinstance(operations, dict):
+                operations = operations.get('operations')
+    except ValueError:
+        return JsonResponse({"error": "JSON invalide."}, status=400)
+
+    try:
+        results = run_batch(operations, request.FILES)
+    except BatchError as exc:
+        return JsonResponse({"index": exc.index, "errors": exc.errors}, status=exc.status)
+    except VersionConflict:
+        # Ligne modifiée par une autre requête pendant le lot : rien n'est écrit
+        return conflict_response(request)
+    except IntegrityError as exc:
+        return JsonResponse({"error": f"Conflit lors de l'écriture : {exc}"}, status=409)
+    return JsonResponse({"results": results})
@@ -0,0 +1,168 @@
+from collections import Counter
+from datetime import date
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Stage, Rapport
+from . import cache, events, stats
+
+
+def _transition(ids, allowed, cible, error):
+    """
+    Fait passer en un lot les rapports `ids` à l'état `cible`. Les lignes
+    sont verrouillées (select_for_update), les règles vérifiées en mémoire
+    puis appliquées par un seul UPDATE. Renvoie (ids modifiés, rejets,
+    encadrants) où rejets associe un id à son message d'erreur et
+    encadrants associe l'id de chaque stage concerné à son encadrant.
+    """
+    ids = list(dict.fromkeys(ids))
+    with transaction.atomic():
+        rows = {
+            pk: (etat, stage_id, date_depot)
+            for pk, etat, stage_id, date_depot in Rapport.objects.select_for_update()
+            .filter(pk__in=ids).values_list('id', 'etat', 'stage_id', 'date_depot')
+        }
+        updated, rejected = [], {}
+        for pk in ids:
+            if pk not in rows:
+                rejected[pk] = "Rapport introuvable."
+            elif not allowed(rows[pk][0]):
+                rejected[pk] = error
+            else:
+                updated.append(pk)
+
+        encadrants = {}
+        if updated:
+            Rapport.objects.filter(pk__in=updated).update(etat=cible, derniere_modif=timezone.now())
+            transaction.on_commit(lambda: cache.bump_version(Rapport))
+            delta = Counter()
+            for pk in updated:
+                annee = stats.depot_year(rows[pk][2])
+                delta[(annee, 'etat', rows[pk][0])] -= 1
+                delta[(annee, 'etat', cible)] += 1
+            stats.apply(delta)
+            # update() n'envoie pas post_save : événements publiés ici
+            encadrants = dict(
+                Stage.objects.filter(pk__in={rows[pk][1] for pk in updated})
+                .values_list('id', 'encadrant_id')
+            )
+            for pk in updated:
+                stage_id = rows[pk][1]
+                events.rapport_event('updated', pk, stage_id, encadrants.get(stage_id), cible)
+    return updated, rejected, encadrants
+
+
+def valider_rapports(ids):
+    # Mêmes règles que rapport_valider : tout rapport non validé, et son stage passe à Validé
+    with transaction.atomic(), stats.batch():
+        updated, rejected, encadrants = _transition(ids, lambda etat: etat != 'Validé', 'Validé', "Déjà validé.")
+        stages = list(
+            Stage.objects.select_for_update().filter(pk__in=encadrants).exclude(statut='Validé')
+            .values_list('id', 'date_debut', 'statut')
+        ) if encadrants else []
+        if stages:
+            Stage.objects.filter(pk__in=[pk for pk, _, _ in stages]).update(
+                statut='Validé', updated_at=timezone.now(), version=F('version') + 1)
+            transaction.on_commit(lambda: cache.bump_version(Stage))
+            delta = Counter()
+            for _, date_debut, statut in stages:
+                delta[(date_debut.year, 'statut', statut)] -= 1
+                delta[(date_debut.year, 'statut', 'Validé')] += 1
+            stats.apply(delta)
+            # Seuls les stages dont le statut a changé (pas ceux déjà validés)
+            for stage_id, _, _ in stages:
+                events.stage_event('updated', stage_id, encadrants[stage_id], 'Validé')
+    return updated, rejected
+
+
+def archiver_rapports(ids):
+    # Mêmes règles que rapport_archiver : seul un rapport Validé peut être archivé
+    updated, rejected, _ = _transition(
+        ids, lambda etat: etat == 'Validé', 'Archivé',
+        "Un rapport ne peut être archivé que s'il est Validé.",
+    )
+    return updated, rejected
+
+
+def _changer_statut(stages, statut, now):
+    """
+    Passe les `stages` (chargés sous verrou) à `statut` par un seul UPDATE.
+    Pas de post_save : compteurs de stages.stats, version du cache et
+    événements sont tenus ici, une fois par lot, comme dans valider_rapports.
+    Renvoie les ids.
+    """
+    Stage.objects.filter(pk__in=[stage.pk for stage in stages]).update(
+        statut=statut, updated_at=now, version=F('version') + 1)
+    transaction.on_commit(lambda: cache.bump_version(Stage))
+    delta = Counter()
+    for stage in stages:
+        delta[(stage.date_debut.year, 'statut', stage.statut)] -= 1
+        delta[(stage.date_debut.year, 'statut', statut)] += 1
+    stats.apply(delta)
+    for stage in stages:
+        events.stage_event('updated', stage.pk, stage.encadrant_id, statut)
+    return [stage.pk for stage in stages]
+
+
+def _par_lots(queryset, traiter):
+    """
+    Applique `traiter` aux stages de `queryset` par lots de
+    STAGES_STATUT_BATCH_SIZE, parcourus par clé (id croissant). Chaque lot
+    est chargé sous verrou et traité dans sa propre transaction : mémoire,
+    liste IN (...) et durée des verrous restent bornées. Renvoie les ids
+    renvoyés par `traiter`.
+    """
+    size = getattr(settings, 'STAGES_STATUT_BATCH_SIZE', 1000)
+    ids, last = [], 0
+    while True:
+        # Compteurs de stages.stats écrits une fois par lot
+        with transaction.atomic(), stats.batch():
+            lot = list(
+                queryset.select_for_update().filter(pk__gt=last)
+                .order_by('pk').defer('search_vector')[:size]
+            )
+            if lot:
+                ids += traiter(lot)
+        if len(lot) < size:
+            return ids
+        last = lot[-1].pk
+
+
+def terminer_stages_echus(today=None):
+    """
+    Passe à « Terminé » les stages « En cours » dont la date de fin est
+    dépassée, un UPDATE par lot (voir _par_lots) : un échec n'annule que
+    le lot en cours. Les stages validés ne sont jamais touchés. Renvoie
+    les ids.
+    """
+    today = today or date.today()
+    return _par_lots(
+        Stage.objects.filter(statut='En cours', date_fin__lt=today),
+        lambda lot: _changer_statut(lot, 'Terminé', timezone.now()),
+    )
+
+
+def recalculer_statuts(ids, today=None):
+    """
+    Remet le statut stocké des stages `ids` en accord avec leur date de fin
+    (Stage.get_statut_effectif) : « Terminé » après une prolongation redevient
+    « En cours », et inversement. Les stages validés ne sont jamais touchés.
+    `ids` peut être une sous-requête (values('pk')). Traité par lots (voir
+    _par_lots), un UPDATE par statut cible et par lot ; renvoie les ids
+    modifiés.
+    """
+    today = today or date.today()
+
+    def traiter(lot):
+        changes = {}
+        for stage in lot:
+            statut = stage.get_statut_effectif(today)
+            if statut != stage.statut:
+                changes.setdefault(statut, []).append(stage)
+        now = timezone.now()
+        return [pk for statut, group in changes.items() for pk in _changer_statut(group, statut, now)]
+
+    return _par_lots(Stage.objects.filter(pk__in=ids).exclude(statut='Validé'), traiter)